@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+"""
+Append-only archive of bunch snapshots for the pyORBIT ALCELI linac.
+
+The archive is one file with the snapshots as binary bunch dumps (see
+acBunchIO.py) one after the other and a footer with the index:
+
+    ARCHIVE_MAGIC | dump 1 | dump 2 | ... | JSON index | index length (uint64) | FOOTER_MAGIC
+
+The index has for every snapshot the node name, the position [m], the
+kinetic energy of the sync particle [GeV], the number of particles and
+the byte offset of the dump. A new snapshot overwrites the footer and
+writes it again behind itself, so the reader finds every snapshot with
+two small reads at the end of the file and memory-maps only the dumps
+(or the particles) it needs. If the footer is lost (e.g. a crash while
+writing) the index is rebuilt from the dump headers.
+
+With more than one MPI rank every rank writes its own particles to
+fileName.<rank>.
+
+Usage: python acBunchArchive.py snapshots.acb
+          lists the snapshots of the archive
+"""
+
+import os
+import sys
+import json
+import struct
+import argparse
+
+import numpy as np
+
+from acBunchIO import MAGIC, bunchHeader, bunchColumns, writeColumns, readHeader, loadBunch
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_ARCHIVE = DEBUG_OFF
+
+ARCHIVE_MAGIC = 'ACBARCH\x01'
+FOOTER_MAGIC  = 'ACBINDX\x01'
+FOOTER_LEN    = 8 + len(FOOTER_MAGIC)   # index length (uint64) and FOOTER_MAGIC
+
+def archiveFileName(fileName):
+    """
+    Returns the file name of the rank.
+    """
+    import orbit_mpi
+    comm = orbit_mpi.mpi_comm.MPI_COMM_WORLD
+    if orbit_mpi.MPI_Comm_size(comm) > 1:
+        return '{}.{}'.format(fileName,orbit_mpi.MPI_Comm_rank(comm))
+    return fileName
+
+def readIndex(file):
+    """
+    Returns (index, end) of the archive: the list of the snapshot entries and
+    the offset of the footer (where the next snapshot is written).
+    """
+    file.seek(0,os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    if file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+        raise ValueError('{} is no bunch archive'.format(file.name))
+    if size >= len(ARCHIVE_MAGIC) + FOOTER_LEN:
+        file.seek(size - FOOTER_LEN)
+        (index_len,) = struct.unpack('<Q',file.read(8))
+        if file.read(len(FOOTER_MAGIC)) == FOOTER_MAGIC:
+            end = size - FOOTER_LEN - index_len
+            file.seek(end)
+            return (json.loads(file.read(index_len)),end)
+    return scanIndex(file,size)
+
+def scanIndex(file, size):
+    """
+    Rebuilds the index from the dump headers of an archive without footer.
+    An incomplete last dump is dropped.
+    """
+    index = []
+    offset = len(ARCHIVE_MAGIC)
+    while offset + len(MAGIC) <= size:
+        try:
+            (header,data_offset) = readHeader(file,offset)
+        except ValueError:
+            break
+        end = data_offset + 8*header['nParticles']*len(header['columns'])
+        if end > size:
+            break
+        index.append(indexEntry(header,offset))
+        offset = end
+    print '-> index of {} rebuilt: {} snapshots'.format(file.name,len(index))
+    return (index,offset)
+
+def indexEntry(header, offset):
+    snapshot = header.get('snapshot',{})
+    return {
+        'node'       : snapshot.get('node'),
+        'position'   : snapshot.get('position'),
+        'kinEnergy'  : header['sync_kinEnergy'],
+        'nParticles' : header['nParticles'],
+        'offset'     : offset,
+        }
+
+class AcBunchArchive:
+    """
+    Writer of the bunch archive. An existing archive is continued. With
+    keepUntil [m] (e.g. the position of a restart) the snapshots behind it
+    are dropped, they are written again by the new tracking.
+    """
+    def __init__(self, fileName, append = True, keepUntil = None):
+        self.fileName = archiveFileName(fileName)
+        if append and os.path.exists(self.fileName):
+            self.file = open(self.fileName,'r+b')
+            (self.index,self.end) = readIndex(self.file)
+            if keepUntil != None:
+                self.truncate(keepUntil)
+        else:
+            dirName = os.path.dirname(self.fileName)
+            if dirName != '' and not os.path.isdir(dirName):
+                os.makedirs(dirName)
+            self.file = open(self.fileName,'w+b')
+            self.file.write(ARCHIVE_MAGIC)
+            self.index = []
+            self.end = self.file.tell()
+            self.writeFooter()
+
+    def truncate(self, position):
+        """
+        Drops the first snapshot behind the position [m] and all snapshots after it.
+        """
+        for (number,entry) in enumerate(self.index):
+            if entry['position'] > position:
+                print '-> {} snapshots behind {:.6f} [m] dropped from {}'.format(len(self.index)-number,position,self.fileName)
+                self.end = entry['offset']
+                self.index = self.index[:number]
+                self.writeFooter()
+                return
+
+    def writeFooter(self):
+        text = json.dumps(self.index)
+        self.file.seek(self.end)
+        self.file.write(text)
+        self.file.write(struct.pack('<Q',len(text)))
+        self.file.write(FOOTER_MAGIC)
+        self.file.truncate()
+        self.file.flush()
+
+    def write(self, bunch, node_name, position):
+        """
+        Appends the snapshot of the (local) bunch at the node and position [m].
+        """
+        header = bunchHeader(bunch)
+        header['snapshot'] = {'node':node_name, 'position':position}
+        self.file.seek(self.end)
+        offset = self.end
+        self.end += writeColumns(self.file,header,bunchColumns(bunch))
+        header['nParticles'] = bunch.getSize()
+        self.index.append(indexEntry(header,offset))
+        self.writeFooter()
+        DEBUG_ARCHIVE(__file__,lineno(),self.index[-1])
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+            print '-> {} snapshots in {}'.format(len(self.index),self.fileName)
+
+class AcSnapshotRecorder:
+    """
+    Writes snapshots to the archive during the tracking. It is an EXIT action
+    for the AccActionsContainer: a snapshot is written at the exit of the nodes
+    with the names and at the first node exit at or behind each of the
+    positions [m] (positions before start_position are skipped, e.g. at restarts).
+    """
+    def __init__(self, archive, names = (), positions = (), start_position = 0.):
+        self.archive = archive
+        self.names = set(names)
+        self.positions = sorted([pos for pos in positions if pos > start_position])
+
+    def __call__(self, paramsDict):
+        node = paramsDict["node"]
+        pos = node.getPosition() + node.getLength()/2.
+        take = node.getName() in self.names
+        while len(self.positions) > 0 and self.positions[0] <= pos:
+            self.positions.pop(0)
+            take = True
+        if take:
+            self.archive.write(paramsDict["bunch"],node.getName(),pos)
+
+class AcBunchArchiveReader:
+    """
+    Random access to the snapshots of the bunch archive.
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        with open(fileName,'rb') as file:
+            (self.index,end) = readIndex(file)
+
+    def __len__(self):
+        return len(self.index)
+
+    def find(self, node_name = None, position = None):
+        """
+        Returns the number of the (first) snapshot of the node or
+        of the snapshot nearest to the position [m].
+        """
+        if node_name != None:
+            for (number,entry) in enumerate(self.index):
+                if entry['node'] == node_name:
+                    return number
+            raise KeyError('no snapshot of node {} in {}'.format(node_name,self.fileName))
+        positions = np.array([entry['position'] for entry in self.index],dtype=float)
+        return int(np.argmin(np.abs(positions - position)))
+
+    def snapshot(self, number):
+        """
+        Returns (header, data) of the snapshot like acBunchIO.loadBunch():
+        data is the read-only np.memmap of shape (nColumns, nParticles).
+        """
+        return loadBunch(self.fileName,self.index[number]['offset'])
+
+    def particles(self, number, indices):
+        """
+        Returns the (len(indices), 6) array of (x,px,y,py,z,dE) of the
+        particles with the indices (array, slice or list) of the snapshot.
+        Only their pages of the file are read.
+        """
+        (header,data) = self.snapshot(number)
+        return np.array(data[:6,indices]).T
+
+def main():
+    parser = argparse.ArgumentParser(description = 'snapshots of the bunch archive')
+    parser.add_argument('archive', help = 'bunch archive file')
+    args = parser.parse_args()
+
+    reader = AcBunchArchiveReader(args.archive)
+    print ' {:>4}  {:20s} {:>12} {:>14} {:>10} {:>14}'.format('#','node','position[m]','kinEnergy[MeV]','particles','offset')
+    for (number,entry) in enumerate(reader.index):
+        print ' {:4d}  {:20s} {:12.6f} {:14.6f} {:10d} {:14d}'.format(
+            number,entry['node'],entry['position'],entry['kinEnergy']*1.e+3,entry['nParticles'],entry['offset'])
+
+if __name__ == '__main__':
+    main()
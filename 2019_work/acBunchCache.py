@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""
+Content addressed disk cache of the initial bunches of the pyORBIT ALCELI linac.
+
+AcLinacBunchGenerator.getBunch() with a seed gives the same particles for
+the same Twiss parameters, beam current, frequency, number of particles,
+distributor class, cut-off, seed and number of MPI ranks. The particles
+of the (rank local) bunch are stored as binary bunch dumps (see acBunchIO.py)
+in the cache directory, the file name is the SHA1 of these inputs:
+
+    cacheDir/bunch_<sha1>.acb
+
+A cache hit reads the columns into the bunch without running the
+distributor. The cache is bounded by maxBytes: a hit touches the file and
+after a new entry the least recently used files are removed.
+
+Usage: python acBunchCache.py bunch_cache
+          lists the cache entries
+"""
+
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+
+from acBunchIO import bunchHeader, bunchColumns, writeColumns, loadBunch
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_BUNCH_CACHE = DEBUG_OFF
+
+CACHE_VERSION = 1
+
+def distributionKey(params):
+    """
+    Returns the SHA1 of the dictionary of the inputs of the distribution.
+    """
+    params = dict(params)
+    params['cache_version'] = CACHE_VERSION
+    return hashlib.sha1(json.dumps(params,sort_keys=True)).hexdigest()
+
+class AcBunchCache:
+    """
+    LRU disk cache of the particle coordinates of bunches.
+    """
+    def __init__(self, cacheDir, maxBytes):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+
+    def fileName(self, key):
+        return os.path.join(self.cacheDir,'bunch_{}.acb'.format(key))
+
+    def entries(self):
+        """
+        Returns the list of (last use, size, file name) of the cache files, oldest first.
+        """
+        entries = []
+        if not os.path.isdir(self.cacheDir):
+            return entries
+        for name in os.listdir(self.cacheDir):
+            if not (name.startswith('bunch_') and name.endswith('.acb')):
+                continue
+            path = os.path.join(self.cacheDir,name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue    # removed by another process
+            entries.append((stat.st_mtime,stat.st_size,path))
+        return sorted(entries)
+
+    def load(self, key, bunch):
+        """
+        Adds the cached particles to the (empty) bunch. Returns False if the key is not cached.
+        """
+        fileName = self.fileName(key)
+        if not os.path.exists(fileName):
+            return False
+        try:
+            (header,data) = loadBunch(fileName)
+            coords = np.array(data[:6]).T.tolist()
+        except (IOError,OSError,ValueError) as error:
+            DEBUG_BUNCH_CACHE(__file__,lineno(),'bad cache entry {}: {}'.format(fileName,error))
+            return False
+        for (x,xp,y,yp,z,dE) in coords:
+            bunch.addParticle(x,xp,y,yp,z,dE)
+        try:
+            os.utime(fileName,None)     # last use
+        except OSError:
+            pass
+        DEBUG_BUNCH_CACHE(__file__,lineno(),'bunch cache hit {}'.format(fileName))
+        return True
+
+    def store(self, key, bunch):
+        """
+        Writes the particles of the bunch to the cache and evicts the least recently used entries.
+        """
+        fileName = self.fileName(key)
+        try:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            tmpName = '{}.{}.tmp'.format(fileName,os.getpid())
+            with open(tmpName,'wb') as file:
+                writeColumns(file,bunchHeader(bunch),bunchColumns(bunch))
+            os.rename(tmpName,fileName)
+        except (IOError,OSError) as error:
+            print '-> no bunch cache entry {}: {}'.format(fileName,error)
+            return
+        self.evict(fileName)
+
+    def evict(self, keep = None):
+        """
+        Removes the least recently used files (but not keep) until the cache has at most maxBytes.
+        """
+        entries = self.entries()
+        total = sum([size for (mtime,size,path) in entries])
+        for (mtime,size,path) in entries:
+            if total <= self.maxBytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            DEBUG_BUNCH_CACHE(__file__,lineno(),'bunch cache evicted {}'.format(path))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'entries of the bunch cache')
+    parser.add_argument('cacheDir', help = 'bunch cache directory')
+    args = parser.parse_args()
+
+    entries = AcBunchCache(args.cacheDir,0).entries()
+    for (mtime,size,path) in reversed(entries):
+        print ' {:50s} {:12d} {:>12}'.format(os.path.basename(path),size,int(mtime))
+    print ' {} entries, {} bytes'.format(len(entries),sum([size for (mtime,size,path) in entries]))
+
+if __name__ == '__main__':
+    main()
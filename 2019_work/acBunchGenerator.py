@@ -3,13 +3,18 @@
 #--------------------------------------------------------
 # The classes will generates bunches for pyORBIT ALCELI linac 
 # at the entrance of ALCELI Linac accelerator line (by default)
-# It is parallel, but it is not efficient.
+# With seed=None every rank draws all particles and keeps its share.
+# It is parallel, but it is not efficient. With a master seed every
+# rank draws only its own share from an independent random stream.
 #--------------------------------------------------------
 
 import math
 import sys
 import os
 import random
+import hashlib
+
+import numpy as np
 
 import orbit_mpi
 from orbit_mpi import mpi_comm
@@ -24,6 +29,9 @@ from orbit.bunch_generators import TwissAnalysis
 
 from bunch import Bunch
 
+from acDistributions import AcGaussDist3D, AcWaterBagDist3D, AcKVDist3D
+from acBunchCache import AcBunchCache, distributionKey
+
 # DEBUG
 from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
 
@@ -50,6 +58,8 @@ class AcLinacBunchGenerator:
 		self.beam_current = 38.0  # beam current in mA , design = 38 mA
 		self.rf_wave_lenght = self.c/self.bunch_frequency
 		self.si_e_charge = 1.6021773e-19
+		self.chunk_size = 1 << 17   # particles per array of the vectorized distributors
+		self.cache = None           # disk cache of the bunches with a seed
 		
 	def getKinEnergy(self):
 		"""
@@ -83,9 +93,52 @@ class AcLinacBunchGenerator:
 		"""
 		self.beam_current = current
 	
-	def getBunch(self, nParticles = 0, distributorClass = WaterBagDist3D, cut_off = -1.):
+	def setBunchCache(self, cacheDir = None, maxBytes = 500*2**20):
+		"""
+		Sets the directory of the bunch cache (see acBunchCache.py) bounded by
+		maxBytes. None switches the cache off.
+		"""
+		self.cache = None if cacheDir == None else AcBunchCache(cacheDir,maxBytes)
+		
+	def getCacheKey(self, nParticles, distributorClass, cut_off, seed, rank, size):
+		"""
+		Returns the key of the bunch cache for the inputs of the distribution.
+		"""
+		params = {
+			'twiss'       : [list(twiss.getAlphaBetaEmitt()) for twiss in self.twiss],
+			'kinEnergy'   : self.getKinEnergy(),
+			'mass'        : self.bunch.mass(),
+			'current'     : self.beam_current,
+			'frequency'   : self.bunch_frequency,
+			'nParticles'  : nParticles,
+			'distributor' : '{}.{}'.format(distributorClass.__module__,distributorClass.__name__),
+			'cut_off'     : cut_off,
+			'seed'        : seed,
+			'rank'        : rank,
+			'size'        : size,
+			'chunk_size'  : self.chunk_size,
+			}
+		return distributionKey(params)
+		
+	def getRankSeed(self, seed, rank):
+		"""
+		Returns the seed of the random stream of the rank derived from the master seed.
+		"""
+		return int(hashlib.sha1('{}:{}'.format(seed,rank)).hexdigest()[:16],16)
+		
+	def getRankShare(self, nParticles, rank, size):
+		"""
+		Returns the number of particles generated by the rank.
+		"""
+		return nParticles//size + (1 if rank < nParticles%size else 0)
+		
+	def getBunch(self, nParticles = 0, distributorClass = WaterBagDist3D, cut_off = -1., seed = None):
 		"""
 		Returns the pyORBIT bunch with particular number of particles.
+		If the master seed is given each rank generates only its own share
+		of the particles without MPI communication. The result is reproducible
+		for the same seed and the same number of ranks and is taken from the
+		bunch cache if there is one.
 		"""
 		comm = orbit_mpi.mpi_comm.MPI_COMM_WORLD
 		rank = orbit_mpi.MPI_Comm_rank(comm)
@@ -104,11 +157,36 @@ class AcLinacBunchGenerator:
 		else:
 			distributor = distributorClass(self.twiss[0],self.twiss[1],self.twiss[2], cut_off)
 		bunch.getSyncParticle().time(0.)	
-		for i in range(nParticles):
-			(x,xp,y,yp,z,dE) = distributor.getCoordinates()
-			(x,xp,y,yp,z,dE) = orbit_mpi.MPI_Bcast((x,xp,y,yp,z,dE),data_type,main_rank,comm)
-			if(i%size == rank):
+		key = None
+		if(self.cache != None and seed != None):
+			key = self.getCacheKey(nParticles,distributorClass,cut_off,seed,rank,size)
+		cached = key != None and self.cache.load(key,bunch)
+		if(cached):
+			DEBUG_BUNCH(__file__,lineno(), 'bunch from the cache: {}'.format(key))
+		elif(hasattr(distributor,'getCoordinatesArray')):
+			# vectorized distributors (acDistributions) are always rank local
+			if(seed == None):
+				seed = random.getrandbits(32)
+			rng = np.random.RandomState(self.getRankSeed(seed,rank) % 2**32)
+			nLocal = self.getRankShare(nParticles,rank,size)
+			for start in range(0,nLocal,self.chunk_size):
+				coords = distributor.getCoordinatesArray(min(self.chunk_size,nLocal-start),rng)
+				for (x,xp,y,yp,z,dE) in coords.tolist():
+					bunch.addParticle(x,xp,y,yp,z,dE)
+		elif(seed == None):
+			for i in range(nParticles):
+				(x,xp,y,yp,z,dE) = distributor.getCoordinates()
+				(x,xp,y,yp,z,dE) = orbit_mpi.MPI_Bcast((x,xp,y,yp,z,dE),data_type,main_rank,comm)
+				if(i%size == rank):
+					bunch.addParticle(x,xp,y,yp,z,dE)
+		else:
+			# the distributors draw from the random module
+			random.seed(self.getRankSeed(seed,rank))
+			for i in range(self.getRankShare(nParticles,rank,size)):
+				(x,xp,y,yp,z,dE) = distributor.getCoordinates()
 				bunch.addParticle(x,xp,y,yp,z,dE)
+		if(key != None and not cached):
+			self.cache.store(key,bunch)
 		nParticlesGlobal = bunch.getSizeGlobal()       #[macro-particles]
 		DEBUG_BUNCH(__file__,lineno(), 'nParticlesGlobal[macro-particles]= {}'.format(nParticlesGlobal))
 		bunch.macroSize(macrosize/nParticlesGlobal)    # [particles/macro-particle]
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+Binary columnar bunch dump format for the pyORBIT ALCELI linac.
+
+The text dumps made by bunch.dumpBunch() write one formatted line per
+particle. Here the file is a small header followed by the particle
+coordinates as contiguous columns of doubles:
+
+    MAGIC (8 bytes) | header length (uint32) | JSON header | padding | x | px | y | py | z | dE
+
+The JSON header carries the bunch and sync particle attributes (the
+'%' placeholder lines of the text dump), the number of particles, the
+column names and the byte order. The data block starts on an 8 byte
+boundary so that the reader can memory-map the columns with NumPy
+without copying them. The writer reads the particles of the bunch in
+blocks of BLOCK_SIZE, so only one block of a column is held in memory.
+
+With more than one MPI rank every rank writes its own particles to
+fileName.<rank>, dumpFileNames() returns the files of a dump.
+"""
+
+import os
+import sys
+import json
+import struct
+import array
+
+import numpy as np
+
+MAGIC   = 'ACBUNCH\x01'
+COLUMNS = ('x','px','y','py','z','dE')
+BLOCK_SIZE = 1 << 16    # particles per block written at once
+
+def _alignedOffset(offset, alignment = 8):
+    return (offset + alignment - 1)//alignment*alignment
+
+def bunchHeader(bunch):
+    """
+    Returns the dictionary with the bunch and sync particle attributes.
+    Units are the pyORBIT units: [m], [rad], [GeV], [GeV/c], [sec].
+    """
+    syncPart = bunch.getSyncParticle()
+    header = {
+        'charge'           : bunch.charge(),
+        'classical_radius' : bunch.classicalRadius(),
+        'macro_size'       : bunch.macroSize(),
+        'm0c2'             : bunch.mass(),
+        'sync_coords'      : [syncPart.x(),syncPart.y(),syncPart.z()],
+        'sync_momentum'    : [syncPart.px(),syncPart.py(),syncPart.pz()],
+        'sync_kinEnergy'   : syncPart.kinEnergy(),
+        'sync_beta'        : syncPart.beta(),
+        'sync_gamma'       : syncPart.gamma(),
+        'sync_time'        : syncPart.time(),
+        'part_attributes'  : list(bunch.getPartAttrNames()),
+        }
+    return header
+
+class BunchColumn:
+    """
+    Column of nParticles values of the accessor get(i) of the bunch (e.g.
+    bunch.x). tofile() writes it in blocks of BLOCK_SIZE values.
+    """
+    def __init__(self, get, nParticles):
+        self.get = get
+        self.nParticles = nParticles
+
+    def __len__(self):
+        return self.nParticles
+
+    def tofile(self, file):
+        for start in xrange(0,self.nParticles,BLOCK_SIZE):
+            stop = min(start + BLOCK_SIZE,self.nParticles)
+            array.array('d',map(self.get,xrange(start,stop))).tofile(file)
+
+def bunchColumns(bunch):
+    """
+    Returns the particle coordinates of the (local) bunch as a tuple of
+    BunchColumn in the order of COLUMNS.
+    """
+    nParticles = bunch.getSize()
+    return tuple([BunchColumn(get,nParticles) for get in (bunch.x,bunch.px,bunch.y,bunch.py,bunch.z,bunch.pz)])
+
+def writeColumns(file, header, columns, names = COLUMNS):
+    """
+    Writes header and columns (BunchColumn or array.array('d')) to an open
+    binary file at its current position. The first six columns are COLUMNS, further columns (e.g.
+    particle attributes) are named by names. Returns the number of bytes written.
+    """
+    header = dict(header)
+    header['nParticles'] = len(columns[0])
+    header['columns']    = list(names)
+    header['byteorder']  = sys.byteorder
+    text = json.dumps(header)
+    start = file.tell()
+    head_len = len(MAGIC) + 4 + len(text)
+    padding = _alignedOffset(start + head_len) - (start + head_len)
+    file.write(MAGIC)
+    file.write(struct.pack('<I',len(text) + padding))
+    file.write(text + ' '*padding)
+    for column in columns:
+        column.tofile(file)
+    return file.tell() - start
+
+def dumpBunchBinary(bunch, fileName):
+    """
+    Dumps the bunch in the binary columnar format. With more than
+    one MPI rank every rank writes its own particles to fileName.<rank>.
+    """
+    import orbit_mpi
+    comm = orbit_mpi.mpi_comm.MPI_COMM_WORLD
+    rank = orbit_mpi.MPI_Comm_rank(comm)
+    size = orbit_mpi.MPI_Comm_size(comm)
+    if size > 1:
+        fileName = '{}.{}'.format(fileName,rank)
+    columns = bunchColumns(bunch)
+    with open(fileName,'wb') as file:
+        writeColumns(file, bunchHeader(bunch), columns)
+    print '-> bunch with {} partcles dumped to {}'.format(len(columns[0]), fileName)
+
+def dumpFileNames(fileName):
+    """
+    Returns the list of the files of the dump: [fileName] or the files
+    fileName.0, fileName.1, ... of the MPI ranks.
+    """
+    if os.path.exists(fileName):
+        return [fileName]
+    names = []
+    while os.path.exists('{}.{}'.format(fileName,len(names))):
+        names.append('{}.{}'.format(fileName,len(names)))
+    if len(names) == 0:
+        raise IOError('no bunch dump {}'.format(fileName))
+    return names
+
+def isBinaryDump(fileName):
+    """
+    True if the file starts with the binary bunch dump MAGIC.
+    """
+    with open(fileName,'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+def readHeader(file, offset = 0):
+    """
+    Reads the header at offset of an open binary file.
+    Returns (header, data_offset).
+    """
+    file.seek(offset)
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError('no binary bunch dump at offset {} of {}'.format(offset,file.name))
+    (text_len,) = struct.unpack('<I',file.read(4))
+    header = json.loads(file.read(text_len))
+    return (header, offset + len(MAGIC) + 4 + text_len)
+
+def columnDtype(header):
+    return np.dtype('<f8') if header['byteorder'] == 'little' else np.dtype('>f8')
+
+def loadBunch(fileName, offset = 0):
+    """
+    Opens a binary bunch dump without copying the particle data.
+    Returns (header, data) where data is a read-only np.memmap of shape
+    (nColumns, nParticles) with rows in the order of header['columns'],
+    the first six are COLUMNS.
+    data[:6].T gives the (nParticles, 6) view of the text dump rows.
+    """
+    with open(fileName,'rb') as file:
+        (header, data_offset) = readHeader(file, offset)
+    nParticles = header['nParticles']
+    nColumns = len(header['columns'])
+    if nParticles == 0:
+        return (header, np.zeros((nColumns,0)))
+    data = np.memmap(fileName, dtype = columnDtype(header), mode = 'r',
+            offset = data_offset, shape = (nColumns,nParticles))
+    return (header, data)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+Bunch checkpoints for restarts of the pyORBIT ALCELI linac tracking.
+
+A checkpoint is a binary bunch dump (see acBunchIO.py) with the particle
+attributes as additional columns. Its JSON header carries, besides the
+bunch and sync particle attributes, the index and name of the node at
+which the tracking continues and the design state of the RF cavities and
+gaps (the result of trackDesignBunch()). A restart from a checkpoint
+needs neither the bunch generation nor the design tracking.
+
+With more than one MPI rank every rank writes and reads its own file
+fileName.<rank>, so a restart needs the same number of ranks.
+"""
+
+import os
+
+import orbit_mpi
+from bunch import Bunch
+
+from acBunchIO import COLUMNS, BunchColumn, bunchHeader, bunchColumns, writeColumns, loadBunch
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_CHECK = DEBUG_OFF
+
+CHECKPOINT_VERSION = 1
+
+def checkpointFileName(fileName):
+    """
+    Returns the file name of the rank.
+    """
+    comm = orbit_mpi.mpi_comm.MPI_COMM_WORLD
+    size = orbit_mpi.MPI_Comm_size(comm)
+    if size > 1:
+        return '{}.{}'.format(fileName,orbit_mpi.MPI_Comm_rank(comm))
+    return fileName
+
+def checkpointNodes(accLattice, names = (), sequenceEnds = False):
+    """
+    Returns the set of indices of the lattice nodes after which checkpoints
+    are written: the nodes with the names and the last nodes of the sequences.
+    """
+    names = set(names)
+    last_nodes = set()
+    if sequenceEnds:
+        for seq in accLattice.getSequences():
+            if len(seq.getNodes()) > 0:
+                last_nodes.add(seq.getNodes()[-1])
+    indices = set()
+    for (index,node) in enumerate(accLattice.getNodes()):
+        if node.getName() in names or node in last_nodes:
+            indices.add(index)
+    return indices
+
+def designState(accLattice):
+    """
+    Returns the design state of the RF cavities and gaps made by trackDesignBunch().
+    """
+    cavities = {}
+    for cav in accLattice.getRF_Cavities():
+        cavities[cav.getName()] = {
+            'amp'                           : cav.getAmp(),
+            'phase'                         : cav.getPhase(),
+            'designArrivalTime'             : cav.getDesignArrivalTime(),
+            'firstGapEtnrancePhase'         : cav.getFirstGapEtnrancePhase(),
+            'firstGapEtnranceDesignPhase'   : cav.getFirstGapEtnranceDesignPhase(),
+            'designSetUp'                   : cav.isDesignSetUp(),
+            }
+    gaps = {}
+    for gap in accLattice.getRF_Gaps():
+        gaps[gap.getName()] = gap.getParam("gap_phase")
+    return {'cavities':cavities, 'gaps':gaps}
+
+def setDesignState(accLattice, state):
+    """
+    Sets the design state of the RF cavities and gaps saved by designState().
+    The cavities are marked as set up, the RF gaps refuse to track otherwise.
+    """
+    for cav in accLattice.getRF_Cavities():
+        values = state['cavities'][cav.getName()]
+        cav.setAmp(values['amp'])
+        cav.setPhase(values['phase'])
+        cav.setDesignArrivalTime(values['designArrivalTime'])
+        cav.setFirstGapEtnrancePhase(values['firstGapEtnrancePhase'])
+        cav.setFirstGapEtnranceDesignPhase(values['firstGapEtnranceDesignPhase'])
+        cav.setDesignSetUp(values.get('designSetUp',True))
+    for gap in accLattice.getRF_Gaps():
+        gap.setParam("gap_phase",state['gaps'][gap.getName()])
+
+def saveCheckpoint(bunch, accLattice, node_index, fileName):
+    """
+    Writes the checkpoint of the bunch before the node with node_index.
+    The bunch is compressed (lost particles removed) before.
+    """
+    bunch.compress()
+    nodes = accLattice.getNodes()
+    header = bunchHeader(bunch)
+    header['checkpoint'] = {
+        'version'    : CHECKPOINT_VERSION,
+        'node_index' : node_index,
+        'node'       : nodes[node_index].getName() if node_index < len(nodes) else None,
+        'nNodes'     : len(nodes),
+        'ranks'      : orbit_mpi.MPI_Comm_size(orbit_mpi.mpi_comm.MPI_COMM_WORLD),
+        'design'     : designState(accLattice),
+        }
+    columns = list(bunchColumns(bunch))
+    names = list(COLUMNS)
+    nParticles = bunch.getSize()
+    for attr in bunch.getPartAttrNames():
+        for attr_index in range(bunch.getPartAttrSize(attr)):
+            get = lambda i, attr = attr, attr_index = attr_index: bunch.partAttrValue(attr,i,attr_index)
+            columns.append(BunchColumn(get,nParticles))
+            names.append('{}:{}'.format(attr,attr_index))
+    fileName = checkpointFileName(fileName)
+    dirName = os.path.dirname(fileName)
+    if dirName != '' and not os.path.isdir(dirName):
+        os.makedirs(dirName)
+    with open(fileName+'.tmp','wb') as file:
+        writeColumns(file, header, columns, names)
+    os.rename(fileName+'.tmp',fileName)
+    print '-> checkpoint with {} particles before node {} written to {}'.format(nParticles,header['checkpoint']['node'],fileName)
+
+def loadCheckpoint(fileName, accLattice):
+    """
+    Reads the checkpoint and sets the design state of the lattice.
+    Returns (bunch, node_index) to continue the tracking with the node node_index.
+    """
+    fileName = checkpointFileName(fileName)
+    (header,data) = loadBunch(fileName)
+    checkpoint = header['checkpoint']
+    nodes = accLattice.getNodes()
+    size = orbit_mpi.MPI_Comm_size(orbit_mpi.mpi_comm.MPI_COMM_WORLD)
+    node_index = checkpoint['node_index']
+    node_name = nodes[node_index].getName() if node_index < len(nodes) else None
+    if checkpoint['ranks'] != size:
+        raise ValueError('checkpoint {} was written by {} ranks, not {}'.format(fileName,checkpoint['ranks'],size))
+    if checkpoint['nNodes'] != len(nodes) or checkpoint['node'] != node_name:
+        raise ValueError('checkpoint {} does not fit the lattice: node {} expected at index {}'.format(fileName,checkpoint['node'],node_index))
+    setDesignState(accLattice,checkpoint['design'])
+
+    bunch = Bunch()
+    bunch.charge(header['charge'])
+    bunch.classicalRadius(header['classical_radius'])
+    bunch.mass(header['m0c2'])
+    bunch.macroSize(header['macro_size'])
+    syncPart = bunch.getSyncParticle()
+    syncPart.rVector(tuple(header['sync_coords']))
+    syncPart.pVector(tuple(header['sync_momentum']))
+    syncPart.time(header['sync_time'])
+    for (x,xp,y,yp,z,dE) in data[:len(COLUMNS)].T.tolist():
+        bunch.addParticle(x,xp,y,yp,z,dE)
+    names = header['columns']
+    for attr in [str(name) for name in header['part_attributes']]:
+        if not bunch.hasPartAttr(attr):
+            bunch.addPartAttr(attr)
+        for attr_index in range(bunch.getPartAttrSize(attr)):
+            row = names.index('{}:{}'.format(attr,attr_index))
+            for (i,value) in enumerate(data[row].tolist()):
+                bunch.partAttrValue(attr,i,attr_index,value)
+    DEBUG_CHECK(__file__,lineno(),'kinEnergy {} / {}'.format(syncPart.kinEnergy(),header['sync_kinEnergy']))
+    print '-> checkpoint with {} particles before node {} read from {}'.format(bunch.getSize(),checkpoint['node'],fileName)
+    return (bunch, node_index)
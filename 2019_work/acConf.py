@@ -9,11 +9,78 @@ CONF = {
     'bunchOut_filename'       : 'bunchf.dat'   ,
     'bunchIn_filename'        : 'bunchi.dat',
     'title'                   : 'pyALCELI',
+    # cache of the parsed lattice.xml (see AcLinacLatticeFactory), None: no cache
+    'lattice_cache_dir'       : 'lattice_cache',
+    # Superfish field tables (EzFile of the RF gaps, see acFieldTables.py)
+    'field_dir'               : '',     # directory of the EzFiles, '' or ending with '/'
+    'field_cache_dir'         : 'field_cache',
+    # replace BaseRF_Gap by AxisFieldRF_Gap nodes using the on-axis fields
+    'axisFieldGaps'           : False,
+    'axisField_z_step'        : 0.002,  # [m]
+    # TTF polynomials fitted to the on-axis fields (see acTTF.py) and RfGapTTF model
+    'fitTTFs'                 : False,
+    'ttf_order'               : 4,
+    'ttf_tolerance'           : 1.e-3,  # max. absolute fit error of T, S, T', S', None: no check
+    'ttf_cache_dir'           : 'ttf_cache',
+    # results of the design tracking keyed by the lattice, gap, cavity and
+    # injection settings (see acDesignCache.py), None: no cache
+    'design_cache_dir'        : 'design_cache',
+
+    # master seed for rank local bunch generation, None: broadcast every particle
+    'bunch_seed'              : 100,
+    'nParticles'              : 5000,   # macro particles of the bunch
+    # disk cache of the bunches with a seed (see acBunchCache.py), None: no cache
+    'bunch_cache_dir'         : 'bunch_cache',
+    'bunch_cache_max_mb'      : 500,    # least recently used bunches are removed above
 
     'dumpBunchIN'             : True,
     'dumpBunchOUT'            : True,
-#todo: twissplot
-    'twissPlot'               : False,  
+    # bunch dump format: 'text' (bunch.dumpBunch) or 'binary' (acBunchIO)
+    'dumpFormat'              : 'binary',
+    'twissPlot'               : True,
+    # twiss table (19 columns, see acDiagnostics.py) recorded during tracking
+    'twissDiagnostics'        : True,
+    'twiss_pos_step'          : 0.1,    # [m] min. distance between records
+    # 'particles': bunch tracking, 'envelope': linear sigma matrix tracking (see acEnvelope.py)
+    'trackingMode'            : 'particles',
+    'envelopeSpaceCharge'     : True,   # linear space charge of the envelope
+    # adaptive slicing (see acSlicing.py), e.g. {'minLength':0.01, 'maxLength':0.2,
+    # 'tolerance':0.01, 'scTolerance':0.05}, None: uniform slices of 0.01 m
+    'adaptiveSlicing'         : None,
+    # apertures of the quads and RF gaps ("aperture" params) and of the scrapers
+    # [(node name, x size [m], y size [m]), ...], the loss map (see acLosses.py)
+    'apertures'               : False,
+    'aperture_scrapers'       : [],
+    'loss_filename'           : 'losses.dat',
+    'loss_bin_length'         : 1.,     # [m]
+    # space charge nodes (see acSpaceCharge.py): None, '3dfft' (grid sc_grid) or
+    # 'ellipse' (sc_nEllipses uniformly charged ellipsoids), at least sc_minLength [m] apart
+    'spaceCharge'             : None,
+    'sc_grid'                 : (64,64,64),
+    'sc_nEllipses'            : 1,
+    'sc_minLength'            : 0.02,
+    # merge consecutive drifts and markers without children into single drifts,
+    # the twiss rows and position snapshots are only at the merged drift exits (warning)
+    'compactLattice'          : False,
+    # per node class/sequence timing of node.trackBunch (see acProfiler.py)
+    'profileTracking'         : False,
+    'profile_filename'        : 'profile.json',
+    # bunch snapshots at the nodes and at the first node exits behind the
+    # positions [m], appended to one archive file (see acBunchArchive.py)
+    'snapshot_nodes'          : [],
+    'snapshot_positions'      : [],
+    'snapshot_filename'       : 'snapshots.acb',
+    # result table of the parameter scans (see acScan.py)
+    'scan_filename'           : 'scan.dat',
+    # mean, std and percentiles of the twiss tables of the seeds (see acEnsemble.py)
+    'ensemble_filename'       : 'ensemble.dat',
+    # checkpoints of the bunch (see acCheckpoint.py) after the named nodes
+    # and/or the last nodes of the sequences, written to checkpoint_dir/<node>.chk
+    'checkpoint_nodes'        : [],
+    'checkpoint_sequence_ends': False,
+    'checkpoint_dir'          : 'checkpoints',
+    # restart the tracking from this checkpoint file, None: track from the injection
+    'restart_checkpoint'      : None,
 
     # display limits
     'ingnore_limits'          : False,
@@ -23,4 +90,10 @@ CONF = {
     'limyp'                   : 201,
     'limz'                    : 161,
     'limzp'                   : 121,
+    # phase space plots of acPlotit.py: 'density' (2D histograms of density_bins**2
+    # bins, cost independent of the number of particles) or 'scatter' (every particle)
+    'phaseSpacePlot'          : 'density',
+    'density_bins'            : 200,
+    # density plots: particles in bins with at most outlier_count particles as points, 0: none
+    'outlier_count'           : 0,
     }
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+Cache of the design tracking of the pyORBIT ALCELI linac.
+
+accLattice.trackDesignBunch() tracks the sync particle to set the arrival
+times and phases of the RF cavities and the phases of the RF gaps. For the
+same lattice, gap and cavity settings and injection the result is always
+the same. trackDesign() keeps it in the cache directory as
+
+    cacheDir/design_<fingerprint>.json
+
+with the design state of acCheckpoint.designState() and the sync particle
+(kinetic energy [GeV], time [sec]) and the phase [rad] at the exit of
+every RF gap. A cache hit sets the design state on the nodes without
+tracking. The fingerprint is the SHA1 of the node classes, names and
+lengths, the RF gap params (but not "gap_phase", it is made by the
+design tracking), the integration step and field extent of the
+AxisFieldRF_Gaps and TTF polynomials, the gap models, the cavity
+amplitudes, phases and frequencies, the field tables (size and mtime)
+and the sync particle of the bunch, so any change gives a new entry.
+"""
+
+import os
+import json
+import hashlib
+
+from orbit.lattice import AccActionsContainer
+
+from acCheckpoint import designState, setDesignState
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_DESIGN = DEBUG_OFF
+
+DESIGN_CACHE_VERSION = 3
+DESIGN_OUTPUT_PARAMS = ("gap_phase",)   # gap params set by the design tracking
+# attributes (not params) of the AxisFieldRF_Gap nodes: integration step and field extent
+AXIS_FIELD_ATTRIBUTES = ("z_step","z_min","z_max","z_tolerance","phase_tolerance")
+
+def fingerprintValue(value):
+    """
+    Returns the JSON value of a node param for the fingerprint.
+    """
+    if value == None or isinstance(value,(bool,int,long,float,basestring)):
+        return value
+    if isinstance(value,(list,tuple)):
+        return [fingerprintValue(item) for item in value]
+    if isinstance(value,dict):
+        return dict((str(key),fingerprintValue(item)) for (key,item) in value.items())
+    if hasattr(value,'getName'):
+        return value.getName()
+    return value.__class__.__name__
+
+def fieldTableStamp(fileName, dir_location = ''):
+    """
+    Returns [size, mtime] of the field table or None if there is none.
+    """
+    path = dir_location+fileName
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size,stat.st_mtime]
+
+def designFingerprint(accLattice, bunch, dir_location = ''):
+    """
+    Returns the fingerprint of the lattice, gap and cavity settings and
+    the sync particle of the bunch for the design tracking.
+    """
+    syncPart = bunch.getSyncParticle()
+    nodes = [[node.__class__.__name__,node.getName(),node.getLength()] for node in accLattice.getNodes()]
+    gaps = []
+    for gap in accLattice.getRF_Gaps():
+        params = gap.getParamsDict()
+        params = dict((key,fingerprintValue(value)) for (key,value) in params.items() if key not in DESIGN_OUTPUT_PARAMS)
+        if "EzFile" in params and isinstance(params["EzFile"],basestring):
+            params["EzFile_stamp"] = fieldTableStamp(params["EzFile"],dir_location)
+        polynomials = []
+        if hasattr(gap,'getTTF_Polynimials'):
+            for poly in gap.getTTF_Polynimials():
+                polynomials.append([poly.coefficient(index) for index in range(poly.order()+1)])
+        axis_field = [fingerprintValue(getattr(gap,name,None)) for name in AXIS_FIELD_ATTRIBUTES]
+        gaps.append([gap.getName(),gap.getCppGapModel().__class__.__name__,params,polynomials,axis_field])
+    cavities = [[cav.getName(),cav.getAmp(),cav.getPhase(),cav.getFrequency()] for cav in accLattice.getRF_Cavities()]
+    injection = [bunch.mass(),bunch.charge(),syncPart.kinEnergy(),syncPart.time()]
+    sha = hashlib.sha1()
+    sha.update(json.dumps([DESIGN_CACHE_VERSION,nodes,gaps,cavities,injection],sort_keys=True))
+    return sha.hexdigest()
+
+class AcDesignRecorder:
+    """
+    Records the sync particle at the exit of the RF gaps during the design
+    tracking: {gap name: [kinEnergy [GeV], time [sec], gap phase [rad]]}.
+    """
+    def __init__(self, accLattice):
+        self.gaps = set(accLattice.getRF_Gaps())
+        self.sync = {}
+
+    def __call__(self, paramsDict):
+        node = paramsDict["node"]
+        if node not in self.gaps:
+            return
+        syncPart = paramsDict["bunch"].getSyncParticle()
+        self.sync[node.getName()] = [syncPart.kinEnergy(),syncPart.time(),node.getParam("gap_phase")]
+
+def trackDesign(accLattice, bunch, cacheDir = None, dir_location = ''):
+    """
+    Sets the design state of the lattice for the bunch, from the cache if
+    possible, otherwise by trackDesignBunch(). Returns the dictionary of the
+    sync particle at the RF gaps of AcDesignRecorder.
+    None as cacheDir switches the cache off.
+    """
+    fileName = None
+    if cacheDir != None:
+        fingerprint = designFingerprint(accLattice,bunch,dir_location)
+        fileName = os.path.join(cacheDir,'design_{}.json'.format(fingerprint))
+        if os.path.exists(fileName):
+            try:
+                with open(fileName,'r') as file:
+                    entry = json.load(file)
+                setDesignState(accLattice,entry['design'])
+                DEBUG_DESIGN(__file__,lineno(),'design cache hit {}'.format(fileName))
+                return entry['sync']
+            except (IOError,ValueError,KeyError) as error:
+                print '-> bad design cache entry {}: {}'.format(fileName,error)
+    recorder = AcDesignRecorder(accLattice)
+    actionsContainer = AccActionsContainer("Design Tracking")
+    actionsContainer.addAction(recorder, AccActionsContainer.EXIT)
+    accLattice.trackDesignBunch(bunch, paramsDict = {}, actionContainer = actionsContainer)
+    if fileName == None:
+        return recorder.sync
+    try:
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        tmpName = '{}.{}.tmp'.format(fileName,os.getpid())
+        with open(tmpName,'w') as file:
+            json.dump({'design':designState(accLattice), 'sync':recorder.sync},file)
+        os.rename(tmpName,fileName)
+    except (IOError,OSError) as error:
+        print '-> no design cache entry {}: {}'.format(fileName,error)
+    return recorder.sync
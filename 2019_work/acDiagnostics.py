@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""
+Diagnostics for the pyORBIT ALCELI linac bunch tracking.
+
+AcTwissRecorder is an action for the AccActionsContainer. At the exit
+of the nodes it analyzes the bunch with the C++ BunchTwissAnalysis
+(no python loops over particles) and appends one row to the twiss table.
+The table has the 19 whitespace separated columns that are read by
+py3_utils/PandaPlotter.py and acPlotit.py.
+"""
+
+import os
+import math
+
+import orbit_mpi
+from bunch import BunchTwissAnalysis
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_DIAG = DEBUG_OFF
+
+TWISS_COLUMNS = [
+    'Node','position',
+    'alphaX','betaX','emittX','normEmittX',
+    'alphaY','betaY','emittY','normEmittY',
+    'alphaZ','betaZ','emittZ','emittZphiMeV',
+    'sizeX','sizeY','sizeZ_deg',
+    'eKin','Nparts']
+
+def nodeExitPosition(node):
+    """
+    Returns the position of the node exit in the lattice in [m].
+    """
+    return node.getPosition() + node.getLength()/2.
+
+def bunchTwiss(bunch, bunch_gen, twiss_analysis = None):
+    """
+    Analyzes the bunch (collective for MPI) and returns the dictionary with
+    the values of the TWISS_COLUMNS[2:] in the units of AcTwissRecorder.
+    """
+    if twiss_analysis == None:
+        twiss_analysis = BunchTwissAnalysis()
+    twiss_analysis.analyzeBunch(bunch)
+    twiss = [twiss_analysis.getTwiss(i) for i in range(3)]
+    return twissValues([(alpha,beta,emitt) for (alpha,beta,gamma,emitt) in twiss],
+        bunch.getSyncParticle(),bunch_gen.getZtoPhaseCoeff(bunch),bunch.getSizeGlobal())
+
+def twissValues(twiss, syncPart, z_to_phase_coeff, nParts):
+    """
+    Returns the dictionary with the values of the TWISS_COLUMNS[2:] for the
+    (alpha,beta,emittance) of X, Y, Z in pyORBIT units.
+    """
+    gamma = syncPart.gamma()
+    beta  = syncPart.beta()
+    ((alphaX,betaX,emittX),(alphaY,betaY,emittY),(alphaZ,betaZ,emittZ)) = twiss
+    x_rms = math.sqrt(betaX*emittX)*1.e+3     # [mm]
+    y_rms = math.sqrt(betaY*emittY)*1.e+3     # [mm]
+    z_rms = math.sqrt(betaZ*emittZ)*1.e+3     # [mm]
+    z_rms_deg = z_to_phase_coeff*z_rms/1.e+3  # [deg]
+    emittX *= 1.e+6                           # [mm*mrad]
+    emittY *= 1.e+6                           # [mm*mrad]
+    phi_de_emittZ = z_to_phase_coeff*emittZ*1.e+3  # [deg*MeV]
+    emittZ *= 1.e+6                           # [mm*MeV]
+    return {
+        'alphaX':alphaX, 'betaX':betaX, 'emittX':emittX, 'normEmittX':emittX*gamma*beta,
+        'alphaY':alphaY, 'betaY':betaY, 'emittY':emittY, 'normEmittY':emittY*gamma*beta,
+        'alphaZ':alphaZ, 'betaZ':betaZ, 'emittZ':emittZ, 'emittZphiMeV':phi_de_emittZ,
+        'sizeX':x_rms, 'sizeY':y_rms, 'sizeZ_deg':z_rms_deg,
+        'eKin':syncPart.kinEnergy()*1.e+3,    # [MeV]
+        'Nparts':nParts}
+
+def formatTwissRow(name, pos, twiss):
+    """
+    Returns the twiss table row (without end of line) for the bunchTwiss() dictionary.
+    """
+    s  = ' %s  %10.6f '%(name,pos)
+    s += '  %g  %g  %g  %g '%tuple(twiss[c] for c in TWISS_COLUMNS[2:6])
+    s += '  %g  %g  %g  %g '%tuple(twiss[c] for c in TWISS_COLUMNS[6:10])
+    s += '  %g  %g  %g  %g '%tuple(twiss[c] for c in TWISS_COLUMNS[10:14])
+    s += '  %g  %g  %g '%tuple(twiss[c] for c in TWISS_COLUMNS[14:17])
+    s += '  %10.6f  %d'%(twiss['eKin'],twiss['Nparts'])
+    return s
+
+class AcTwissRecorder:
+    """
+    Records Twiss parameters, rms sizes and kinetic energy of the bunch
+    during the tracking. A row is written if the node passes nodeFilter
+    (default: all nodes) and the bunch moved at least paramsDict["pos_step"]
+    since the last row. Units: beta in [m] ([m/GeV] for Z), emittances in
+    [mm*mrad] ([mm*MeV] for Z, [deg*MeV] for emittZphiMeV), sizes in [mm]
+    and [deg], eKin in [MeV].
+    With append an existing table is continued like AcBunchArchive. With
+    keepUntil [m] (e.g. the position of a restart) the rows behind it are
+    dropped, they are written again by the new tracking.
+    """
+    def __init__(self, fileName, bunch_gen, nodeFilter = None, append = False, keepUntil = None):
+        self.fileName = fileName
+        self.bunch_gen = bunch_gen
+        self.nodeFilter = nodeFilter
+        self.twiss_analysis = BunchTwissAnalysis()
+        comm = orbit_mpi.mpi_comm.MPI_COMM_WORLD
+        self.rank = orbit_mpi.MPI_Comm_rank(comm)
+        self.file = None
+        self.nRows = 0
+        if self.rank == 0:
+            if append and os.path.exists(fileName):
+                self.file = open(fileName,'r+')
+                self.truncate(keepUntil)
+            else:
+                self.file = open(fileName,'w')
+                self.file.write(' '.join(TWISS_COLUMNS)+'\n')
+
+    def truncate(self, position):
+        """
+        Drops the rows of the existing table behind the position [m] (None: none)
+        and moves to its end. A table with other columns is started again.
+        """
+        header = self.file.readline()
+        if header.split() != TWISS_COLUMNS:
+            print '-> {} is no twiss table, it is written again'.format(self.fileName)
+            self.file.seek(0)
+            self.file.truncate()
+            self.file.write(' '.join(TWISS_COLUMNS)+'\n')
+            return
+        (kept,dropped) = (0,0)
+        while True:
+            offset = self.file.tell()
+            line = self.file.readline()
+            if line == '':
+                break
+            if position != None and float(line.split()[1]) > position:
+                dropped = sum(1 for line in self.file) + 1
+                self.file.seek(offset)
+                self.file.truncate()
+                break
+            kept += 1
+        if dropped > 0:
+            print '-> {} twiss rows behind {:.6f} [m] dropped from {}'.format(dropped,position,self.fileName)
+        self.file.seek(0,os.SEEK_END)
+        self.nRows = kept
+
+    def __call__(self, paramsDict):
+        node = paramsDict["node"]
+        if self.nodeFilter != None and not self.nodeFilter(node):
+            return
+        pos = nodeExitPosition(node)
+        if paramsDict["old_pos"] == pos: return
+        if paramsDict["old_pos"] + paramsDict["pos_step"] > pos: return
+        paramsDict["old_pos"] = pos
+        paramsDict["count"] += 1
+        self.record(node.getName(),pos,paramsDict["bunch"])
+
+    def record(self, name, pos, bunch):
+        """
+        Analyzes the bunch and appends one row to the twiss table.
+        All ranks have to call it because the analysis is collective.
+        """
+        twiss = bunchTwiss(bunch, self.bunch_gen, self.twiss_analysis)
+        if self.file == None:
+            return
+        self.file.write(formatTwissRow(name, pos, twiss)+'\n')
+        self.nRows += 1
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+            print '-> {} twiss records in {}'.format(self.nRows,self.fileName)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+Vectorized 3D distribution generators for the pyORBIT ALCELI linac.
+
+They take the same TwissContainer X, Y, Z triplets (and cut_off) as
+GaussDist3D, WaterBagDist3D and KVDist3D from orbit.bunch_generators,
+but draw whole (nParticles,6) arrays of (x,xp,y,yp,z,dE) with NumPy
+instead of one tuple per getCoordinates() call.
+AcLinacBunchGenerator.getBunch() uses getCoordinatesArray() when the
+distributor class has it.
+
+The emittances in the TwissContainers are rms emittances. The normalized
+coordinates (u,up) of every plane have unit variance and are transformed by
+    x  = sqrt(beta*emittance)*u
+    xp = sqrt(emittance/beta)*(up - alpha*u)
+"""
+
+import math
+
+import numpy as np
+
+def twissTransform(twiss, u, up):
+    """
+    Transforms the normalized coordinates u,up (arrays) to x,xp.
+    """
+    (alpha,beta,emittance) = twiss.getAlphaBetaEmitt()
+    x  = math.sqrt(beta*emittance)*u
+    xp = math.sqrt(emittance/beta)*(up - alpha*u)
+    return (x,xp)
+
+class AcDist3D:
+    """
+    The base class of the vectorized 3D distributions. The subclasses
+    implement getNormalizedArray(nParticles, rng).
+    """
+    def __init__(self, twissX, twissY, twissZ, cut_off = -1.):
+        self.twiss = (twissX, twissY, twissZ)
+        self.cut_off = cut_off
+        self.rng = np.random
+
+    def getNormalizedArray(self, nParticles, rng):
+        """
+        Returns the (6,nParticles) array of normalized coordinates.
+        """
+        raise NotImplementedError
+
+    def getCoordinatesArray(self, nParticles, rng = None):
+        """
+        Returns the (nParticles,6) array of (x,xp,y,yp,z,dE).
+        rng is a np.random.RandomState, by default the global NumPy generator.
+        """
+        if rng == None:
+            rng = self.rng
+        u = self.getNormalizedArray(nParticles, rng)
+        coords = np.empty((nParticles,6))
+        for plane in range(3):
+            (coords[:,2*plane],coords[:,2*plane+1]) = twissTransform(self.twiss[plane],u[2*plane],u[2*plane+1])
+        return coords
+
+    def getCoordinates(self):
+        """
+        Returns one tuple (x,xp,y,yp,z,dE) like the orbit.bunch_generators classes.
+        """
+        return tuple(self.getCoordinatesArray(1)[0])
+
+class AcGaussDist3D(AcDist3D):
+    """
+    Gaussian distribution. If cut_off > 0 every normalized coordinate is
+    limited to |u| < cut_off (in sigma) by drawing again.
+    """
+    def getNormalizedArray(self, nParticles, rng):
+        u = rng.standard_normal((6,nParticles))
+        if self.cut_off > 0.:
+            outside = np.abs(u) >= self.cut_off
+            nOutside = np.count_nonzero(outside)
+            while nOutside > 0:
+                u[outside] = rng.standard_normal(nOutside)
+                outside = np.abs(u) >= self.cut_off
+                nOutside = np.count_nonzero(outside)
+        return u
+
+class AcWaterBagDist3D(AcDist3D):
+    """
+    Uniform distribution inside the 6D hyper-ellipsoid. cut_off is not used.
+    """
+    def getNormalizedArray(self, nParticles, rng):
+        u = rng.standard_normal((6,nParticles))
+        u /= np.sqrt(np.sum(u*u,axis=0))
+        # radius of the uniform 6D ball and <u**2> = 1 for every coordinate
+        u *= math.sqrt(8.)*rng.random_sample(nParticles)**(1./6.)
+        return u
+
+class AcKVDist3D(AcDist3D):
+    """
+    KV distribution: uniform on the surface of the 6D hyper-ellipsoid. cut_off is not used.
+    """
+    def getNormalizedArray(self, nParticles, rng):
+        u = rng.standard_normal((6,nParticles))
+        u *= math.sqrt(6.)/np.sqrt(np.sum(u*u,axis=0))
+        return u
@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+
+"""
+This script runs an ensemble of the ALCELI Linac tracking with N seeds.
+
+Every seed generates its own bunch of the same configuration (lattice,
+injection, current, number of particles) and records the twiss table of
+acDiagnostics.AcTwissRecorder (rows at the same node exits for all seeds).
+The tables are reduced to the mean, the standard deviation and the
+percentiles of every column at every row as the seeds finish. The
+statistics are streamed: Welford's algorithm for the mean and the standard
+deviation and the P-square algorithm (Jain and Chlamtac) for the percentiles,
+so the memory does not grow with the number of seeds.
+
+Every worker process builds the lattice once, like acScan.py. The bunches
+of the seeds are used once and do not go into the bunch cache.
+
+Usage: ./START.sh acEnsemble.py 1 --seeds 50 --workers 8 --nParticles 5000 --out ensemble.dat
+"""
+
+import os
+import time
+import argparse
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from orbit.lattice import AccActionsContainer
+
+from acLinac import makeLattice, getInjectionParams, makeBunchGenerator, simulinacRoot
+from acDistributions import AcGaussDist3D
+from acDiagnostics import AcTwissRecorder, TWISS_COLUMNS, bunchTwiss
+from acDesignCache import trackDesign
+from acConf import CONF
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+DEBUG_ENSEMBLE = DEBUG_OFF
+
+STAT_COLUMNS = TWISS_COLUMNS[2:]
+
+EXACT_SAMPLES = 50     # seeds kept for exact percentiles before the P-square estimation
+
+class AcStreamStats:
+    """
+    Streamed statistics of arrays of the same shape: mean, standard
+    deviation (Welford) and percentiles (P-square, 5 markers per percentile).
+    The percentiles of the first EXACT_SAMPLES samples are exact, the markers
+    are initialized from them.
+    """
+    def __init__(self, percentiles = (5.,50.,95.)):
+        self.percentiles = list(percentiles)
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.first = []     # the first EXACT_SAMPLES samples
+        self.q = None       # marker heights [percentile][marker] + shape
+        self.n = None       # marker positions
+        self.np = None      # desired marker positions
+        self.dn = None      # increments of the desired marker positions
+
+    def add(self, values):
+        values = np.asarray(values,dtype=float)
+        self.count += 1
+        if self.mean is None:
+            self.mean = np.zeros_like(values)
+            self.m2 = np.zeros_like(values)
+        delta = values - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(values - self.mean)
+        if self.count <= EXACT_SAMPLES:
+            self.first.append(values)
+            return
+        if self.q == None:
+            self._initMarkers()
+        for i in range(len(self.percentiles)):
+            self._updateMarkers(i,values)
+
+    def _initMarkers(self):
+        first = np.sort(np.array(self.first),axis=0)
+        self.first = []
+        last = len(first) - 1
+        self.q = []
+        self.n = []
+        self.np = []
+        self.dn = []
+        for p in self.percentiles:
+            p = p/100.
+            desired = np.array([0.,p/2.,p,(1.+p)/2.,1.])*last
+            # distinct marker positions
+            positions = [int(round(pos)) for pos in desired]
+            for k in range(1,4):
+                positions[k] = max(positions[k],positions[k-1]+1)
+            for k in range(3,-1,-1):
+                positions[k] = min(positions[k],positions[k+1]-1)
+            self.q.append(first[positions].copy())
+            self.n.append(np.ones(first.shape)[:5]*np.array(positions,dtype=float).reshape((5,)+(1,)*(first.ndim-1)))
+            self.np.append(desired)
+            self.dn.append(np.array([0.,p/2.,p,(1.+p)/2.,1.]))
+
+    def _updateMarkers(self, i, x):
+        (q,n) = (self.q[i],self.n[i])
+        q[0] = np.minimum(q[0],x)
+        q[4] = np.maximum(q[4],x)
+        # marker positions above x move by one
+        for k in range(1,5):
+            n[k] += (x < q[k]) | (k == 4)
+        self.np[i] = self.np[i] + self.dn[i]
+        for k in (1,2,3):
+            d = self.np[i][k] - n[k]
+            up = (d >= 1.) & (n[k+1] - n[k] > 1.)
+            down = (d <= -1.) & (n[k-1] - n[k] < -1.)
+            move = up | down
+            if not np.any(move):
+                continue
+            d = np.where(up,1.,-1.)
+            parabolic = q[k] + d/(n[k+1] - n[k-1])*(
+                (n[k] - n[k-1] + d)*(q[k+1] - q[k])/(n[k+1] - n[k]) +
+                (n[k+1] - n[k] - d)*(q[k] - q[k-1])/(n[k] - n[k-1]))
+            (q_d,n_d) = (np.where(up,q[k+1],q[k-1]),np.where(up,n[k+1],n[k-1]))
+            linear = q[k] + d*(q_d - q[k])/(n_d - n[k])
+            new_q = np.where((q[k-1] < parabolic) & (parabolic < q[k+1]),parabolic,linear)
+            q[k] = np.where(move,new_q,q[k])
+            n[k] = np.where(move,n[k] + d,n[k])
+
+    def std(self):
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return np.sqrt(self.m2/(self.count - 1))
+
+    def percentile(self, i):
+        if self.count <= EXACT_SAMPLES:
+            return np.percentile(np.array(self.first),self.percentiles[i],axis=0)
+        return self.q[i][2]
+
+class AcTwissCollector(AcTwissRecorder):
+    """
+    AcTwissRecorder that keeps the rows (name, position, twiss) in memory.
+    """
+    def __init__(self, bunch_gen):
+        AcTwissRecorder.__init__(self, os.devnull, bunch_gen)
+        self.rows = []
+
+    def record(self, name, pos, bunch):
+        self.rows.append((name, pos, bunchTwiss(bunch, self.bunch_gen, self.twiss_analysis)))
+
+# the lattice and the injection of the worker process
+ensemble_lattice = None
+
+def initWorker(names, xml_file_name):
+    """
+    Builds the lattice once per worker process.
+    """
+    global ensemble_lattice
+    (accLattice,acc_da) = makeLattice(names,xml_file_name)
+    ensemble_lattice = (accLattice,getInjectionParams(acc_da))
+
+def runSeed(task):
+    """
+    Tracks the bunch of the seed. Returns (seed, names, positions, table) with
+    the (rows, STAT_COLUMNS) array table of the twiss rows.
+    """
+    (seed,nParticles,current) = task
+    (accLattice,injection) = ensemble_lattice
+    bunch_gen = makeBunchGenerator(injection, current = current)
+    bunch_gen.setBunchCache(None)   # every seed is used once, keep the cache for the fixed bunches
+    bunch = bunch_gen.getBunch(nParticles = nParticles, distributorClass = AcGaussDist3D, seed = seed)
+    accLattice.setLinacTracker(switch=True)
+    trackDesign(accLattice,bunch,CONF['design_cache_dir'],CONF['field_dir'])
+    accLattice.setLinacTracker(switch=False)    # use TeapotBase (TPB) tracking
+    collector = AcTwissCollector(bunch_gen)
+    collector.record('START',0.,bunch)
+    actionsContainer = AccActionsContainer("Ensemble Tracking")
+    actionsContainer.addAction(collector, AccActionsContainer.EXIT)
+    paramsDict = {"old_pos":-1.,"count":0,"pos_step":CONF['twiss_pos_step']}
+    accLattice.trackBunch(bunch, paramsDict=paramsDict, actionContainer=actionsContainer)
+    table = np.array([[twiss[column] for column in STAT_COLUMNS] for (name,pos,twiss) in collector.rows])
+    DEBUG_ENSEMBLE(__file__,lineno(),'seed {}: {} rows'.format(seed,len(table)))
+    return (seed,[name for (name,pos,twiss) in collector.rows],[pos for (name,pos,twiss) in collector.rows],table)
+
+def writeEnsemble(fileName, names, positions, stats):
+    """
+    Writes the table with the mean, std and percentiles of the STAT_COLUMNS per row.
+    """
+    percentile_names = ['p{:g}'.format(p) for p in stats.percentiles]
+    columns = ['Node','position']
+    for column in STAT_COLUMNS:
+        columns += [column+'_'+stat for stat in ['mean','std']+percentile_names]
+    values = [stats.mean,stats.std()] + [stats.percentile(i) for i in range(len(stats.percentiles))]
+    with open(fileName,'w') as file:
+        file.write(' '.join(columns)+'\n')
+        for (row,(name,pos)) in enumerate(zip(names,positions)):
+            s = ' %s  %10.6f '%(name,pos)
+            s += ' '.join(['%g'%value[row,col] for col in range(len(STAT_COLUMNS)) for value in values])
+            file.write(s+'\n')
+
+def main():
+    parser = argparse.ArgumentParser(description = 'ALCELI Linac ensemble of seeds')
+    parser.add_argument('--seeds',      default = 10, type = int,       help = 'number of seeds')
+    parser.add_argument('--first',      default = CONF['bunch_seed'], type = int, help = 'first seed')
+    parser.add_argument('--workers',    default = multiprocessing.cpu_count(), type = int, help = 'number of worker processes')
+    parser.add_argument('--nParticles', default = CONF['nParticles'], type = int, help = 'macro particles per seed')
+    parser.add_argument('--current',    default = 10., type = float,    help = 'beam current [mA]')
+    parser.add_argument('--percentiles',default = '5,50,95',            help = 'comma separated percentiles')
+    parser.add_argument('--out',        default = CONF['ensemble_filename'], help = 'result table')
+    parser.add_argument('--lattice',    default = None,                  help = 'lattice XML file, default: $SIMULINAC_ROOT/lattice.xml')
+    parser.add_argument('--sequences',  default = 'S25to200',            help = 'comma separated sequence names')
+    args = parser.parse_args()
+
+    names = args.sequences.split(',')
+    xml_file_name = args.lattice if args.lattice != None else simulinacRoot+"/lattice.xml"
+    tasks = [(seed,args.nParticles,args.current) for seed in range(args.first,args.first+args.seeds)]
+    print "-> {} seeds with {} workers".format(args.seeds,args.workers)
+
+    time_start = time.time()
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, initWorker, (names,xml_file_name))
+        results = pool.imap_unordered(runSeed,tasks)
+    else:
+        pool = None
+        initWorker(names,xml_file_name)
+        results = itertools.imap(runSeed,tasks)
+    stats = AcStreamStats([float(p) for p in args.percentiles.split(',')])
+    (row_names,positions) = (None,None)
+    for (seed,seed_names,seed_positions,table) in results:
+        if positions == None:
+            (row_names,positions) = (seed_names,seed_positions)
+        elif seed_positions != positions:
+            raise ValueError('seed {}: the twiss rows differ from the other seeds'.format(seed))
+        stats.add(table)
+        print "-> seed {} done ({}/{}): T-final[MeV] {:.6f}".format(seed,stats.count,args.seeds,table[-1,STAT_COLUMNS.index('eKin')])
+    if pool != None:
+        pool.close()
+        pool.join()
+    writeEnsemble(args.out,row_names,positions,stats)
+    print "-> ensemble of {} seeds written to {} in {:4.2f} [sec]".format(stats.count,args.out,time.time()-time_start)
+
+if __name__ == '__main__':
+    main()
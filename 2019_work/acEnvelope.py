@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+"""
+Linear envelope tracking for the pyORBIT ALCELI linac.
+
+The 6x6 sigma matrix of the bunch in the pyORBIT coordinates
+(x[m], xp[rad], y[m], yp[rad], z[m], dE[GeV]) is propagated by the
+linear maps of the lattice nodes:
+    Drift (and every other node with a length)  drift with the z-dE slip
+    Quad                                        thick quadrupole
+    Bend                                        sector dipole with dispersion
+    BaseRF_Gap                                  thin gap kicks like MatrixRfGap
+                                                with adiabatic damping
+With a beam current the linear space charge kick of the uniform ellipsoid
+with the rms sizes of the sigma matrix (like TRACE3D) is applied at the
+exit of every node with a length, so the result depends on the slicing.
+The synchronous particle (energy, gap phases) is tracked by pyORBIT's
+trackDesignBunch(), the maps are made in its ENTRANCE and EXIT actions of
+the top level nodes. No macro-particles are tracked.
+
+The envelope is written in the twiss table format of acDiagnostics.py
+(Nparts = 0).
+"""
+
+import math
+
+import numpy as np
+
+import orbit_mpi
+from bunch import Bunch
+from orbit.lattice import AccActionsContainer
+from orbit.py_linac.lattice import Quad, Bend, BaseRF_Gap
+
+from acDiagnostics import TWISS_COLUMNS, twissValues, formatTwissRow, nodeExitPosition
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_ENV = DEBUG_OFF
+
+CLIGHT = 2.99792458e+8      # [m/sec]
+COULOMB = 8.9875517873681764e+9  # 1/(4*pi*eps0) [V*m/C]
+
+def sigmaFromTwiss(twiss):
+    """
+    Returns the block diagonal sigma matrix for the (alpha,beta,emittance) of X, Y, Z.
+    """
+    sigma = np.zeros((6,6))
+    for (plane,(alpha,beta,emitt)) in enumerate(twiss):
+        i = 2*plane
+        sigma[i:i+2,i:i+2] = emitt*np.array([[beta,-alpha],[-alpha,(1.+alpha**2)/beta]])
+    return sigma
+
+def twissFromSigma(sigma):
+    """
+    Returns the rms (alpha,beta,emittance) of X, Y, Z of the sigma matrix.
+    """
+    twiss = []
+    for plane in range(3):
+        i = 2*plane
+        emitt = math.sqrt(max(np.linalg.det(sigma[i:i+2,i:i+2]),0.))
+        if emitt > 0.:
+            twiss.append((-sigma[i,i+1]/emitt,sigma[i,i]/emitt,emitt))
+        else:
+            twiss.append((0.,0.,0.))
+    return twiss
+
+def driftMatrix(length, beta, gamma, mass):
+    """
+    Drift of length [m]. z is shifted by the velocity difference of dE.
+    """
+    m = np.identity(6)
+    m[0,1] = m[2,3] = length
+    m[4,5] = length/(beta**2*gamma**3*mass)
+    return m
+
+def quadMatrix(length, kq, beta, gamma, mass):
+    """
+    Thick quad with kq = charge*(dB/dr)/(B*rho) [1/m**2], focusing in x for kq > 0.
+    """
+    m = driftMatrix(length, beta, gamma, mass)
+    if kq == 0. or length == 0.:
+        return m
+    sk = math.sqrt(abs(kq))
+    phi = sk*length
+    foc = np.array([[math.cos(phi),math.sin(phi)/sk],[-sk*math.sin(phi),math.cos(phi)]])
+    defoc = np.array([[math.cosh(phi),math.sinh(phi)/sk],[sk*math.sinh(phi),math.cosh(phi)]])
+    (m[0:2,0:2],m[2:4,2:4]) = (foc,defoc) if kq > 0. else (defoc,foc)
+    return m
+
+def bendMatrix(length, theta, beta, gamma, mass):
+    """
+    Sector dipole with the bending angle theta [rad] in the horizontal plane.
+    """
+    m = driftMatrix(length, beta, gamma, mass)
+    if theta == 0. or length == 0.:
+        return m
+    rho = length/theta
+    (c,s) = (math.cos(theta),math.sin(theta))
+    delta = 1./(beta**2*gamma*mass)       # dp/p per dE
+    m[0:2,0:2] = [[c,rho*s],[-s/rho,c]]
+    m[0,5] = rho*(1.-c)*delta
+    m[1,5] = s*delta
+    # z ahead of the sync particle: longer path is behind
+    m[4,0] = -s
+    m[4,1] = -rho*(1.-c)
+    m[4,5] = (length/gamma**2 - rho*(theta - s))*delta
+    return m
+
+def rfGapMatrix(E0TL, phase, frequency, syncIn, syncOut, mass):
+    """
+    Thin RF gap: longitudinal and transverse kicks of the gap with the
+    amplitude E0TL [GeV] at the phase [rad] and the adiabatic damping from
+    syncIn = (beta,gamma) to syncOut.
+    """
+    (beta_in,gamma_in) = syncIn
+    (beta_out,gamma_out) = syncOut
+    beta  = (beta_in + beta_out)/2.
+    gamma = (gamma_in + gamma_out)/2.
+    wave_length = CLIGHT/frequency
+    kick = np.identity(6)
+    # dE kick of the phase difference -2*pi*z/(beta*lambda)
+    kick[5,4] = E0TL*math.sin(phase)*2.*math.pi/(beta*wave_length)
+    kick[1,0] = kick[3,2] = -math.pi*E0TL*math.sin(phase)/(mass*beta**3*gamma**3*wave_length)
+    damping = np.identity(6)
+    damping[1,1] = damping[3,3] = (beta_in*gamma_in)/(beta_out*gamma_out)
+    damping[4,4] = beta_out/beta_in
+    return np.dot(damping,kick)
+
+def ellipsoidFormFactor(p):
+    """
+    Returns the form factor f of the uniform spheroid with the aspect
+    ratio p = rz/sqrt(rx*ry) in the rest frame of the bunch.
+    """
+    if abs(p - 1.) < 1.e-6:
+        return 1./3.
+    if p > 1.:
+        return (p/math.sqrt(p**2 - 1.)*math.acosh(p) - 1.)/(p**2 - 1.)
+    return (1. - p/math.sqrt(1. - p**2)*math.acos(p))/(1. - p**2)
+
+def spaceChargeMatrix(sigma, length, charge, beta, gamma, mass):
+    """
+    Linear space charge kick for the length [m] of the uniform ellipsoid
+    with the bunch charge [C] and the rms sizes of the sigma matrix.
+    """
+    m = np.identity(6)
+    (rx,ry,rz) = [math.sqrt(5.*max(sigma[i,i],0.)) for i in (0,2,4)]
+    if charge == 0. or length == 0. or rx*ry*rz == 0.:
+        return m
+    rz *= gamma                           # rest frame
+    f = ellipsoidFormFactor(rz/math.sqrt(rx*ry))
+    field = 3.*COULOMB*charge*1.e-9       # [GV*m]
+    # rest frame fields, the magnetic force cancels 1-beta**2 of the lab frame field
+    m[1,0] = field*(1.-f)/(rx*(rx+ry)*rz)*length/(mass*beta**2*gamma**2)
+    m[3,2] = field*(1.-f)/(ry*(rx+ry)*rz)*length/(mass*beta**2*gamma**2)
+    m[5,4] = field*f/(rx*ry*rz)*gamma*length
+    return m
+
+class AcEnvelopeTracker:
+    """
+    Propagates the sigma matrix through the lattice during trackDesignBunch().
+    Rows of the twiss table are written at the exits of the top level nodes
+    at least pos_step apart. bunch_charge [C] switches the space charge on.
+    """
+    def __init__(self, accLattice, sigma, phase_coeff, pos_step = 0.1, bunch_charge = 0.):
+        self.accLattice = accLattice
+        self.sigma = sigma
+        self.phase_coeff = phase_coeff      # 360/lambda [deg/m]
+        self.pos_step = pos_step
+        self.bunch_charge = bunch_charge
+        self.nodes = set(accLattice.getNodes())
+        self.rows = []
+        self.old_pos = -1.
+        self.syncIn = None
+        self.last_exit = None
+
+    def twiss(self, syncPart):
+        """
+        Returns the twissValues() dictionary of the envelope.
+        """
+        z_to_phase_coeff = self.phase_coeff/syncPart.beta()
+        return twissValues(twissFromSigma(self.sigma),syncPart,z_to_phase_coeff,0)
+
+    def nodeMatrix(self, node, bunch):
+        syncPart = bunch.getSyncParticle()
+        mass = bunch.mass()
+        (beta_in,gamma_in) = self.syncIn
+        length = node.getLength()
+        if isinstance(node,Quad):
+            momentum = beta_in*gamma_in*mass                                   # [GeV/c]
+            kq = bunch.charge()*node.getParam("dB/dr")/(momentum/0.299792458)  # B*rho in [T*m]
+            return quadMatrix(length,kq,beta_in,gamma_in,mass)
+        if isinstance(node,Bend):
+            return bendMatrix(length,node.getParam("theta"),beta_in,gamma_in,mass)
+        if isinstance(node,BaseRF_Gap):
+            cav = node.getRF_Cavity()
+            E0TL = abs(bunch.charge())*node.getParam("E0TL")*cav.getAmp()
+            return rfGapMatrix(E0TL,node.getParam("gap_phase"),cav.getFrequency(),
+                self.syncIn,(syncPart.beta(),syncPart.gamma()),mass)
+        return driftMatrix(length,beta_in,gamma_in,mass)
+
+    def entrance(self, paramsDict):
+        if paramsDict["node"] in self.nodes:
+            syncPart = paramsDict["bunch"].getSyncParticle()
+            self.syncIn = (syncPart.beta(),syncPart.gamma())
+
+    def exit(self, paramsDict):
+        node = paramsDict["node"]
+        if node not in self.nodes:
+            return
+        bunch = paramsDict["bunch"]
+        m = self.nodeMatrix(node,bunch)
+        self.sigma = np.dot(np.dot(m,self.sigma),m.T)
+        if self.bunch_charge != 0. and node.getLength() > 0.:
+            syncPart = bunch.getSyncParticle()
+            m = spaceChargeMatrix(self.sigma,node.getLength(),self.bunch_charge,syncPart.beta(),syncPart.gamma(),bunch.mass())
+            self.sigma = np.dot(np.dot(m,self.sigma),m.T)
+        self.last_exit = (node,bunch)
+        pos = nodeExitPosition(node)
+        if pos >= self.old_pos + self.pos_step:
+            self.old_pos = pos
+            self.rows.append((node.getName(),pos,self.twiss(bunch.getSyncParticle())))
+
+    def track(self, design_bunch):
+        """
+        Tracks the design particle of the bunch and the envelope through the lattice.
+        Returns the design bunch at the exit.
+        """
+        container = AccActionsContainer("Envelope Tracking")
+        container.addAction(self.entrance, AccActionsContainer.ENTRANCE)
+        container.addAction(self.exit, AccActionsContainer.EXIT)
+        bunch = Bunch()
+        design_bunch.copyEmptyBunchTo(bunch)
+        self.rows = [('START',0.,self.twiss(bunch.getSyncParticle()))]
+        self.old_pos = 0.
+        self.last_exit = None
+        self.accLattice.trackDesignBunch(bunch, paramsDict = {}, actionContainer = container)
+        (node,bunch) = self.last_exit
+        if self.old_pos != nodeExitPosition(node):
+            self.rows.append((node.getName(),nodeExitPosition(node),self.twiss(bunch.getSyncParticle())))
+        return bunch
+
+    def write(self, fileName):
+        """
+        Writes the twiss table (rank 0 only).
+        """
+        if orbit_mpi.MPI_Comm_rank(orbit_mpi.mpi_comm.MPI_COMM_WORLD) != 0:
+            return
+        with open(fileName,'w') as file:
+            file.write(' '.join(TWISS_COLUMNS)+'\n')
+            for (name,pos,twiss) in self.rows:
+                file.write(formatTwissRow(name,pos,twiss)+'\n')
+        print '-> {} envelope records written to {}'.format(len(self.rows),fileName)
+
+def makeEnvelopeTracker(accLattice, bunch_gen, pos_step = 0.1, spaceCharge = False, trackerClass = AcEnvelopeTracker):
+    """
+    Returns the envelope tracker for the Twiss, the energy and (with
+    spaceCharge) the beam current of the bunch generator.
+    """
+    twiss = [twiss.getAlphaBetaEmitt() for twiss in bunch_gen.twiss]
+    # getZtoPhaseCoeff() is 360/(beta*lambda) at the injection energy
+    phase_coeff = bunch_gen.getZtoPhaseCoeff(bunch_gen.bunch)*bunch_gen.bunch.getSyncParticle().beta()
+    bunch_charge = 0.
+    if spaceCharge:
+        bunch_charge = bunch_gen.getBeamCurrent()*1.e-3/bunch_gen.bunch_frequency   # [C]
+    return trackerClass(accLattice,sigmaFromTwiss(twiss),phase_coeff,pos_step,bunch_charge)
+
+def trackEnvelope(accLattice, bunch_gen, fileName, pos_step = 0.1, spaceCharge = False):
+    """
+    Tracks the envelope of the bunch generator Twiss through the lattice
+    and writes the twiss table. Returns the AcEnvelopeTracker.
+    """
+    tracker = makeEnvelopeTracker(accLattice,bunch_gen,pos_step,spaceCharge)
+    tracker.track(bunch_gen.bunch)
+    tracker.write(fileName)
+    return tracker
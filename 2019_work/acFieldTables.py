@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""
+Superfish field tables (*.TBL) for the pyORBIT ALCELI linac.
+
+A TBL file has a preamble (Title, Titles ... EndTitles, AxisLabels, ...)
+and the table between Data and EndData with the columns
+    Z [cm]  R [cm]  Ez [MV/m]  Er [MV/m]  |E| [MV/m]  H [A/m]
+The loader converts Z and R to [m] and extracts the on-axis Ez(z) (R = 0).
+Tables of half cavities starting at z = 0 (like SF_WDK2g44.TBL) are
+mirrored to the full gap.
+
+The on-axis field is cached as a small binary NumPy file keyed by the SHA1
+of the TBL file, so the tables are parsed only once for all runs and ranks.
+addAxisFieldsToStore() puts the fields of the EzFile params of the RF gaps
+into the RF_AxisFieldsStore of pyORBIT, where
+Replace_BaseRF_Gap_to_AxisField_Nodes() finds them without reading files.
+
+Usage: python acFieldTables.py SF_WDK2g44.TBL [--out SF_WDK2g44.dat]
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+
+import numpy as np
+
+from acConf import CONF
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_FIELD = DEBUG_OFF
+
+FIELD_CACHE_VERSION = 1
+
+# unit conversion of the TBL columns to [m], [MV/m] and [A/m]
+TBL_UNITS = {'Z':1.e-2, 'R':1.e-2, 'Ez':1., 'Er':1., '|E|':1., 'H':1.}
+
+def readTBL(fileName):
+    """
+    Parses the Superfish TBL file. Returns the dictionary of the
+    columns (np.arrays) named by the Titles, Z and R in [m].
+    """
+    titles = []
+    rows = []
+    section = None
+    with open(fileName,'r') as file:
+        for line in file:
+            text = line.strip()
+            if text in ('Titles','Data'):
+                section = text
+            elif text in ('EndTitles','EndData'):
+                section = None
+            elif section == 'Titles' and text != '':
+                titles.append(text)
+            elif section == 'Data' and text != '' and not text.startswith(';'):
+                rows.append([float(value) for value in text.split()])
+    if len(rows) == 0:
+        raise ValueError('no Data in the field table {}'.format(fileName))
+    data = np.array(rows)
+    if len(titles) != data.shape[1]:
+        titles = ['Z','R','Ez','Er','|E|','H'][:data.shape[1]]
+    columns = {}
+    for (index,title) in enumerate(titles):
+        columns[title] = data[:,index]*TBL_UNITS.get(title,1.)
+    return columns
+
+def axisField(columns, symmetric = True):
+    """
+    Returns the arrays (z [m], Ez [MV/m]) on the axis (R = 0), sorted by z.
+    With symmetric a half cavity table starting at z = 0 is mirrored.
+    """
+    on_axis = columns['R'] == 0.
+    z  = columns['Z'][on_axis]
+    Ez = columns['Ez'][on_axis]
+    order = np.argsort(z)
+    (z,Ez) = (z[order],Ez[order])
+    if symmetric and z[0] == 0.:
+        z  = np.concatenate((-z[:0:-1],z))
+        Ez = np.concatenate((Ez[:0:-1],Ez))
+    return (z,Ez)
+
+def fieldCacheFileName(fileName, symmetric, cacheDir):
+    """
+    Returns the cache file name for the content of the TBL file.
+    """
+    sha = hashlib.sha1(repr((FIELD_CACHE_VERSION,symmetric)))
+    with open(fileName,'rb') as file:
+        sha.update(file.read())
+    return os.path.join(cacheDir,'Ez_{}.npy'.format(sha.hexdigest()))
+
+def loadAxisField(fileName, symmetric = True, cacheDir = None):
+    """
+    Returns the arrays (z [m], Ez [MV/m]) of the TBL file from the cache
+    or parses the file and writes the cache.
+    """
+    if cacheDir == None:
+        return axisField(readTBL(fileName),symmetric)
+    cacheName = fieldCacheFileName(fileName,symmetric,cacheDir)
+    if os.path.exists(cacheName):
+        DEBUG_FIELD(__file__,lineno(),'field cache hit {}'.format(cacheName))
+        field = np.load(cacheName)
+        return (field[0],field[1])
+    (z,Ez) = axisField(readTBL(fileName),symmetric)
+    if not os.path.isdir(cacheDir):
+        try:
+            os.makedirs(cacheDir)
+        except OSError:
+            pass    # made by another rank
+    tmpName = '{}.{}.tmp'.format(cacheName,os.getpid())
+    with open(tmpName,'wb') as file:
+        np.save(file,np.array((z,Ez)))
+    os.rename(tmpName,cacheName)
+    return (z,Ez)
+
+def isFieldTable(fileName):
+    return fileName.upper().endswith('.TBL')
+
+def addAxisFieldsToStore(accLattice, dir_location = '', symmetric = True, cacheDir = None):
+    """
+    Puts the on-axis fields of the TBL files of the RF gaps (EzFile params)
+    as orbit_utils Functions into RF_AxisFieldsStore under the name
+    dir_location+EzFile used by Replace_BaseRF_Gap_to_AxisField_Nodes().
+    Returns the number of field tables.
+    """
+    from orbit_utils import Function
+    from orbit.py_linac.lattice import RF_AxisFieldsStore
+    if cacheDir == None:
+        cacheDir = CONF['field_cache_dir']
+    fl_names = set()
+    for rf_gap in accLattice.getRF_Gaps():
+        if rf_gap.hasParam("EzFile") and isFieldTable(rf_gap.getParam("EzFile")):
+            fl_names.add(dir_location+rf_gap.getParam("EzFile"))
+    for fl_name in sorted(fl_names):
+        if fl_name in RF_AxisFieldsStore.static_element_dict:
+            continue
+        (z,Ez) = loadAxisField(fl_name,symmetric,cacheDir)
+        function = Function()
+        for (z_i,Ez_i) in zip(z.tolist(),Ez.tolist()):
+            function.add(z_i,Ez_i)
+        function.setConstStep(1)
+        RF_AxisFieldsStore.static_element_dict[fl_name] = function
+    return len(fl_names)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Superfish TBL on-axis field')
+    parser.add_argument('tbl',                                      help = 'Superfish TBL file')
+    parser.add_argument('--out',       default = None,              help = 'two column z[m] Ez[MV/m] text file')
+    parser.add_argument('--half',      action = 'store_true',       help = 'do not mirror half cavity tables')
+    parser.add_argument('--cacheDir',  default = CONF['field_cache_dir'], help = 'field cache directory')
+    args = parser.parse_args()
+
+    (z,Ez) = loadAxisField(args.tbl,not args.half,args.cacheDir)
+    print '-> {}: {} points on axis, z= {:.6f} .. {:.6f} [m], max|Ez|= {:.6g} [MV/m]'.format(
+        args.tbl,len(z),z[0],z[-1],np.max(np.abs(Ez)))
+    if args.out != None:
+        np.savetxt(args.out,np.column_stack((z,Ez)),fmt = '%.8e')
+        print '-> on-axis field written to {}'.format(args.out)
+
+if __name__ == '__main__':
+    main()
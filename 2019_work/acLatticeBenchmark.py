@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+
+"""
+This script measures how the AcLinacLatticeFactory scales with the size of the lattice.
+
+It writes synthetic lattice XML files in the SIMULINAC schema with the
+requested numbers of elements (QUAD, BEND, RFGAP with Cavities, DCH, DCV
+and markers), builds the lattices and reports the build time of every
+phase of the factory: XML parsing, reading the records, node creation,
+thin node insertion, sorting, drift insertion and initialize().
+The results are written to a JSON file. If a baseline file is given
+the times are compared with it.
+
+Usage: ./START.sh acLatticeBenchmark.py 1 --sizes 100,1000,10000 --baseline lattice_bench.json
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+
+from acLatticeFactory import AcLinacLatticeFactory
+
+PHASES = ['xml_parse','read_records','node_creation','thin_nodes','sort','drifts','initialize']
+
+def makeSyntheticLatticeXml(nElements, fileName, seqName = 'SYNTH'):
+    """
+    Writes a lattice XML file with nElements accElements in one sequence.
+    The lattice is made of 1 m cells with 10 elements each:
+    QUAD with DCH and DCV inside, marker, BEND, two RFGAPs of one cavity,
+    marker, QUAD and DCV behind it.
+    """
+    ttfs = ('<TTFs beta_max="0.9" beta_min="0.1">'
+            '<polyT order="2" pcoefs="0.8 0.1 -0.05"/><polyS order="2" pcoefs="0.0 0.05 0.01"/>'
+            '<polyTP order="2" pcoefs="0.1 -0.1 0.0"/><polySP order="2" pcoefs="0.05 0.01 0.0"/></TTFs>')
+    elements = []
+    cavities = []
+    nCells = (nElements + 9)//10
+    for cell in range(nCells):
+        s = float(cell)
+        cav_name = 'CAV{}'.format(cell)
+        cavities.append('<Cavity ampl="1.0" frequency="816.e+6" name="{}" pos="{:.6f}"/>'.format(cav_name,s+0.65))
+        def quad(name, pos, field):
+            return '<accElement length="0.1" name="{}" pos="{:.6f}" type="QUAD"><parameters field="{}" aperture="0.01" aprt_type="1"/></accElement>'.format(name,pos,field)
+        def thin(name, pos, type):
+            params = '<parameters effLength="0.02" B="0.0"/>' if type in ('DCH','DCV') else '<parameters/>'
+            return '<accElement length="0.0" name="{}" pos="{:.6f}" type="{}">{}</accElement>'.format(name,pos,type,params)
+        def gap(name, pos):
+            return ('<accElement length="0.0" name="{}" pos="{:.6f}" type="RFGAP">'.format(name,pos)+
+                    '<parameters E0L="0.0012" E0TL="0.001" EzFile="SF_WDK2g44.TBL" cavity="{}" mode="0" phase="-20." aperture="0.01" aprt_type="1"/>'.format(cav_name)+
+                    ttfs+'</accElement>')
+        cell_elements = [
+            quad('QF{}'.format(cell),s+0.10,40.),
+            thin('DCH{}'.format(cell),s+0.09,'DCH'),
+            thin('DCV{}'.format(cell),s+0.11,'DCV'),
+            thin('MA{}'.format(cell),s+0.25,'MARKER'),
+            '<accElement length="0.2" name="B{}" pos="{:.6f}" type="BEND"><parameters ea1="0.0" ea2="0.0" theta="0.001"/></accElement>'.format(cell,s+0.40),
+            gap('G{}a'.format(cell),s+0.60),
+            gap('G{}b'.format(cell),s+0.70),
+            thin('MB{}'.format(cell),s+0.80,'MARKER'),
+            quad('QD{}'.format(cell),s+0.90,-40.),
+            thin('DCV{}b'.format(cell),s+0.97,'DCV'),
+            ]
+        elements += cell_elements[:nElements - 10*cell]
+    with open(fileName,'w') as file:
+        file.write('<ALCELI>\n')
+        file.write('<PARAMS injection_energy="70." proton_mass="938.272" frequenz="816.e+6" clight="299792458."/>\n')
+        file.write('<{} length="{:.6f}">\n'.format(seqName,float(nCells)))
+        file.write('<Cavities>\n'+'\n'.join(cavities)+'\n</Cavities>\n')
+        file.write('\n'.join(elements)+'\n')
+        file.write('</{}>\n</ALCELI>\n'.format(seqName))
+
+def benchmark(nElements, maxDriftLength, workDir, repeat = 1):
+    """
+    Returns the best of repeat build times of every phase for a synthetic lattice.
+    """
+    fileName = os.path.join(workDir,'synth_{}.xml'.format(nElements))
+    makeSyntheticLatticeXml(nElements,fileName)
+    best = None
+    for count in range(repeat):
+        factory = AcLinacLatticeFactory()
+        factory.setMaxDriftLength(maxDriftLength)
+        phaseTimes = {}
+        factory.setPhaseTimes(phaseTimes)
+        time_start = time.time()
+        (lattice,acc_da) = factory.getLinacAccLattice(['SYNTH'],fileName)
+        phaseTimes['total'] = time.time() - time_start
+        phaseTimes['nodes'] = len(lattice.getNodes())
+        if best == None or phaseTimes['total'] < best['total']:
+            best = phaseTimes
+    return best
+
+def report(results, baseline = None):
+    """
+    Returns the results (and the ratios result/baseline) as a table in a string.
+    """
+    columns = PHASES + ['total']
+    s = '{:>8} {:>8} '.format('elements','nodes')+' '.join(['{:>13}'.format(c) for c in columns])+'\n'
+    for key in sorted(results['sizes'], key = int):
+        result = results['sizes'][key]
+        s += '{:>8} {:>8} '.format(key,result['nodes'])+' '.join(['{:>13.4f}'.format(result.get(c,0.)) for c in columns])+'\n'
+        if baseline != None and key in baseline['sizes']:
+            base = baseline['sizes'][key]
+            def ratio(c):
+                return '{:>13}'.format('x{:.2f}'.format(result.get(c,0.)/base[c]) if base.get(c,0.) > 0. else '-')
+            s += '{:>8} {:>8} '.format('','vs base')+' '.join([ratio(c) for c in columns])+'\n'
+    return s
+
+def main():
+    parser = argparse.ArgumentParser(description = 'AcLinacLatticeFactory scaling benchmark')
+    parser.add_argument('--sizes',    default = '100,1000,10000,100000', help = 'comma separated numbers of elements')
+    parser.add_argument('--maxDrift', default = 0.01, type = float,    help = 'maximal drift length [m]')
+    parser.add_argument('--repeat',   default = 1, type = int,         help = 'best of repeat builds')
+    parser.add_argument('--out',      default = 'lattice_bench.json',  help = 'results file')
+    parser.add_argument('--baseline', default = None,                  help = 'results file to compare with')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline != None and os.path.exists(args.baseline):
+        with open(args.baseline,'r') as file:
+            baseline = json.load(file)
+        if baseline['maxDriftLength'] != args.maxDrift:
+            print '-> baseline {} was made with maxDriftLength {}'.format(args.baseline,baseline['maxDriftLength'])
+
+    results = {'maxDriftLength':args.maxDrift, 'sizes':{}}
+    workDir = tempfile.mkdtemp(prefix = 'acLatticeBench')
+    try:
+        for nElements in [int(n) for n in args.sizes.split(',')]:
+            results['sizes'][str(nElements)] = benchmark(nElements,args.maxDrift,workDir,args.repeat)
+            print '-> {} elements done in {:.3f} [sec]'.format(nElements,results['sizes'][str(nElements)]['total'])
+    finally:
+        shutil.rmtree(workDir)
+    print report(results,baseline)
+    with open(args.out,'w') as file:
+        json.dump(results,file,indent = 1,sort_keys = True)
+    print '-> results written to {}'.format(args.out)
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,10 @@ import os
 import sys
 import string
 import math
+import hashlib
+import bisect
+import time
+import cPickle
 
 # import the XmlDataAdaptor XML parser
 from orbit.utils.xml import XmlDataAdaptor
@@ -34,6 +38,10 @@ from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
 
 DEBUG_FACTORY = DEBUG_OFF
 
+#The version of the lattice records format. Change it if the records change.
+#It is part of the cache file name and of the cache file.
+LATTICE_RECORDS_VERSION = 2
+
 class AcLinacLatticeFactory():
    """
    The ALCELI Linac Lattice Factory generates the Linac Accelerator Lattice
@@ -44,6 +52,12 @@ class AcLinacLatticeFactory():
       self.zeroDistance = 0.00001
       #The maximal length of the drift. It will be devided if it is more than that.
       self.maxDriftLength = 1.
+      #The directory of the lattice records cache. None - no cache.
+      self.cacheDir = None
+      #Accumulated build times [sec] of the lattice construction phases. None - not recorded.
+      self.phaseTimes = None
+      #The profile of the slice lengths (see setSliceLengthProfile). None - maxDriftLength everywhere.
+      self.sliceLengthProfile = None
 
    def setMaxDriftLength(self, maxDriftLength = 1.0):
       """
@@ -60,9 +74,65 @@ class AcLinacLatticeFactory():
       """
       return self.maxDriftLength
 
+   def setSliceLengthProfile(self, profile = None):
+      """
+      Sets the profile of the slice lengths for the adaptive slicing of the drifts,
+      quads and bends. The profile has the method getSliceLength(start,end) that
+      returns the maximal slice length [m] for the region start..end [m] of the lattice
+      (see acSlicing.py). None switches back to the uniform maxDriftLength.
+      """
+      self.sliceLengthProfile = profile
+
+   def getSliceLength(self,start,end):
+      """
+      Returns the maximal slice length for the region start..end of the lattice.
+      """
+      if(self.sliceLengthProfile == None):
+         return self.maxDriftLength
+      return self.sliceLengthProfile.getSliceLength(start,end)
+
+   def setLatticeCacheDir(self, cacheDir = None):
+      """
+      Sets the directory of the lattice records cache. The cache is
+      keyed by the XML file content, the sequence names and the
+      maximal drift length. None switches the cache off.
+      """
+      self.cacheDir = cacheDir
+
+   def getLatticeCacheDir(self):
+      """
+      Returns the directory of the lattice records cache or None.
+      """
+      return self.cacheDir
+
+   def getLatticeCacheFileName(self,names,xml_file_name):
+      """
+      Returns the name of the cache file for the XML file and the build options.
+      """
+      sha = hashlib.sha1()
+      sha.update(repr((LATTICE_RECORDS_VERSION,list(names),self.maxDriftLength)))
+      with open(xml_file_name,'rb') as file:
+         for block in iter(lambda: file.read(1 << 20), ''):
+            sha.update(block)
+      return os.path.join(self.cacheDir,'lattice_'+sha.hexdigest()+'.pkl')
+
+   def setPhaseTimes(self, phaseTimes = None):
+      """
+      Sets the dictionary where the build time [sec] of every phase of the lattice
+      construction (xml_parse, read_records, node_creation, thin_nodes, sort, drifts,
+      initialize) is accumulated. None switches the recording off.
+      """
+      self.phaseTimes = phaseTimes
+
+   def addPhaseTime(self,phase,time_start):
+      if(self.phaseTimes != None):
+         self.phaseTimes[phase] = self.phaseTimes.get(phase,0.) + time.time() - time_start
+
    def getLinacAccLattice(self,names,xml_file_name):
       """
       Returns the linac accelerator lattice for specified sequence names and for a specified XML file.
+      If the lattice cache is on, the XML file is parsed only if there are no cached
+      records for it. In this case the returned data adaptor contains only the PARAMS.
       """
       if(len(names) < 1):
          msg = "The AcLinacLatticeFactory method getLinacAccLattice(names,xml_file_name): you have to specify the names array!"
@@ -70,13 +140,50 @@ class AcLinacLatticeFactory():
          msg = msg + "Stop."
          msg = msg + os.linesep
          orbitFinalize(msg)
+      cache_file_name = None
+      if(self.cacheDir != None):
+         cache_file_name = self.getLatticeCacheFileName(names,xml_file_name)
+         records = self.loadLatticeRecords(cache_file_name)
+         if(records != None):
+            DEBUG_FACTORY(__file__,lineno(),'lattice records from cache {}'.format(cache_file_name))
+            lattice = self.getLinacAccLatticeFromRecords(records)
+            return (lattice,self.makeParamsDataAdaptor(records))
       #----- let's parse the XML file
+      time_start = time.time()
       acc_da = XmlDataAdaptor.adaptorForFile(xml_file_name)
+      self.addPhaseTime("xml_parse",time_start)
       # DEBUG_FACTORY(__file__,lineno(),acc_da)
       # DEBUG_FACTORY(__file__,lineno(),acc_da.__dict__)
-      lattice = self.getLinacAccLatticeFromDA(names,acc_da)
+      records = self.getLatticeRecordsFromDA(names,acc_da)
+      if(cache_file_name != None):
+         if(not os.path.isdir(self.cacheDir)):
+            os.makedirs(self.cacheDir)
+         #---- write and rename: concurrent jobs never see a partial file
+         tmp_file_name = '{}.{}.tmp'.format(cache_file_name,os.getpid())
+         with open(tmp_file_name,'wb') as file:
+            cPickle.dump((LATTICE_RECORDS_VERSION,records),file,cPickle.HIGHEST_PROTOCOL)
+         os.rename(tmp_file_name,cache_file_name)
+      lattice = self.getLinacAccLatticeFromRecords(records)
       return (lattice,acc_da)
 
+   def loadLatticeRecords(self,cache_file_name):
+      """
+      Returns the lattice records of the cache file or None if there is none or
+      it cannot be read (truncated, other version). The XML file is parsed then.
+      """
+      if(not os.path.exists(cache_file_name)):
+         return None
+      try:
+         with open(cache_file_name,'rb') as file:
+            (version,records) = cPickle.load(file)
+      except (IOError,EOFError,cPickle.UnpicklingError,ValueError,TypeError,AttributeError,ImportError,IndexError) as error:
+         print '-> lattice cache {} not readable ({}: {}), parsing the XML file'.format(cache_file_name,error.__class__.__name__,error)
+         return None
+      if(version != LATTICE_RECORDS_VERSION or not isinstance(records,dict) or 'sequences' not in records):
+         print '-> lattice cache {} has another format, parsing the XML file'.format(cache_file_name)
+         return None
+      return records
+
    def getLinacAccLatticeFromDA(self,names,acc_da):
       """
       Returns the linac accelerator lattice for specified sequence names.
@@ -88,6 +195,24 @@ class AcLinacLatticeFactory():
          msg = msg + os.linesep
          orbitFinalize(msg)
       # DEBUG_FACTORY(__file__,lineno(),acc_da.getName())
+      return self.getLinacAccLatticeFromRecords(self.getLatticeRecordsFromDA(names,acc_da))
+
+   def getLatticeRecordsFromDA(self,names,acc_da):
+      """
+      Reads everything that is needed to build the lattice from the XML DataAdaptor
+      into plain python records (dicts, lists, numbers and strings) that can be pickled:
+      {'name', 'params':{PARAMS attributes}, 'sequences':[{'name', 'length', ['bpmFrequency'],
+      'cavities':[{'name','frequency','ampl','pos'}], 'elements':[{'name','type','length',
+      'pos','params':{...}, ['ttfs':{...}]}]}]}
+      The elements of the sequences are sorted by position.
+      """
+      time_start = time.time()
+      records = {'name':acc_da.getName(), 'params':{}, 'sequences':[]}
+      params_da_arr = acc_da.childAdaptors('PARAMS')
+      if(len(params_da_arr) == 1):
+         attributes = params_da_arr[0].getAttributes()
+         for attr_name in attributes:
+            records['params'][attr_name] = params_da_arr[0].stringValue(attr_name)
 
       #----- let's parse the XML DataAdaptor
       accSeq_da_arr = acc_da.childAdaptors()
@@ -98,8 +223,94 @@ class AcLinacLatticeFactory():
       # DEBUG_FACTORY(__file__,lineno(),accSeq_da_arr)
       # DEBUG_FACTORY(__file__,lineno(),string.join(['{}'.format(i.getAttributes()) for i in accSeq_da_arr]))
 
+      for seq_da in accSeq_da_arr:
+         seq_rec = {'name':seq_da.getName(), 'length':seq_da.doubleValue("length"), 'cavities':[], 'elements':[]}
+         #---- BPM frequnecy for this sequence ----
+         if(seq_da.hasAttribute("bpmFrequency")):
+            seq_rec['bpmFrequency'] = seq_da.doubleValue("bpmFrequency")
+         #---- RF Cavities
+         if(len(seq_da.childAdaptors("Cavities")) == 1):
+            cavs_da = seq_da.childAdaptors("Cavities")[0]
+            for cav_da in cavs_da.childAdaptors("Cavity"):
+               seq_rec['cavities'].append({
+                  'name'      : cav_da.stringValue("name"),
+                  'frequency' : cav_da.doubleValue("frequency"),
+                  'ampl'      : cav_da.doubleValue("ampl"),
+                  'pos'       : cav_da.doubleValue("pos")})
+         #node_da_arr - array of accElements. These nodes are not AccNodes. They are XmlDataAdaptor class instances
+         for node_da in seq_da.childAdaptors("accElement"):
+            seq_rec['elements'].append(self.getElementRecordFromDA(node_da))
+         #put nodes in order according to the position in the sequence
+         seq_rec['elements'].sort(key = lambda elem_rec: elem_rec['pos'])
+         records['sequences'].append(seq_rec)
+      self.addPhaseTime("read_records",time_start)
+      return records
+
+   def getElementRecordFromDA(self,node_da):
+      """
+      Returns the record of one accElement DataAdaptor.
+      """
+      params_da = node_da.childAdaptors("parameters")[0]
+      node_type = node_da.stringValue("type")
+      params = {}
+      elem_rec = {
+         'name'   : node_da.stringValue("name"),
+         'type'   : node_type,
+         'length' : node_da.doubleValue("length"),
+         'pos'    : node_da.doubleValue("pos"),
+         'params' : params}
+      def copyValues(names,method):
+         for name in names:
+            if(params_da.hasAttribute(name)):
+               params[name] = method(name)
+      if(node_type == "QUAD"):
+         params["field"] = params_da.doubleValue("field")
+         copyValues(("poles","skews"),params_da.intArrayValue)
+         copyValues(("kls",),params_da.doubleArrayValue)
+         copyValues(("aprt_type",),params_da.intValue)
+         copyValues(("aperture","radIn","radOut"),params_da.doubleValue)
+      elif(node_type == "BEND"):
+         copyValues(("poles","skews"),params_da.intArrayValue)
+         copyValues(("kls",),params_da.doubleArrayValue)
+         for name in ("ea1","ea2","theta"):
+            params[name] = params_da.doubleValue(name)
+         copyValues(("aprt_type",),params_da.intValue)
+         copyValues(("aperture_x","aperture_y"),params_da.doubleValue)
+      elif(node_type == "RFGAP"):
+         for name in ("E0TL","E0L","mode","phase"):
+            params[name] = params_da.doubleValue(name)
+         params["EzFile"] = params_da.stringValue("EzFile")
+         params["cavity"] = params_da.stringValue("cavity")
+         copyValues(("aprt_type",),params_da.intValue)
+         copyValues(("aperture",),params_da.doubleValue)
+         #---- TTFs parameters
+         ttfs_da = node_da.childAdaptors("TTFs")[0]
+         ttfs = {'beta_min':ttfs_da.doubleValue("beta_min"), 'beta_max':ttfs_da.doubleValue("beta_max")}
+         for poly_name in ("polyT","polyS","polyTP","polySP"):
+            poly_da = ttfs_da.childAdaptors(poly_name)[0]
+            ttfs[poly_name] = (poly_da.intValue("order"),poly_da.doubleArrayValue("pcoefs"))
+         elem_rec['ttfs'] = ttfs
+      elif(node_type == "DCV" or node_type == "DCH"):
+         params["effLength"] = params_da.doubleValue("effLength")
+         copyValues(("B",),params_da.doubleValue)
+      return elem_rec
+
+   def makeParamsDataAdaptor(self,records):
+      """
+      Returns the accelerator data adaptor with the PARAMS child only.
+      """
+      acc_da = XmlDataAdaptor(records['name'])
+      params_da = acc_da.createChild('PARAMS')
+      for (attr_name,value) in records['params'].items():
+         params_da.setValue(attr_name,value)
+      return acc_da
+
+   def getLinacAccLatticeFromRecords(self,records):
+      """
+      Returns the linac accelerator lattice built from the lattice records.
+      """
       #----make linac latticeaccSeq
-      linacAccLattice = LinacAccLattice(acc_da.getName())
+      linacAccLattice = LinacAccLattice(records['name'])
       # DEBUG_FACTORY(__file__,lineno(),linacAccLattice.__dict__)
 
       #There are the folowing possible types of elements in the linac tree:
@@ -113,321 +324,57 @@ class AcLinacLatticeFactory():
       #----------------------------------------------------------------------
       # The DRIFTS will be generated additionally and put into right places
       #----------------------------------------------------------------------
-      def positionComp(node1_da,node2_da):
-         if(node1_da.getParam("pos") > node2_da.getParam("pos")):
-            return 1
-         else:
-            if(node1_da.getParam("pos") == node2_da.getParam("pos")):
-               return 0
-         return -1
-
       # loop sequences
       accSeqs = []
       accRF_Cavs = []
       seqPosition = 0.
-      for seq_da in accSeq_da_arr:
-         accSeq = Sequence(seq_da.getName())
+      for seq_rec in records['sequences']:
+         accSeq = Sequence(seq_rec['name'])
          # DEBUG_FACTORY(__file__,lineno(),'seq: {}'.format(accSeq.getName()))
          accSeq.setLinacAccLattice(linacAccLattice)
-         accSeq.setLength(seq_da.doubleValue("length"))
+         accSeq.setLength(seq_rec['length'])
          accSeq.setPosition(seqPosition)
          seqPosition = seqPosition + accSeq.getLength()
          #---- BPM frequnecy for this sequence ----
-         if(seq_da.hasAttribute("bpmFrequency")):
-            bpmFrequency = seq_da.doubleValue("bpmFrequency")
-            accSeq.addParam("bpmFrequency",bpmFrequency)
+         if('bpmFrequency' in seq_rec):
+            accSeq.addParam("bpmFrequency",seq_rec['bpmFrequency'])
          #-----------------------------------------
          accSeqs.append(accSeq)
          # DEBUG_FACTORY(__file__,lineno(),'sequences: '+string.join(['{}'.format(i.getName()) for i in accSeqs]))
 
          #---- create RF Cavities
-         if(len(seq_da.childAdaptors("Cavities")) == 1):
-            cavs_da = seq_da.childAdaptors("Cavities")[0]
-            cav_da_arr = cavs_da.childAdaptors("Cavity")
-            # DEBUG_FACTORY(__file__,lineno(),'Cavities: '+string.join(['{}'.format(i.stringValue('name')) for i in cav_da_arr]))
-            # loop cavities
-            for cav_da in cav_da_arr:
-               frequency = cav_da.doubleValue("frequency")
-               cav_amp = cav_da.doubleValue("ampl")
-               cav_name = cav_da.stringValue("name")
-               cav_pos = cav_da.doubleValue("pos")
-               cav = RF_Cavity(cav_name)
-               cav.setAmp(cav_amp)
-               cav.setFrequency(frequency)
-               cav.setPosition(cav_pos)
-               accSeq.addRF_Cavity(cav)
-               # DEBUG_FACTORY(__file__,lineno(),cav.__dict__)
+         for cav_rec in seq_rec['cavities']:
+            cav = RF_Cavity(cav_rec['name'])
+            cav.setAmp(cav_rec['ampl'])
+            cav.setFrequency(cav_rec['frequency'])
+            cav.setPosition(cav_rec['pos'])
+            accSeq.addRF_Cavity(cav)
+            # DEBUG_FACTORY(__file__,lineno(),cav.__dict__)
          #----------------------------
-         #node_da_arr - array of accElements. These nodes are not AccNodes. They are XmlDataAdaptor class instances
-         node_da_arr = seq_da.childAdaptors("accElement")
-         #put nodes in order according to the position in the sequence
-         for node_da in node_da_arr:
-            node_da.setParam("pos",node_da.doubleValue("pos"))
-         node_da_arr.sort(positionComp)
-         #thinNodes - array of accNode nodes with zero length
-         #They can be positioned inside the thick nodes, and this will be done at the end of this method
-         thinNodes = []
-         
-         # node  loop
-         for node_da in node_da_arr:
-            # DEBUG_FACTORY(__file__, lineno(), node_da.__dict__)
-            params_da    = node_da.childAdaptors("parameters")[0]
-            # DEBUG_FACTORY(__file__, lineno(), params_da.__dict__)
-            node_tagname = node_da.getName()
-            node_name    = node_da.stringValue('name')
-            node_type    = node_da.stringValue("type")
-            node_length  = node_da.doubleValue("length")
-            node_pos     = node_da.getParam("pos")
-            # DEBUG_FACTORY(__file__,lineno(),'node_da: {} {} {} len= {} pos={}'.format( node_tagname,node_name,node_type,node_length,node_pos))
-            #------------QUAD-----------------
-            if(node_type == "QUAD"):
-               accNode = Quad(node_da.stringValue("name"))
-               accNode.setParam("dB/dr",params_da.doubleValue("field"))
-               accNode.setParam("field",params_da.doubleValue("field"))
-               accNode.setLength(node_length)
-               if(params_da.hasAttribute("poles")):
-                  #accNode.setParam("poles",[int(x) for x in eval(params_da.stringValue("poles"))])
-                  accNode.setParam("poles",params_da.intArrayValue("poles"))
-               if(params_da.hasAttribute("kls")):
-                  #accNode.setParam("kls", [x for x in eval(params_da.stringValue("kls"))])
-                  accNode.setParam("kls",params_da.doubleArrayValue("kls"))
-               if(params_da.hasAttribute("skews")):
-                  #accNode.setParam("skews",[int(x) for x in eval(params_da.stringValue("skews"))])
-                  accNode.setParam("skews",params_da.intArrayValue("skews"))
-               if(0.5*accNode.getLength() > self.maxDriftLength):
-                  accNode.setnParts(2*int(0.5*accNode.getLength()/self.maxDriftLength  + 1.5 - 1.0e-12) )
-               if(params_da.hasAttribute("aperture") and params_da.hasAttribute("aprt_type")):
-                  accNode.setParam("aprt_type",params_da.intValue("aprt_type"))
-                  accNode.setParam("aperture",params_da.doubleValue("aperture"))
-               #---- possible parameters for PMQ description of the in Trace3D style
-               if(params_da.hasAttribute("radIn") and params_da.hasAttribute("radOut")):
-                  accNode.setParam("radIn",params_da.doubleValue("radIn"))
-                  accNode.setParam("radOut",params_da.doubleValue("radOut"))
-               accNode.setParam("pos",node_pos)
-               accSeq.addNode(accNode)
-               # DEBUG_FACTORY(__file__,lineno(),'maxDriftLength {}'.format(self.maxDriftLength))
-               # DEBUG_FACTORY(__file__,lineno(),accNode.__dict__)
-               
-            #------------BEND-----------------
-            elif(node_type == "BEND"):
-               accNode = Bend(node_da.stringValue("name"))
-               if(params_da.hasAttribute("poles")):
-                  #accNode.setParam("poles",[int(x) for x in eval(params_da.stringValue("poles"))])
-                  accNode.setParam("poles",params_da.intArrayValue("poles"))
-               if(params_da.hasAttribute("kls")):
-                  #accNode.setParam("kls", [x for x in eval(params_da.stringValue("kls"))])
-                  accNode.setParam("kls",params_da.doubleArrayValue("kls"))
-               if(params_da.hasAttribute("skews")):
-                  #accNode.setParam("skews",[int(x) for x in eval(params_da.stringValue("skews"))])
-                  accNode.setParam("skews",params_da.intArrayValue("skews"))
-               accNode.setParam("ea1",params_da.doubleValue("ea1"))
-               accNode.setParam("ea2",params_da.doubleValue("ea2"))
-               accNode.setParam("theta",params_da.doubleValue("theta"))
-               if(params_da.hasAttribute("aperture_x") and params_da.hasAttribute("aperture_y") and params_da.hasAttribute("aprt_type")):
-                  accNode.setParam("aprt_type",params_da.intValue("aprt_type"))
-                  accNode.setParam("aperture_x",params_da.doubleValue("aperture_x"))
-                  accNode.setParam("aperture_y",params_da.doubleValue("aperture_y"))
-               accNode.setLength(node_length)
-               if(accNode.getLength() > self.maxDriftLength):
-                  accNode.setnParts(2*int(accNode.getLength()/self.maxDriftLength  + 1.5 - 1.0e-12))
-               accNode.setParam("pos",node_pos)
-               accSeq.addNode(accNode)
-            #------------RF_Gap-----------------
-            elif(node_type == "RFGAP"):
-               accNode = BaseRF_Gap(node_da.stringValue("name"))
-               accNode.setLength(0.)
-               accNode.setParam("E0TL",params_da.doubleValue("E0TL"))
-               accNode.setParam("E0L",params_da.doubleValue("E0L"))
-               accNode.setParam("mode",params_da.doubleValue("mode"))
-               accNode.setParam("gap_phase",params_da.doubleValue("phase")*math.pi/180.)
-               accNode.setParam("EzFile",params_da.stringValue("EzFile"))
-               cav_name = params_da.stringValue("cavity")
-               cav = accSeq.getRF_Cavity(cav_name)
-               cav.addRF_GapNode(accNode)
-               if(accNode.isFirstRFGap()):
-                  cav.setPhase(accNode.getParam("gap_phase"))
-               #---- TTFs parameters
-               ttfs_da = node_da.childAdaptors("TTFs")[0]
-               accNode.setParam("beta_min",ttfs_da.doubleValue("beta_min"))
-               accNode.setParam("beta_max",ttfs_da.doubleValue("beta_max"))
-               (polyT,polyS,polyTp,polySp) = accNode.getTTF_Polynimials()
-               polyT_da = ttfs_da.childAdaptors("polyT")[0]
-               polyS_da = ttfs_da.childAdaptors("polyS")[0]
-               polyTp_da = ttfs_da.childAdaptors("polyTP")[0]
-               polySp_da = ttfs_da.childAdaptors("polySP")[0]
-               polyT.order(polyT_da.intValue("order"))
-               polyS.order(polyS_da.intValue("order"))
-               polyTp.order(polyTp_da.intValue("order"))
-               polySp.order(polySp_da.intValue("order"))
-               coef_arr = polyT_da.doubleArrayValue("pcoefs")
-               for coef_ind in range(len(coef_arr)):
-                  polyT.coefficient(coef_ind,coef_arr[coef_ind])
-               coef_arr = polyS_da.doubleArrayValue("pcoefs")
-               for coef_ind in range(len(coef_arr)):
-                  polyS.coefficient(coef_ind,coef_arr[coef_ind])
-               coef_arr = polyTp_da.doubleArrayValue("pcoefs")
-               for coef_ind in range(len(coef_arr)):
-                  polyTp.coefficient(coef_ind,coef_arr[coef_ind])
-               coef_arr = polySp_da.doubleArrayValue("pcoefs")
-               for coef_ind in range(len(coef_arr)):
-                  polySp.coefficient(coef_ind,coef_arr[coef_ind])
-               if(params_da.hasAttribute("aperture") and params_da.hasAttribute("aprt_type")):
-                  accNode.setParam("aprt_type",params_da.intValue("aprt_type"))
-                  accNode.setParam("aperture",params_da.doubleValue("aperture"))
-               accNode.setParam("pos",node_pos)
-               accSeq.addNode(accNode)
-               # DEBUG_FACTORY(__file__,lineno(),'accNode: '+string.join(['\n\t{} : {}'.format(k,v) for k,v in accNode.__dict__.items()]))
-            else:
-               if(node_length != 0.):
-                  msg = "The LinacLatticeFactory method getLinacAccLattice(names): there is a strange element!"
-                  msg = msg + os.linesep
-                  msg = msg + "name=" + node_da.stringValue("name")
-                  msg = msg + os.linesep
-                  msg = msg + "type="+node_type
-                  msg = msg + os.linesep
-                  msg = msg + "length(should be 0.)="+str(node_length)
-                  orbitFinalize(msg)
-               #------ thin nodes analysis
-               accNode = None
-               if(node_type == "DCV" or node_type == "DCH"):
-                  if(node_type == "DCV"): accNode = DCorrectorV(node_da.stringValue("name"))
-                  if(node_type == "DCH"): accNode = DCorrectorH(node_da.stringValue("name"))
-                  accNode.setParam("effLength",params_da.doubleValue("effLength"))
-                  if(params_da.hasAttribute("B")):
-                     accNode.setParam("B",params_da.doubleValue("B"))
-               else:
-                  accNode = MarkerLinacNode(node_da.stringValue("name"))
-               accNode.setParam("pos",node_pos)
-               thinNodes.append(accNode)
+         #---- create the nodes
+         time_start = time.time()
+         thinNodes = self.createSequenceNodes(seq_rec,accSeq)
+         self.addPhaseTime("node_creation",time_start)
          #----- assign the thin nodes that are inside the thick nodes
-         unusedThinNodes = []
-         for thinNode in thinNodes:
-            thinNode_pos = thinNode.getParam("pos")
-            isInside = False
-            for accNode in accSeq.getNodes():
-               length = accNode.getLength()
-               if(length > 0.):
-                  pos = accNode.getParam("pos")
-                  if(thinNode_pos >= (pos-length/2) and thinNode_pos <= (pos+length/2)):
-                     isInside = True
-                     delta_pos = thinNode_pos - (pos-length/2)
-                     s_path = 0.
-                     part_ind_in = -1
-                     for part_ind in range(accNode.getnParts()):
-                        part_ind_in = part_ind
-                        s_path += accNode.getLength(part_ind)
-                        if(delta_pos <= s_path + self.zeroDistance):
-                           break
-                     accNode.addChildNode(thinNode, place = AccNode.BODY, part_index = part_ind_in , place_in_part = AccNode.AFTER)
-                     thinNode.setParam("pos",(pos-length/2)+s_path)
-            if(not isInside):
-               unusedThinNodes.append(thinNode)
-         thinNodes = unusedThinNodes
+         time_start = time.time()
+         thinNodes = self.assignThinNodes(accSeq.getNodes(),thinNodes)
+         self.addPhaseTime("thin_nodes",time_start)
+         time_start = time.time()
          newAccNodes = accSeq.getNodes()[:] + thinNodes
-         newAccNodes.sort(positionComp)
+         newAccNodes.sort(key = lambda accNode: accNode.getParam("pos"))
          accSeq.setNodes(newAccNodes)
+         self.addPhaseTime("sort",time_start)
 
-         #insert the drifts ======================start ===========================
-         #-----now check the integrity quads and rf_gaps should not overlap
-         #-----and create drifts
-         copyAccNodes = accSeq.getNodes()[:]
-         # DEBUG_FACTORY(__file__,lineno(),copyAccNodes)
-         firstNode = copyAccNodes[0]
-         lastNode = copyAccNodes[len(copyAccNodes)-1]
-         driftNodes_before = []
-         driftNodes_after = []
-         #insert the drift before the first element if its half length is less than its position
-         if(math.fabs(firstNode.getLength()/2.0 - firstNode.getParam("pos")) > self.zeroDistance):
-            if(firstNode.getLength()/2.0 > firstNode.getParam("pos")):
-               msg = "The LinacLatticeFactory method getLinacAccLattice(names): the first node is too long!"
-               msg = msg + os.linesep
-               msg = msg + "name=" + firstNode.getName()
-               msg = msg + os.linesep
-               msg = msg + "type=" + firstNode.getType()
-               msg = msg + os.linesep
-               msg = msg + "length=" + str(firstNode.getLength())
-               msg = msg + os.linesep
-               msg = msg + "pos=" + str(firstNode.getParam("pos"))
-               orbitFinalize(msg)
-            else:
-               driftNodes = []
-               driftLength = firstNode.getParam("pos") - firstNode.getLength()/2.0
-               nDrifts = int(driftLength/self.maxDriftLength) + 1
-               driftLength = driftLength/nDrifts
-               for idrift in range(nDrifts):
-                  drift = Drift(accSeq.getName()+":START:"+str(idrift+1)+":drift")
-                  drift.setLength(driftLength)
-                  drift.setParam("pos",0.+drift.getLength()*(idrift+0.5))
-                  driftNodes.append(drift)
-               driftNodes_before = driftNodes
-         #insert the drift after the last element if its half length less + position is less then the sequence length
-         if(math.fabs(lastNode.getLength()/2.0 + lastNode.getParam("pos") - accSeq.getLength()) > self.zeroDistance):
-            if(lastNode.getLength()/2.0 + lastNode.getParam("pos") > accSeq.getLength()):
-               msg = "The LinacLatticeFactory method getLinacAccLattice(names): the last node is too long!"
-               msg = msg + os.linesep
-               msg = msg + "name=" + lastNode.getName()
-               msg = msg + os.linesep
-               msg = msg + "type=" + lastNode.getType()
-               msg = msg + os.linesep
-               msg = msg + "length=" + str(lastNode.getLength())
-               msg = msg + os.linesep
-               msg = msg + "pos=" + str(lastNode.getParam("pos"))
-               msg = msg + os.linesep
-               msg = msg + "sequence name=" + accSeq.getName()
-               msg = msg + os.linesep
-               msg = msg + "sequence length=" + str(accSeq.getLength())
-               orbitFinalize(msg)
-            else:
-               driftNodes = []
-               driftLength = accSeq.getLength() - (lastNode.getParam("pos") + lastNode.getLength()/2.0)
-               nDrifts = int(driftLength/self.maxDriftLength) + 1
-               driftLength = driftLength/nDrifts
-               for idrift in range(nDrifts):
-                  drift = Drift(accSeq.getName()+":"+lastNode.getName()+":"+str(idrift+1)+":drift")
-                  drift.setLength(driftLength)
-                  drift.setParam("pos",lastNode.getParam("pos")+lastNode.getLength()/2.0 + drift.getLength()*(idrift+0.5))
-                  driftNodes.append(drift)
-               driftNodes_after = driftNodes
-         #now move on and generate drifts between (i,i+1) nodes from copyAccNodes
-         newAccNodes = driftNodes_before
-         for node_ind in range(len(copyAccNodes)-1):
-            accNode0 = copyAccNodes[node_ind]
-            newAccNodes.append(accNode0)
-            accNode1 = copyAccNodes[node_ind+1]
-            dist = accNode1.getParam("pos") - accNode1.getLength()/2 - (accNode0.getParam("pos") + accNode0.getLength()/2)
-            # DEBUG_FACTORY(__file__,lineno(),'distance from {},to {}, {:8.4f}[m]'.format(accNode0.getName(),accNode1.getName(),dist))
-            if(abs(dist)<1.e-10): dist = 0.
-            if(dist < 0.):
-               msg = "The LinacLatticeFactory method getLinacAccLattice(names): two nodes are overlapping!"
-               msg = msg + os.linesep
-               msg = msg + "sequence name=" + accSeq.getName()
-               msg = msg + os.linesep
-               msg = msg + "node 0 name=" + accNode0.getName() + " pos="+ str(accNode0.getParam("pos")) + " L="+str(accNode0.getLength())
-               msg = msg + os.linesep
-               msg = msg + "node 1 name=" + accNode1.getName() + " pos="+ str(accNode1.getParam("pos")) + " L="+str(accNode1.getLength())
-               msg = msg + os.linesep
-               orbitFinalize(msg)
-            elif(dist > self.zeroDistance):
-               driftNodes = []
-               nDrifts = int(dist/self.maxDriftLength) + 1
-               driftLength = dist/nDrifts
-               for idrift in range(nDrifts):
-                  drift = Drift(accSeq.getName()+":"+accNode0.getName()+":"+str(idrift+1)+":drift")
-                  drift.setLength(driftLength)
-                  drift.setParam("pos",accNode0.getParam("pos")+accNode0.getLength()*0.5+drift.getLength()*(idrift+0.5))
-                  driftNodes.append(drift)
-               newAccNodes += driftNodes
-            else:
-               pass
-         newAccNodes.append(lastNode)
-         newAccNodes += driftNodes_after
-         accSeq.setNodes(newAccNodes)
-         #insert the drifts ======================stop ===========================
+         time_start = time.time()
+         self.insertDrifts(accSeq)
+         self.addPhaseTime("drifts",time_start)
          #add all AccNodes to the linac lattice
          for accNode in accSeq.getNodes():
             linacAccLattice.addNode(accNode)
       #------- finalize the lattice construction
+      time_start = time.time()
       linacAccLattice.initialize()
+      self.addPhaseTime("initialize",time_start)
       nodes = linacAccLattice.getNodes()
       if DEBUG_FACTORY == DEBUG_ON:
          DEBUG_FACTORY(__file__,lineno(),'LinacAccLattice initalized')
@@ -440,6 +387,331 @@ class AcLinacLatticeFactory():
          #    print('{} \t(si,s0,sf) ({},{},{})'.format(nodes[i],si,s0,sf))
       return linacAccLattice
 
+   def createSequenceNodes(self,seq_rec,accSeq):
+      """
+      Creates the nodes of the sequence record. The thick nodes and RF gaps are added
+      to the sequence, the thin nodes (zero length) are returned.
+      """
+      #thinNodes - array of accNode nodes with zero length
+      #They can be positioned inside the thick nodes, and this will be done by assignThinNodes
+      thinNodes = []
+      seqPosition = accSeq.getPosition()
+
+      # node  loop
+      for elem_rec in seq_rec['elements']:
+         params       = elem_rec['params']
+         node_name    = elem_rec['name']
+         node_type    = elem_rec['type']
+         node_length  = elem_rec['length']
+         node_pos     = elem_rec['pos']
+         # DEBUG_FACTORY(__file__,lineno(),'elem_rec: {} {} len= {} pos={}'.format(node_name,node_type,node_length,node_pos))
+         #------------QUAD-----------------
+         if(node_type == "QUAD"):
+            accNode = Quad(node_name)
+            accNode.setParam("dB/dr",params["field"])
+            accNode.setParam("field",params["field"])
+            accNode.setLength(node_length)
+            if("poles" in params):
+               accNode.setParam("poles",params["poles"])
+            if("kls" in params):
+               accNode.setParam("kls",params["kls"])
+            if("skews" in params):
+               accNode.setParam("skews",params["skews"])
+            sliceLength = self.getSliceLength(seqPosition+node_pos-node_length/2.,seqPosition+node_pos+node_length/2.)
+            if(0.5*accNode.getLength() > sliceLength):
+               accNode.setnParts(2*int(0.5*accNode.getLength()/sliceLength  + 1.5 - 1.0e-12) )
+            if("aperture" in params and "aprt_type" in params):
+               accNode.setParam("aprt_type",params["aprt_type"])
+               accNode.setParam("aperture",params["aperture"])
+            #---- possible parameters for PMQ description of the in Trace3D style
+            if("radIn" in params and "radOut" in params):
+               accNode.setParam("radIn",params["radIn"])
+               accNode.setParam("radOut",params["radOut"])
+            accNode.setParam("pos",node_pos)
+            accSeq.addNode(accNode)
+            # DEBUG_FACTORY(__file__,lineno(),'maxDriftLength {}'.format(self.maxDriftLength))
+            # DEBUG_FACTORY(__file__,lineno(),accNode.__dict__)
+
+         #------------BEND-----------------
+         elif(node_type == "BEND"):
+            accNode = Bend(node_name)
+            if("poles" in params):
+               accNode.setParam("poles",params["poles"])
+            if("kls" in params):
+               accNode.setParam("kls",params["kls"])
+            if("skews" in params):
+               accNode.setParam("skews",params["skews"])
+            accNode.setParam("ea1",params["ea1"])
+            accNode.setParam("ea2",params["ea2"])
+            accNode.setParam("theta",params["theta"])
+            if("aperture_x" in params and "aperture_y" in params and "aprt_type" in params):
+               accNode.setParam("aprt_type",params["aprt_type"])
+               accNode.setParam("aperture_x",params["aperture_x"])
+               accNode.setParam("aperture_y",params["aperture_y"])
+            accNode.setLength(node_length)
+            sliceLength = self.getSliceLength(seqPosition+node_pos-node_length/2.,seqPosition+node_pos+node_length/2.)
+            if(accNode.getLength() > sliceLength):
+               accNode.setnParts(2*int(accNode.getLength()/sliceLength  + 1.5 - 1.0e-12))
+            accNode.setParam("pos",node_pos)
+            accSeq.addNode(accNode)
+         #------------RF_Gap-----------------
+         elif(node_type == "RFGAP"):
+            accNode = BaseRF_Gap(node_name)
+            accNode.setLength(0.)
+            accNode.setParam("E0TL",params["E0TL"])
+            accNode.setParam("E0L",params["E0L"])
+            accNode.setParam("mode",params["mode"])
+            accNode.setParam("gap_phase",params["phase"]*math.pi/180.)
+            accNode.setParam("EzFile",params["EzFile"])
+            cav = accSeq.getRF_Cavity(params["cavity"])
+            cav.addRF_GapNode(accNode)
+            if(accNode.isFirstRFGap()):
+               cav.setPhase(accNode.getParam("gap_phase"))
+            #---- TTFs parameters
+            ttfs = elem_rec['ttfs']
+            accNode.setParam("beta_min",ttfs["beta_min"])
+            accNode.setParam("beta_max",ttfs["beta_max"])
+            (polyT,polyS,polyTp,polySp) = accNode.getTTF_Polynimials()
+            for (poly,poly_name) in ((polyT,"polyT"),(polyS,"polyS"),(polyTp,"polyTP"),(polySp,"polySP")):
+               (order,coef_arr) = ttfs[poly_name]
+               poly.order(order)
+               for coef_ind in range(len(coef_arr)):
+                  poly.coefficient(coef_ind,coef_arr[coef_ind])
+            if("aperture" in params and "aprt_type" in params):
+               accNode.setParam("aprt_type",params["aprt_type"])
+               accNode.setParam("aperture",params["aperture"])
+            accNode.setParam("pos",node_pos)
+            accSeq.addNode(accNode)
+            # DEBUG_FACTORY(__file__,lineno(),'accNode: '+string.join(['\n\t{} : {}'.format(k,v) for k,v in accNode.__dict__.items()]))
+         else:
+            if(node_length != 0.):
+               msg = "The LinacLatticeFactory method getLinacAccLattice(names): there is a strange element!"
+               msg = msg + os.linesep
+               msg = msg + "name=" + node_name
+               msg = msg + os.linesep
+               msg = msg + "type="+node_type
+               msg = msg + os.linesep
+               msg = msg + "length(should be 0.)="+str(node_length)
+               orbitFinalize(msg)
+            #------ thin nodes analysis
+            accNode = None
+            if(node_type == "DCV" or node_type == "DCH"):
+               if(node_type == "DCV"): accNode = DCorrectorV(node_name)
+               if(node_type == "DCH"): accNode = DCorrectorH(node_name)
+               accNode.setParam("effLength",params["effLength"])
+               if("B" in params):
+                  accNode.setParam("B",params["B"])
+            else:
+               accNode = MarkerLinacNode(node_name)
+            accNode.setParam("pos",node_pos)
+            thinNodes.append(accNode)
+      return thinNodes
+
+   def insertDrifts(self,accSeq):
+      """
+      Checks that the nodes of the sequence do not overlap and fills the space
+      between them with drifts not longer than maxDriftLength.
+      """
+      #insert the drifts ======================start ===========================
+      #-----now check the integrity quads and rf_gaps should not overlap
+      #-----and create drifts
+      copyAccNodes = accSeq.getNodes()[:]
+      seqPosition = accSeq.getPosition()
+      # DEBUG_FACTORY(__file__,lineno(),copyAccNodes)
+      firstNode = copyAccNodes[0]
+      lastNode = copyAccNodes[len(copyAccNodes)-1]
+      driftNodes_before = []
+      driftNodes_after = []
+      #insert the drift before the first element if its half length is less than its position
+      if(math.fabs(firstNode.getLength()/2.0 - firstNode.getParam("pos")) > self.zeroDistance):
+         if(firstNode.getLength()/2.0 > firstNode.getParam("pos")):
+            msg = "The LinacLatticeFactory method getLinacAccLattice(names): the first node is too long!"
+            msg = msg + os.linesep
+            msg = msg + "name=" + firstNode.getName()
+            msg = msg + os.linesep
+            msg = msg + "type=" + firstNode.getType()
+            msg = msg + os.linesep
+            msg = msg + "length=" + str(firstNode.getLength())
+            msg = msg + os.linesep
+            msg = msg + "pos=" + str(firstNode.getParam("pos"))
+            orbitFinalize(msg)
+         else:
+            driftNodes = []
+            driftLength = firstNode.getParam("pos") - firstNode.getLength()/2.0
+            nDrifts = int(driftLength/self.getSliceLength(seqPosition,seqPosition+driftLength)) + 1
+            driftLength = driftLength/nDrifts
+            for idrift in range(nDrifts):
+               drift = Drift(accSeq.getName()+":START:"+str(idrift+1)+":drift")
+               drift.setLength(driftLength)
+               drift.setParam("pos",0.+drift.getLength()*(idrift+0.5))
+               driftNodes.append(drift)
+            driftNodes_before = driftNodes
+      #insert the drift after the last element if its half length less + position is less then the sequence length
+      if(math.fabs(lastNode.getLength()/2.0 + lastNode.getParam("pos") - accSeq.getLength()) > self.zeroDistance):
+         if(lastNode.getLength()/2.0 + lastNode.getParam("pos") > accSeq.getLength()):
+            msg = "The LinacLatticeFactory method getLinacAccLattice(names): the last node is too long!"
+            msg = msg + os.linesep
+            msg = msg + "name=" + lastNode.getName()
+            msg = msg + os.linesep
+            msg = msg + "type=" + lastNode.getType()
+            msg = msg + os.linesep
+            msg = msg + "length=" + str(lastNode.getLength())
+            msg = msg + os.linesep
+            msg = msg + "pos=" + str(lastNode.getParam("pos"))
+            msg = msg + os.linesep
+            msg = msg + "sequence name=" + accSeq.getName()
+            msg = msg + os.linesep
+            msg = msg + "sequence length=" + str(accSeq.getLength())
+            orbitFinalize(msg)
+         else:
+            driftNodes = []
+            driftLength = accSeq.getLength() - (lastNode.getParam("pos") + lastNode.getLength()/2.0)
+            nDrifts = int(driftLength/self.getSliceLength(seqPosition+accSeq.getLength()-driftLength,seqPosition+accSeq.getLength())) + 1
+            driftLength = driftLength/nDrifts
+            for idrift in range(nDrifts):
+               drift = Drift(accSeq.getName()+":"+lastNode.getName()+":"+str(idrift+1)+":drift")
+               drift.setLength(driftLength)
+               drift.setParam("pos",lastNode.getParam("pos")+lastNode.getLength()/2.0 + drift.getLength()*(idrift+0.5))
+               driftNodes.append(drift)
+            driftNodes_after = driftNodes
+      #now move on and generate drifts between (i,i+1) nodes from copyAccNodes
+      newAccNodes = driftNodes_before
+      for node_ind in range(len(copyAccNodes)-1):
+         accNode0 = copyAccNodes[node_ind]
+         newAccNodes.append(accNode0)
+         accNode1 = copyAccNodes[node_ind+1]
+         dist = accNode1.getParam("pos") - accNode1.getLength()/2 - (accNode0.getParam("pos") + accNode0.getLength()/2)
+         # DEBUG_FACTORY(__file__,lineno(),'distance from {},to {}, {:8.4f}[m]'.format(accNode0.getName(),accNode1.getName(),dist))
+         if(abs(dist)<1.e-10): dist = 0.
+         if(dist < 0.):
+            msg = "The LinacLatticeFactory method getLinacAccLattice(names): two nodes are overlapping!"
+            msg = msg + os.linesep
+            msg = msg + "sequence name=" + accSeq.getName()
+            msg = msg + os.linesep
+            msg = msg + "node 0 name=" + accNode0.getName() + " pos="+ str(accNode0.getParam("pos")) + " L="+str(accNode0.getLength())
+            msg = msg + os.linesep
+            msg = msg + "node 1 name=" + accNode1.getName() + " pos="+ str(accNode1.getParam("pos")) + " L="+str(accNode1.getLength())
+            msg = msg + os.linesep
+            orbitFinalize(msg)
+         elif(dist > self.zeroDistance):
+            driftNodes = []
+            start = seqPosition + accNode0.getParam("pos") + accNode0.getLength()/2
+            nDrifts = int(dist/self.getSliceLength(start,start+dist)) + 1
+            driftLength = dist/nDrifts
+            for idrift in range(nDrifts):
+               drift = Drift(accSeq.getName()+":"+accNode0.getName()+":"+str(idrift+1)+":drift")
+               drift.setLength(driftLength)
+               drift.setParam("pos",accNode0.getParam("pos")+accNode0.getLength()*0.5+drift.getLength()*(idrift+0.5))
+               driftNodes.append(drift)
+            newAccNodes += driftNodes
+         else:
+            pass
+      newAccNodes.append(lastNode)
+      newAccNodes += driftNodes_after
+      accSeq.setNodes(newAccNodes)
+      #insert the drifts ======================stop ===========================
+
+   def isInertNode(self,accNode,keepNames):
+      """
+      Returns True for the drifts and markers without child nodes (apertures,
+      diagnostics, space charge) that are not in keepNames. They can be merged.
+      """
+      if(not isinstance(accNode,(Drift,MarkerLinacNode))): return False
+      if(accNode.getName() in keepNames): return False
+      return len(accNode.getAllChildren()) == 0
+
+   def compactLattice(self,linacAccLattice,keepNames = ()):
+      """
+      Returns a new linac accelerator lattice where every run of consecutive
+      inert drifts and markers (see isInertNode) of a sequence with at least
+      one drift is replaced by one drift. The merged drift has the name of the
+      first drift of the run and the param "compacted_nodes" with the list of
+      (name, position [m], length [m]) of the replaced nodes for the reports.
+      Nodes with child nodes (e.g. space charge) and the nodes in keepNames
+      (the nodes of name based actions) are kept. The actions by position
+      (twiss rows, snapshot positions) see only the merged drift exits.
+      Use it after all lattice modifications.
+      """
+      keepNames = set(keepNames)
+      newLattice = LinacAccLattice(linacAccLattice.getName())
+      for accSeq in linacAccLattice.getSequences():
+         accSeq.setLinacAccLattice(newLattice)
+         newAccNodes = []
+         run = []
+         for accNode in accSeq.getNodes() + [None]:
+            if(accNode != None and self.isInertNode(accNode,keepNames)):
+               run.append(accNode)
+               continue
+            drifts = [node for node in run if isinstance(node,Drift)]
+            if(len(run) > 1 and len(drifts) > 0):
+               length = sum([node.getLength() for node in run])
+               start = run[0].getPosition() - run[0].getLength()/2.
+               drift = Drift(drifts[0].getName())
+               drift.setLength(length)
+               drift.setParam("pos",start+length/2.)
+               drift.setParam("compacted_nodes",[(node.getName(),node.getPosition(),node.getLength()) for node in run])
+               newAccNodes.append(drift)
+            else:
+               newAccNodes += run
+            run = []
+            if(accNode != None):
+               newAccNodes.append(accNode)
+         DEBUG_FACTORY(__file__,lineno(),'{}: {} nodes compacted to {}'.format(accSeq.getName(),len(accSeq.getNodes()),len(newAccNodes)))
+         accSeq.setNodes(newAccNodes)
+         for accNode in newAccNodes:
+            newLattice.addNode(accNode)
+      newLattice.initialize()
+      return newLattice
+
+   def assignThinNodes(self,accNodes,thinNodes):
+      """
+      Puts the thin nodes as BODY children into the parts of the thick nodes
+      (length > 0) that contain their positions and returns the thin nodes
+      that are outside of all thick nodes. A thin node at the common edge of
+      two thick nodes goes into both of them. The thick nodes are not
+      overlapping and sorted by position, so the containing nodes are found
+      by bisection over their start positions, and the part by bisection over
+      the cumulative part lengths.
+      """
+      thickNodes = []
+      starts = []
+      ends = []
+      for accNode in accNodes:
+         length = accNode.getLength()
+         if(length > 0.):
+            pos = accNode.getParam("pos")
+            thickNodes.append(accNode)
+            starts.append(pos-length/2)
+            ends.append(pos+length/2)
+      #----- cumulative part lengths (+ zeroDistance) of the thick nodes, made when needed
+      parts_ends = {}
+      unusedThinNodes = []
+      for thinNode in thinNodes:
+         thinNode_pos = thinNode.getParam("pos")
+         ind = bisect.bisect_right(starts,thinNode_pos) - 1
+         inside = []
+         while(ind >= 0 and ends[ind] >= thinNode_pos):
+            inside.append(ind)
+            ind -= 1
+         if(len(inside) == 0):
+            unusedThinNodes.append(thinNode)
+            continue
+         for ind in reversed(inside):
+            accNode = thickNodes[ind]
+            if(ind not in parts_ends):
+               s_path = 0.
+               s_paths = []
+               for part_ind in range(accNode.getnParts()):
+                  s_path += accNode.getLength(part_ind)
+                  s_paths.append(s_path)
+               parts_ends[ind] = (s_paths,[s + self.zeroDistance for s in s_paths])
+            (s_paths,s_limits) = parts_ends[ind]
+            delta_pos = thinNode_pos - starts[ind]
+            part_ind_in = min(bisect.bisect_left(s_limits,delta_pos),len(s_paths)-1)
+            accNode.addChildNode(thinNode, place = AccNode.BODY, part_index = part_ind_in , place_in_part = AccNode.AFTER)
+            thinNode.setParam("pos",starts[ind]+s_paths[part_ind_in])
+      return unusedThinNodes
+
    def filterSequences_and_OptionalCheck(self,accSeq_da_arr,names):
       """
       This method will filter the sequences according to names list
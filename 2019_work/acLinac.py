@@ -38,6 +38,19 @@ import orbit
 # import python modules customized for ALCELI
 from acBunchGenerator import AcLinacBunchGenerator
 from acLatticeFactory import AcLinacLatticeFactory
+from acBunchIO import dumpBunchBinary
+from acDistributions import AcGaussDist3D, AcWaterBagDist3D, AcKVDist3D
+from acDiagnostics import AcTwissRecorder, nodeExitPosition
+from acProfiler import AcTrackingProfiler
+from acCheckpoint import checkpointNodes, saveCheckpoint, loadCheckpoint
+from acDesignCache import trackDesign
+from acFieldTables import addAxisFieldsToStore
+from acTTF import addTTFsToLattice
+from acEnvelope import trackEnvelope
+from acSlicing import AcAdaptiveSlicing
+from acSpaceCharge import addSpaceChargeNodes
+from acLosses import addApertures, AcLossMap
+from acBunchArchive import AcBunchArchive, AcSnapshotRecorder
 from acConf  import CONF
 # import from SIMULINAC
 from setutil import PARAMS,WConverter
@@ -114,28 +127,27 @@ def action_exit(paramsDict):
         DEBUG_MAIN(__file__,lineno(),'exit action at node: {} --> tkin[MeV] {}'.format(node.getName(),Tkfin))
     
 
-#todo: use WConverter
-#todo: strukturieren - zu viel sphargetti code!
-#todo: use AxisField models
-#todo: make twiss plots
-#todo: read parameter from simu.py instead from xml-input
-def main():
-    random.seed(100)
-
-    # section list
-    names = ["S25to200"]
-
-    #---- the XML input file name with the linac structure
-    xml_file_name = simulinacRoot+"/lattice.xml"
-
+def makeLattice(names, xml_file_name):
+    """
+    Builds the linac lattice for the sequence names with the FACTORY
+    and sets up the RF gap model and the quad fringe fields.
+    Returns (accLattice, acc_da).
+    """
     #---- create the FACTORY instance
     linac_factory = AcLinacLatticeFactory()
     linac_factory.setMaxDriftLength(0.01)
-    
+    linac_factory.setLatticeCacheDir(CONF['lattice_cache_dir'])
+    if CONF['adaptiveSlicing'] != None:
+        #---- slice lengths from the envelope on a coarse lattice
+        slicing = AcAdaptiveSlicing(**CONF['adaptiveSlicing'])
+        linac_factory.setMaxDriftLength(slicing.maxLength)
+        (coarseLattice,acc_da) = linac_factory.getLinacAccLattice(names,xml_file_name)
+        slicing.estimate(coarseLattice,makeBunchGenerator(getInjectionParams(acc_da)),CONF['envelopeSpaceCharge'])
+        linac_factory.setSliceLengthProfile(slicing)
+
     #---- call FACTORY
     (accLattice,acc_da) = linac_factory.getLinacAccLattice(names,xml_file_name)
     DEBUG_MAIN(__file__,lineno(),accLattice)
-    print "Linac lattice is ready. L=",accLattice.getLength()
 
     #----set up RF Gap Model -------------
     #---- There are three available models at this moment
@@ -145,6 +157,10 @@ def main():
     cppGapModel = MatrixRfGap()
     cppGapModel = BaseRfGap()
     # cppGapModel = RfGapTTF
+    if CONF['fitTTFs']:
+        #---- TTF polynomials fitted to the on-axis fields of the Superfish tables
+        addTTFsToLattice(accLattice,CONF['field_dir'],CONF['ttf_order'],CONF['ttf_tolerance'])
+        cppGapModel = RfGapTTF()
     rf_gaps = accLattice.getRF_Gaps()
     for rf_gap in rf_gaps:
         # DEBUG_MAIN(__file__,lineno(),rf_gap)
@@ -160,107 +176,233 @@ def main():
             # DEBUG_MAIN(__file__,lineno(),quad.getNodeTiltIN().__dict__)
             # DEBUG_MAIN(__file__,lineno(),quad.getNodeTiltOUT().__dict__)
             pass
+    if CONF['axisFieldGaps']:
+        #---- BaseRF_Gap to AxisFieldRF_Gap replacement with the on-axis fields
+        #---- of the Superfish tables (parsed once, cached in CONF['field_cache_dir'])
+        dir_location = CONF['field_dir']
+        addAxisFieldsToStore(accLattice,dir_location)
+        Replace_BaseRF_Gap_to_AxisField_Nodes(accLattice,CONF['axisField_z_step'],dir_location,names)
+    if CONF['apertures']:
+        #---- apertures of the quads, RF gaps and scrapers remove the lost particles (see acLosses.py)
+        addApertures(accLattice,CONF['aperture_scrapers'])
+    if CONF['spaceCharge'] != None:
+        #---- space charge kicks at the node boundaries (see acSpaceCharge.py)
+        addSpaceChargeNodes(accLattice,CONF['spaceCharge'],CONF['sc_grid'],CONF['sc_nEllipses'],CONF['sc_minLength'])
+    if CONF['compactLattice']:
+        #---- merge the runs of drifts and markers into single drifts (after all modifications),
+        #---- the nodes of the checkpoints and snapshots are kept
+        nNodes = len(accLattice.getNodes())
+        keepNames = list(CONF['checkpoint_nodes']) + list(CONF['snapshot_nodes'])
+        if CONF['twissDiagnostics'] or len(CONF['snapshot_positions']) > 0:
+            print '-> WARNING: compactLattice with twissDiagnostics or snapshot_positions, rows and snapshots only at the merged drift exits'
+        accLattice = linac_factory.compactLattice(accLattice,keepNames)
+        print '-> lattice compacted from {} to {} nodes'.format(nNodes,len(accLattice.getNodes()))
+    return (accLattice,acc_da)
 
-    # get PARAMS from xml-lattice
+def getInjectionParams(acc_da):
+    """
+    Returns the dictionary of the injection parameters from the PARAMS of the xml-lattice.
+    """
     [params_da] = acc_da.childAdaptors(name='PARAMS')
     DEBUG_MAIN(__file__,lineno(),params_da.getAttributes())
+    injection = {}
+    injection['tkin']      = params_da.doubleValue('injection_energy')   # in [MeV]
+    injection['m0c2']      = params_da.doubleValue('proton_mass')        # in [MeV]
+    injection['frequency'] = params_da.doubleValue('frequenz')           # in [Hz]
+    injection['clight']    = params_da.doubleValue('clight')             # in [m/sec]
+    for name in ('betax_i','betay_i','betaz_i'):   # [m], [m], [m/rad]
+        injection[name] = params_da.doubleValue(name)
+    for name in ('alfax_i','alfay_i','alfaz_i'):   # []
+        injection[name] = params_da.doubleValue(name)
+    for name in ('emitx_i','emity_i','emitz_i'):   # [m*rad]
+        injection[name] = params_da.doubleValue(name)
+    injection['emitw_i']   = params_da.doubleValue('emitw_i')            # [rad]
+    return injection
 
-    # twiss parameters at the entrance
-    tkin      = params_da.doubleValue('injection_energy')        # in [MeV]
-    m0c2      = params_da.doubleValue('proton_mass')             # in [MeV]
-    frequency = params_da.doubleValue('frequenz')                # in [Hz]
-    clight    = params_da.doubleValue('clight')                  # in [m/sec]
-    lamb      = clight/frequency                                 # in [m]
-    gamma     = (m0c2 + tkin)/m0c2
-    pi        = math.pi
-    beta      = math.sqrt(gamma**2 - 1.0)/gamma
-    betax_i   = params_da.doubleValue('betax_i')    # [m]
-    betay_i   = params_da.doubleValue('betay_i')    # [m]
-    betaz_i   = params_da.doubleValue('betaz_i')    # [m/rad]
-    alfax_i   = params_da.doubleValue('alfax_i')    # []
-    alfay_i   = params_da.doubleValue('alfay_i')    # []
-    alfaz_i   = params_da.doubleValue('alfaz_i')    # []
-    emitx_i   = params_da.doubleValue('emitx_i')    # [m*rad]
-    emity_i   = params_da.doubleValue('emity_i')    # [m*rad]
-    emitz_i   = params_da.doubleValue('emitz_i')    # [m*rad]
-    emitw_i   = params_da.doubleValue('emitw_i')    # [rad]
-    
-    print "At injection: T= {}[GeV], gamma= {}, beta= {}".format(tkin, gamma, beta)
-
-    print " ========= Twiss parameters at injection ==========="
-    print " aplha beta emitt[mm*mrad] X= %6.3g %6.3g %6.3g "%(alfax_i,betax_i,emitx_i*1.0e+6)
-    print " aplha beta emitt[mm*mrad] Y= %6.3g %6.3g %6.3g "%(alfay_i,betay_i,emity_i*1.0e+6)
-    print " aplha beta emitt[mm*mrad] Z= %6.3g %6.3g %6.3g "%(alfaz_i,betaz_i,emitz_i*1.0e+6)
+def makeBunchGenerator(injection, current = 10.):
+    """
+    Returns the bunch generator for the injection parameters and the beam current in [mA].
+    """
+    m0c2  = injection['m0c2']
+    tkin  = injection['tkin']
+    gamma = (m0c2 + tkin)/m0c2
+    beta  = math.sqrt(gamma**2 - 1.0)/gamma
 
     #-----TWISS Parameters at the entrance of MEBT ---------------
     #-----transverse emittances are unnormalized and in [pi*mm*mrad]
     #-----longitudinal emittance is in [pi*m*GeV]
 
     #---- transform to pyORBIT (apparently {z-DW} phase space)
-    emitzW  = m0c2*gamma*beta**2*emitz_i*1.e-3        # [m*GeV]
-    betazW  = 1./(m0c2*gamma*beta**2)*betaz_i*1.e+3   # [m/GeV]
-    Tkin    = tkin*1.e-3                              # [GeV]      
-    
-    print " ========= PyORBIT parameters at injection ==========="
-    print " aplha beta[mm/mrad] emitt[mm*mrad] X= %6.3g %6.3g %6.3g "%(alfax_i,betax_i,emitx_i*1.0e+6)
-    print " aplha beta[mm/mrad] emitt[mm*mrad] Y= %6.3g %6.3g %6.3g "%(alfay_i,betay_i,emity_i*1.0e+6)
-    print " aplha beta[m/Gev]   emitt[m*GeV]   Z= %6.3g %6.3g %6.3g "%(alfaz_i,betazW,emitzW)
+    emitzW  = m0c2*gamma*beta**2*injection['emitz_i']*1.e-3        # [m*GeV]
+    betazW  = 1./(m0c2*gamma*beta**2)*injection['betaz_i']*1.e+3   # [m/GeV]
+    Tkin    = tkin*1.e-3                                           # [GeV]
 
     #-----longitudinal emittance is in [pi*m*GeV]
-    twissX = TwissContainer(alfax_i,betax_i,emitx_i)
-    twissY = TwissContainer(alfay_i,betay_i,emity_i)
-    twissZ = TwissContainer(alfaz_i,betazW,emitzW)
-
-    # BUNCH generation
-    print "-> Start Bunch Generation"
-    bunch_gen  = AcLinacBunchGenerator(twissX,twissY,twissZ,frequency=frequency)
-    paramsDict = {'BunchGenerator': bunch_gen}
+    twissX = TwissContainer(injection['alfax_i'],injection['betax_i'],injection['emitx_i'])
+    twissY = TwissContainer(injection['alfay_i'],injection['betay_i'],injection['emity_i'])
+    twissZ = TwissContainer(injection['alfaz_i'],betazW,emitzW)
+
+    bunch_gen  = AcLinacBunchGenerator(twissX,twissY,twissZ,frequency=injection['frequency'])
     #----------------------------------------
     # set the initial kinetic energy in [GeV]
     bunch_gen.setKinEnergy(Tkin)
     #----------------------------------------
     #set the beam peak current in mA
     # bunch_gen.setBeamCurrent(PARAMS['elementarladung']*PARAMS['frequenz']*1.e3)   # 1 e-charge per bunch
-    bunch_gen.setBeamCurrent(10.)
-    bunch = bunch_gen.getBunch(nParticles = 5000, distributorClass = GaussDist3D)
-    # print '\npossible particle attributes names:\n'+''.join(['\t"{}"\n'.format(i) for i in bunch.getPossiblePartAttrNames()])
+    bunch_gen.setBeamCurrent(current)
+    bunch_gen.setBunchCache(CONF['bunch_cache_dir'],CONF['bunch_cache_max_mb']*2**20)
+    return bunch_gen
 
-    # DUMP bunch at lattice entrance
-    if CONF['dumpBunchIN']:
-        bunch.dumpBunch(CONF['bunchIn_filename'])
-    print "-> Bunch Generation finished"
+#todo: use WConverter
+#todo: use AxisField models
+#todo: read parameter from simu.py instead from xml-input
+def main():
+    random.seed(100)
+
+    # section list
+    names = ["S25to200"]
+
+    #---- the XML input file name with the linac structure
+    xml_file_name = simulinacRoot+"/lattice.xml"
+
+    (accLattice,acc_da) = makeLattice(names,xml_file_name)
+    print "Linac lattice is ready. L=",accLattice.getLength()
+
+    # twiss parameters at the entrance
+    injection = getInjectionParams(acc_da)
+    tkin      = injection['tkin']
+    m0c2      = injection['m0c2']
+    gamma     = (m0c2 + tkin)/m0c2
+    beta      = math.sqrt(gamma**2 - 1.0)/gamma
+    (alfax_i,betax_i,emitx_i) = (injection['alfax_i'],injection['betax_i'],injection['emitx_i'])
+    (alfay_i,betay_i,emity_i) = (injection['alfay_i'],injection['betay_i'],injection['emity_i'])
+    (alfaz_i,betaz_i,emitz_i) = (injection['alfaz_i'],injection['betaz_i'],injection['emitz_i'])
+
+    print "At injection: T= {}[GeV], gamma= {}, beta= {}".format(tkin, gamma, beta)
 
-    # DESIGN tracking
-    print "-> Design tracking started"
-    accLattice.trackDesignBunch(bunch)
-    print "-> Design tracking finished "
+    print " ========= Twiss parameters at injection ==========="
+    print " aplha beta emitt[mm*mrad] X= %6.3g %6.3g %6.3g "%(alfax_i,betax_i,emitx_i*1.0e+6)
+    print " aplha beta emitt[mm*mrad] Y= %6.3g %6.3g %6.3g "%(alfay_i,betay_i,emity_i*1.0e+6)
+    print " aplha beta emitt[mm*mrad] Z= %6.3g %6.3g %6.3g "%(alfaz_i,betaz_i,emitz_i*1.0e+6)
+
+    bunch_gen = makeBunchGenerator(injection, current = 10.)
+    (twissX,twissY,twissZ) = bunch_gen.twiss
+    print " ========= PyORBIT parameters at injection ==========="
+    print " aplha beta[mm/mrad] emitt[mm*mrad] X= %6.3g %6.3g %6.3g "%(alfax_i,betax_i,emitx_i*1.0e+6)
+    print " aplha beta[mm/mrad] emitt[mm*mrad] Y= %6.3g %6.3g %6.3g "%(alfay_i,betay_i,emity_i*1.0e+6)
+    print " aplha beta[m/Gev]   emitt[m*GeV]   Z= %6.3g %6.3g %6.3g "%twissZ.getAlphaBetaEmitt()
+
+    if CONF['trackingMode'] == 'envelope':
+        # ENVELOPE tracking of the sigma matrix instead of the macro-particles
+        print "-> Envelope tracking started"
+        time_start = time.clock()
+        envelope = trackEnvelope(accLattice,bunch_gen,CONF['twiss_filename'],CONF['twiss_pos_step'],CONF['envelopeSpaceCharge'])
+        time_exec = time.clock() - time_start
+        print "-> Envelope tracking finished in {:4.2f} [sec], T-final[MeV] {}".format(time_exec,envelope.rows[-1][2]['eKin'])
+        return
+
+    start_index = 0
+    if CONF['restart_checkpoint'] != None:
+        # RESTART from checkpoint: no bunch generation and no design tracking
+        (bunch,start_index) = loadCheckpoint(CONF['restart_checkpoint'],accLattice)
+    else:
+        # BUNCH generation
+        print "-> Start Bunch Generation"
+        bunch = bunch_gen.getBunch(nParticles = CONF['nParticles'], distributorClass = AcGaussDist3D, seed = CONF['bunch_seed'])
+        # print '\npossible particle attributes names:\n'+''.join(['\t"{}"\n'.format(i) for i in bunch.getPossiblePartAttrNames()])
+
+        # DUMP bunch at lattice entrance
+        if CONF['dumpBunchIN']:
+            if CONF['dumpFormat'] == 'binary':
+                dumpBunchBinary(bunch,CONF['bunchIn_filename'])
+            else:
+                bunch.dumpBunch(CONF['bunchIn_filename'])
+        print "-> Bunch Generation finished"
+
+        # DESIGN tracking
+        print "-> Design tracking started"
+        trackDesign(accLattice,bunch,CONF['design_cache_dir'],CONF['field_dir'])
+        print "-> Design tracking finished "
 
     # BUNCH tracking preparation
     accLattice.setLinacTracker(switch=False)    # use TeapotBase (TPB) tracking
-    paramsDict = {"old_pos":-1.,"count":0,"pos_step":0.1,'m0c2':m0c2}
+    paramsDict = {"old_pos":-1.,"count":0,"pos_step":CONF['twiss_pos_step'],'m0c2':m0c2}
     last_node_index = len(accLattice.getNodes())-1
-    nodes           = accLattice.getNodes()[:last_node_index-1]
+    nodes           = accLattice.getNodes()[start_index:last_node_index]
     last_node       = accLattice.getNodes()[last_node_index]
+    checkpoints     = checkpointNodes(accLattice,CONF['checkpoint_nodes'],CONF['checkpoint_sequence_ends'])
     # DEBUG_MAIN(__file__,lineno(),nodes)
     DEBUG_MAIN(__file__,lineno(),'last node: {}'.format(last_node.getName()))
 
+    # DIAGNOSTICS along the lattice
+    nodesContainer   = AccActionsContainer("Bunch Tracking")
+    actionsContainer = AccActionsContainer("Bunch Tracking")
+    twiss_recorder   = None
+    profiler         = None
+    if CONF['profileTracking']:
+        # first, to keep the cost of the other actions out of the node times
+        profiler = AcTrackingProfiler()
+        profiler.addActionsTo(nodesContainer)
+        profiler.addActionsTo(actionsContainer)
+    actionsContainer.addAction(action_exit, AccActionsContainer.EXIT)    
+    if CONF['twissDiagnostics']:
+        if start_index > 0:
+            # a restart continues the table without the rows behind the restart node
+            start_position = nodeExitPosition(accLattice.getNodes()[start_index-1])
+            twiss_recorder = AcTwissRecorder(CONF['twiss_filename'],bunch_gen,append = True,keepUntil = start_position)
+            twiss_recorder.record('RESTART',start_position,bunch)
+        else:
+            twiss_recorder = AcTwissRecorder(CONF['twiss_filename'],bunch_gen)
+            twiss_recorder.record('START',0.,bunch)
+        nodesContainer.addAction(twiss_recorder, AccActionsContainer.EXIT)
+        actionsContainer.addAction(twiss_recorder, AccActionsContainer.EXIT)
+    snapshots = None
+    if len(CONF['snapshot_nodes']) > 0 or len(CONF['snapshot_positions']) > 0:
+        # a restart continues the archive without the snapshots behind the restart node
+        start_position = nodeExitPosition(accLattice.getNodes()[start_index-1]) if start_index > 0 else 0.
+        archive = AcBunchArchive(CONF['snapshot_filename'],append = start_index > 0,keepUntil = start_position)
+        snapshots = AcSnapshotRecorder(archive,CONF['snapshot_nodes'],CONF['snapshot_positions'],start_position)
+        nodesContainer.addAction(snapshots, AccActionsContainer.EXIT)
+        actionsContainer.addAction(snapshots, AccActionsContainer.EXIT)
+    loss_map = None
+    if CONF['apertures']:
+        loss_map = AcLossMap(bunch_gen)
+        loss_map.addTo(paramsDict,nodesContainer)
+        loss_map.addTo(paramsDict,actionsContainer)
+
     # BUNCH tracking
     print "-> Bunch tracking started "
     time_start = time.clock()
     # all but last node
-    for node in nodes:
-        node.trackBunch(bunch, paramsDict=paramsDict)
-    # last node action
-    actionsContainer = AccActionsContainer("Bunch Tracking")
-    actionsContainer.addAction(action_exit, AccActionsContainer.EXIT)    
-    last_node.trackBunch(bunch, paramsDict=paramsDict, actionContainer=actionsContainer)
+    for (index,node) in enumerate(nodes,start_index):
+        node.trackBunch(bunch, paramsDict=paramsDict, actionContainer=nodesContainer)
+        if index in checkpoints:
+            saveCheckpoint(bunch,accLattice,index+1,os.path.join(CONF['checkpoint_dir'],node.getName()+'.chk'))
+    # last node action (not after a restart from the checkpoint at the lattice end)
+    if start_index <= last_node_index:
+        last_node.trackBunch(bunch, paramsDict=paramsDict, actionContainer=actionsContainer)
+        if last_node_index in checkpoints:
+            saveCheckpoint(bunch,accLattice,last_node_index+1,os.path.join(CONF['checkpoint_dir'],last_node.getName()+'.chk'))
     time_exec = time.clock() - time_start
+    if twiss_recorder != None:
+        if start_index <= last_node_index and paramsDict["old_pos"] != nodeExitPosition(last_node):
+            twiss_recorder.record(last_node.getName(),nodeExitPosition(last_node),bunch)
+        twiss_recorder.close()
+    if snapshots != None:
+        snapshots.archive.close()
+    if loss_map != None:
+        loss_map.write(CONF['loss_filename'],CONF['loss_bin_length'])
+    if profiler != None:
+        profiler.dump(CONF['profile_filename'])
     print "-> Bunch tracking finished in {:4.2f} [sec], T-final[MeV] {}".format(time_exec,bunch.getSyncParticle().kinEnergy()*1.e3)
 
     # DUMP bunch at lattice end
     if CONF['dumpBunchOUT']:
         # DEBUG_MAIN(__file__,lineno(),'bunch.getSize(): {}'.format(bunch.getSize()))
-        bunch.dumpBunch(CONF['bunchOut_filename'])
+        if CONF['dumpFormat'] == 'binary':
+            dumpBunchBinary(bunch,CONF['bunchOut_filename'])
+        else:
+            bunch.dumpBunch(CONF['bunchOut_filename'])
         # dumpBunch(bunch,CONF['bunchOut_filename'])
 
 if __name__ == '__main__':
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+Apertures and beam losses of the pyORBIT ALCELI linac.
+
+addApertures() attaches the aperture nodes of pyORBIT to the quads and
+RF gaps with the "aperture" param (diameter [m], see the FACTORY) and to
+the scraper nodes. An aperture node removes the particles outside of it
+from the bunch, so the following nodes do not track them, and puts them
+into paramsDict["lostbunch"] if there is one.
+
+AcLossMap is an EXIT action for the AccActionsContainer. At every
+aperture node it books the number of lost macro particles and their beam
+power and empties the lost bunch. write() writes the loss map, i.e. the
+losses per aperture node and per position bin, as small tables instead
+of dumps of the lost particles.
+"""
+
+import math
+
+import orbit_mpi
+from orbit_mpi import mpi_datatype, mpi_op
+from bunch import Bunch
+from orbit.lattice import AccActionsContainer
+from orbit.py_linac.lattice import LinacApertureNode
+from orbit.py_linac.lattice_modifications import Add_quad_apertures_to_lattice
+from orbit.py_linac.lattice_modifications import Add_rfgap_apertures_to_lattice
+from orbit.py_linac.lattice_modifications import AddScrapersAperturesToLattice
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_LOSS = DEBUG_OFF
+
+SI_E_CHARGE = 1.602176634e-19   # [Coul]
+
+def addApertures(accLattice, scrapers = ()):
+    """
+    Adds the apertures of the quads and RF gaps and the scrapers
+    [(node name, x size [m], y size [m]), ...] to the lattice.
+    Returns the list of the aperture nodes.
+    """
+    aprtNodes = Add_quad_apertures_to_lattice(accLattice)
+    aprtNodes = Add_rfgap_apertures_to_lattice(accLattice,aprtNodes)
+    for (node_name,x_size,y_size) in scrapers:
+        aprtNodes = AddScrapersAperturesToLattice(accLattice,node_name,x_size,y_size,aprtNodes)
+    print '-> {} aperture nodes added'.format(len(aprtNodes))
+    return aprtNodes
+
+class AcLossMap:
+    """
+    Books the lost particles of the aperture nodes: the number of macro
+    particles and the beam power [W] for the beam current of the bunch
+    generator. The values of the rank are summed up in write().
+    """
+    def __init__(self, bunch_gen):
+        self.frequency = bunch_gen.bunch_frequency
+        self.lostbunch = Bunch()
+        self.macroSize = 0.
+        self.names = []         # aperture nodes in tracking order (the same for all ranks)
+        self.positions = {}     # node name: position [m]
+        self.losses = {}        # node name: [lost macro particles, lost energy [GeV]]
+
+    def addTo(self, paramsDict, actionsContainer):
+        """
+        Puts the lost bunch into paramsDict and the action into the AccActionsContainer.
+        """
+        paramsDict["lostbunch"] = self.lostbunch
+        actionsContainer.addAction(self, AccActionsContainer.EXIT)
+
+    def __call__(self, paramsDict):
+        node = paramsDict["node"]
+        if not isinstance(node,LinacApertureNode):
+            return
+        name = node.getName()
+        if name not in self.losses:
+            self.names.append(name)
+            self.positions[name] = node.getPosition()
+            self.losses[name] = [0,0.]
+        nLost = self.lostbunch.getSize()
+        if nLost == 0:
+            return
+        bunch = paramsDict["bunch"]
+        kinEnergy = bunch.getSyncParticle().kinEnergy()
+        self.losses[name][0] += nLost
+        self.losses[name][1] += sum([kinEnergy + self.lostbunch.pz(i) for i in range(nLost)])
+        self.macroSize = bunch.macroSize()
+        self.lostbunch.deleteAllParticles()
+        DEBUG_LOSS(__file__,lineno(),'{}: {} particles lost'.format(name,nLost))
+
+    def globalLosses(self, names):
+        """
+        Returns the lists of the lost macro particles and the beam power [W]
+        of all ranks for the aperture node names. All ranks have to call it.
+        """
+        comm = orbit_mpi.mpi_comm.MPI_COMM_WORLD
+        counts = [float(self.losses[name][0]) for name in names]
+        energies = [self.losses[name][1] for name in names]
+        macroSize = self.macroSize
+        if orbit_mpi.MPI_Comm_size(comm) > 1 and len(names) > 0:
+            counts = list(orbit_mpi.MPI_Allreduce(tuple(counts),mpi_datatype.MPI_DOUBLE,mpi_op.MPI_SUM,comm))
+            energies = list(orbit_mpi.MPI_Allreduce(tuple(energies),mpi_datatype.MPI_DOUBLE,mpi_op.MPI_SUM,comm))
+            macroSize = orbit_mpi.MPI_Allreduce(macroSize,mpi_datatype.MPI_DOUBLE,mpi_op.MPI_MAX,comm)
+        # power = lost particles per bunch * kinetic energy * bunch frequency
+        powers = [energy*1.e+9*SI_E_CHARGE*macroSize*self.frequency for energy in energies]
+        return ([int(count) for count in counts],powers)
+
+    def write(self, fileName, binLength = 1.):
+        """
+        Writes the losses per aperture node and per position bin of binLength [m]
+        (MPI rank 0 only). All ranks have to call it.
+        """
+        comm = orbit_mpi.mpi_comm.MPI_COMM_WORLD
+        names = self.names
+        (counts,powers) = self.globalLosses(names)
+        if orbit_mpi.MPI_Comm_rank(comm) != 0:
+            return
+        bins = {}
+        for (name,count,power) in zip(names,counts,powers):
+            if count == 0:
+                continue
+            bin_index = int(math.floor(self.positions[name]/binLength))
+            entry = bins.setdefault(bin_index,[0,0.])
+            entry[0] += count
+            entry[1] += power
+        with open(fileName,'w') as file:
+            file.write('# losses per aperture node\n')
+            file.write('Node position nLost power[W]\n')
+            for (name,count,power) in zip(names,counts,powers):
+                if count > 0:
+                    file.write(' %s  %10.6f  %d  %g\n'%(name,self.positions[name],count,power))
+            file.write('# losses per position bin of %g [m]\n'%binLength)
+            file.write('bin_start bin_end nLost power[W]\n')
+            for bin_index in sorted(bins.keys()):
+                (count,power) = bins[bin_index]
+                file.write(' %10.6f  %10.6f  %d  %g\n'%(bin_index*binLength,(bin_index+1)*binLength,count,power))
+        print '-> {} macro particles lost ({:.4g} [W]) at {} apertures, loss map written to {}'.format(
+            sum(counts),sum(powers),len([count for count in counts if count > 0]),fileName)
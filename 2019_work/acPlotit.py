@@ -1,12 +1,37 @@
 # -*- coding: utf-8 -*-
+"""
+Plots of the ALCELI linac results: the twiss table and the bunch dumps.
+
+Usage: python acPlotit.py
+          shows the plots of the files in CONF
+       python acPlotit.py --batch runs/ 'scan_*/' [--workers 8] [--force]
+          renders the twiss tables and bunch dumps (the CONF file names) in the
+          directories or globs without display to <file>.png next to them,
+          in parallel, skipping the PNG files newer than their data file
+"""
+import os
+import re
 import sys
+import glob
 import math
+import argparse
+import itertools
+import multiprocessing
 import numpy as np
+import matplotlib
+if '--batch' in sys.argv:
+   matplotlib.use('Agg')     # headless rendering, before pyplot is imported
 import matplotlib.pyplot as plt
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import json
 
 from acConf import CONF
+from acBunchIO import isBinaryDump, loadBunch, dumpFileNames
+
+# number of particles read and filtered at once
+CHUNK_SIZE = 1000000
+# particles drawn as points: the sample of the scatter plots, the outliers per density plot
+MAX_POINTS = 100000
 
 def display1(track_results):
    z=[]
@@ -75,14 +100,10 @@ def display1(track_results):
 
    plt.draw()
 
-def make_scatter(axScatter,x,y,whazit):
-#    max values
-   xmax = np.max(np.fabs(x))
-   ymax = np.max(np.fabs(y))
-
-   # the scatter plot
-   axScatter.scatter(x,y,s=1)
-
+def make_marginal_axes(axScatter,whazit):
+   """
+   Labels the phase space axes and returns the new axes (top, right) of the projections.
+   """
    # set tick label size
    axScatter.tick_params(labelsize='xx-small')
 
@@ -99,6 +120,36 @@ def make_scatter(axScatter,x,y,whazit):
 
    # make some labels invisible
    plt.setp(axHistx.get_xticklabels() + axHisty.get_yticklabels(), visible=False)
+   return (axHistx,axHisty)
+
+def make_density(axDensity,plane,whazit):
+   """
+   Phase space plot as 2D histogram of CONF['density_bins']**2 bins with the
+   projections computed from it. The drawing cost does not depend on the
+   number of particles. The particles in bins with at most CONF['outlier_count']
+   particles are drawn as points (0: none).
+   """
+   (xmax,ymax) = (plane.xmax,plane.ymax)
+   # the density raster, empty bins transparent
+   axDensity.imshow(np.ma.masked_equal(plane.density.T,0.),origin='lower',extent=(-xmax,xmax,-ymax,ymax),
+      aspect='auto',interpolation='nearest',cmap='viridis')
+   if len(plane.outliers) > 0:
+      outliers = np.concatenate(plane.outliers)
+      axDensity.scatter(outliers[:,0],outliers[:,1],s=1,color='red')
+   (axHistx,axHisty) = make_marginal_axes(axDensity,whazit)
+
+   # the projections
+   axHistx.step(plane.edgesx[:-1],plane.density.sum(axis=1),where='post')
+   axHisty.step(plane.density.sum(axis=0),plane.edgesy[:-1],where='post')
+
+def make_scatter(axScatter,x,y,whazit):
+#    max values
+   xmax = np.max(np.fabs(x))
+   ymax = np.max(np.fabs(y))
+
+   # the scatter plot
+   axScatter.scatter(x,y,s=1)
+   (axHistx,axHisty) = make_marginal_axes(axScatter,whazit)
 
    # now determine nice binning limits by hand
    binwidthx=xmax/100.
@@ -122,75 +173,248 @@ def make_scatter(axScatter,x,y,whazit):
       tl.set_visible(False)
    axHisty.set_xticks([0,50,100])
 
-def display2(bunch,whazit):
-   x=[]; px=[]; y=[]; py=[];z=[]; pz=[]
-   count_NaNs = 0
-   count_out_limits = 0
-   for bunchItem in bunch:
-      # skip items with NaNs
-      found_NaN = False
-      for i in range(6):
-         found_NaN = bunchItem[i] != bunchItem[i]
-      if found_NaN:
-         count_NaNs += 1
-         continue
-      x0  = bunchItem[0]*1.e3     #[mm]
-      px0 = bunchItem[1]*1.e3     #[mrad]
-      y0  = bunchItem[2]*1.e3     #[mm]
-      py0 = bunchItem[3]*1.e3     #[mrad]
-      z0  = bunchItem[4]*1.e3     #[mm]
-      pz0 = bunchItem[5]*1.e3     #[MeV]
-      if not CONF['ingnore_limits'] and (CONF['limx'] <= abs(x0) or CONF['limxp'] <= abs(px0) or CONF['limy'] <= abs(y0) or CONF['limyp'] <= abs(py0) or CONF['limz'] <= abs(z0) or CONF['limzp'] <= abs(pz0)):
-         count_out_limits += 1
-         continue
-      x.append(x0)
-      px.append(px0)
-      y.append(y0)
-      py.append(py0)
-      z.append(z0)
-      pz.append(pz0)
-   print '{} NaN, {}/{} off-limits/total'.format(count_NaNs,count_out_limits,len(bunch))
+def filter_chunks(chunks,counts):
+   """
+   Yields the (n,6) arrays of x[mm],px[mrad],y[mm],py[mrad],z[mm],dW[MeV] of the
+   particles of the chunks (see load_bunch_chunks) without NaNs inside the
+   CONF['lim*'] limits. counts is the dictionary of the numbers of 'total',
+   'NaN', 'off_limits' and 'kept' particles, updated chunk by chunk.
+   """
+   limits = np.array([CONF['limx'],CONF['limxp'],CONF['limy'],CONF['limyp'],CONF['limz'],CONF['limzp']])
+   for key in ('total','NaN','off_limits','kept'):
+      counts[key] = 0
+   for chunk in chunks:
+      coords = chunk*1.e3
+      keep = ~np.isnan(coords).any(axis=1)
+      counts['total'] += len(coords)
+      counts['NaN'] += len(coords) - np.count_nonzero(keep)
+      if not CONF['ingnore_limits']:
+         with np.errstate(invalid='ignore'):    # NaNs are outside
+            inside = (np.abs(coords) < limits).all(axis=1)
+         counts['off_limits'] += np.count_nonzero(keep & ~inside)
+         keep &= inside
+      counts['kept'] += np.count_nonzero(keep)
+      yield coords[keep]
+
+class PhasePlane:
+   """
+   The density histogram of the coordinates (ix,iy) of the phase space plot,
+   accumulated chunk by chunk, and at most MAX_POINTS particles as points
+   (the sample of the scatter plot or the outliers of the density plot).
+   """
+   def __init__(self,ix,iy,label,xmax,ymax):
+      self.ix = ix
+      self.iy = iy
+      self.label = label
+      self.xmax = max(xmax,1.e-30)
+      self.ymax = max(ymax,1.e-30)
+      nBins = CONF['density_bins']
+      self.density = np.zeros((nBins,nBins))
+      self.edgesx = np.linspace(-self.xmax,self.xmax,nBins+1)
+      self.edgesy = np.linspace(-self.ymax,self.ymax,nBins+1)
+      self.outliers = []
+      self.nOutliers = 0
+
+   def bins(self,coords):
+      nBins = CONF['density_bins']
+      bx = np.clip(((coords[:,self.ix]+self.xmax)*(nBins/(2.*self.xmax))).astype(int),0,nBins-1)
+      by = np.clip(((coords[:,self.iy]+self.ymax)*(nBins/(2.*self.ymax))).astype(int),0,nBins-1)
+      return (bx,by)
+
+   def add(self,coords):
+      self.density += np.histogram2d(coords[:,self.ix],coords[:,self.iy],bins=(self.edgesx,self.edgesy))[0]
+
+   def addOutliers(self,coords):
+      if self.nOutliers >= MAX_POINTS:
+         return
+      (bx,by) = self.bins(coords)
+      outliers = coords[self.density[bx,by] <= CONF['outlier_count']][:MAX_POINTS-self.nOutliers]
+      self.outliers.append(outliers[:,(self.ix,self.iy)])
+      self.nOutliers += len(outliers)
+
+def display2(fileName,whazit):
+   """
+   Phase space plots of the bunch dump. The dump is read chunk by chunk in
+   passes (limits, histograms or sample, outliers), so the memory does not
+   grow with the number of particles.
+   """
+   counts = {}
+   amax = np.zeros(6)
+   for coords in filter_chunks(load_bunch_chunks(fileName),counts):
+      if len(coords) > 0:
+         amax = np.maximum(amax,np.abs(coords).max(axis=0))
+   print '{} NaN, {}/{} off-limits/total'.format(counts['NaN'],counts['off_limits'],counts['total'])
 
+   labels = (('x[mm],px[mrad]',0,1),('y[mm],py[mrad]',2,3),('x[mm],y[mm]',0,2),('z[mm],dW[Mev]',4,5))
+   planes = [PhasePlane(ix,iy,label,amax[ix],amax[iy]) for (label,ix,iy) in labels]
+   if CONF['phaseSpacePlot'] == 'density':
+      kind = 'density'
+      for coords in filter_chunks(load_bunch_chunks(fileName),counts):
+         for plane in planes:
+            plane.add(coords)
+      if CONF['outlier_count'] > 0:
+         for coords in filter_chunks(load_bunch_chunks(fileName),counts):
+            for plane in planes:
+               plane.addOutliers(coords)
+   else:
+      # every stride-th particle, at most MAX_POINTS
+      kind = 'scatter'
+      stride = max(1,int(math.ceil(counts['kept']/float(MAX_POINTS))))
+      (sample,index) = ([],0)
+      for coords in filter_chunks(load_bunch_chunks(fileName),counts):
+         sample.append(coords[(-index)%stride::stride])
+         index += len(coords)
+      sample = np.concatenate(sample) if len(sample) > 0 else np.empty((0,6))
    width= 9.;   height = 8.
-   fig = plt.figure(CONF['title']+", scatter plots@"+whazit,figsize=(width,height))
-   ax1 = plt.subplot(221)
-   make_scatter(ax1,x,px,'x[mm],px[mrad]')     #x,px
-   ax2 = plt.subplot(222)
-   make_scatter(ax2,y,py,'y[mm],py[mrad]')     #y,py
-   ax3 = plt.subplot(223)
-   make_scatter(ax3,x,y,'x[mm],y[mm]')         #x,y
-   ax4 = plt.subplot(224)
-   make_scatter(ax4,z,pz,'z[mm],dW[Mev]')      #z,pz
+   fig = plt.figure(CONF['title']+", "+kind+" plots@"+whazit,figsize=(width,height))
+   for (number,plane) in enumerate(planes):
+      ax = plt.subplot(221+number)
+      if kind == 'density':
+         make_density(ax,plane,plane.label)
+      else:
+         make_scatter(ax,sample[:,plane.ix],sample[:,plane.iy],plane.label)
+
+def load_twiss(fileName):
+   """
+   Returns the records of the twiss table written by acDiagnostics.AcTwissRecorder.
+   """
+   records=[]
+   with open(fileName,'r') as file:
+      columns = file.readline().split()
+      for line in file:
+         row = dict(zip(columns,line.split()))
+         records.append(dict(
+            position = float(row['position']),
+            betax    = float(row['betaX']),
+            betay    = float(row['betaY']),
+            betaz    = float(row['betaZ']),
+            xrms     = float(row['sizeX']),
+            yrms     = float(row['sizeY']),
+            zrms_deg = float(row['sizeZ_deg']),
+            emittx   = float(row['emittX']),
+            emittxn  = float(row['normEmittX']),
+            emitty   = float(row['emittY']),
+            emittyn  = float(row['normEmittY']),
+            viseo    = 0.))
+   return records
+
+def load_bunch_chunks(fileName, chunk_size = CHUNK_SIZE):
+   """
+   Yields the bunch dump in (n,6) arrays of (x,px,y,py,z,dE) of at most
+   chunk_size particles. Binary dumps are memory-mapped, text dumps are
+   parsed chunk by chunk with NumPy, so the memory stays bounded.
+   The dumps of the MPI ranks (fileName.<rank>) are read one after the other.
+   """
+   for name in dumpFileNames(fileName):
+      for chunk in load_file_chunks(name,chunk_size):
+         yield chunk
+
+def load_file_chunks(fileName, chunk_size):
+   if isBinaryDump(fileName):
+      (header,data) = loadBunch(fileName)
+      for start in range(0,data.shape[1],chunk_size):
+         yield data[:6,start:start+chunk_size].T
+      return
+   with open(fileName,'r') as file:
+      nColumns = None
+      while True:
+         lines = list(itertools.islice(file,chunk_size))
+         if len(lines) == 0:
+            break
+         lines = [line for line in lines if line[0] != '%' and line.strip() != '']
+         if len(lines) == 0:
+            continue
+         if nColumns == None:
+            nColumns = len(lines[0].split())
+         values = np.fromstring(''.join(lines),sep=' ')
+         yield values.reshape(-1,nColumns)[:,:6]
+
+def batch_files(patterns):
+   """
+   Returns the sorted list of the twiss tables and bunch dumps with the CONF
+   file names in the directories (recursively) or matching the globs.
+   """
+   names = set([CONF['twiss_filename'],CONF['bunchIn_filename'],CONF['bunchOut_filename']])
+   def data_file(path):
+      # the dumps of the MPI ranks <name>.<rank> are one file
+      match = re.match(r'(.*)\.\d+$',path)
+      if os.path.basename(path) not in names and match != None:
+         path = match.group(1)
+      return path if os.path.basename(path) in names else None
+   files = set()
+   for pattern in patterns:
+      for path in glob.glob(pattern):
+         if os.path.isdir(path):
+            for (dirpath,dirnames,filenames) in os.walk(path):
+               files.update([data_file(os.path.join(dirpath,name)) for name in filenames])
+         else:
+            files.add(data_file(path))
+   files.discard(None)
+   return sorted(files)
+
+def is_up_to_date(fileName,pngName):
+   return os.path.exists(pngName) and os.path.getmtime(pngName) >= max([os.path.getmtime(name) for name in dumpFileNames(fileName)])
+
+def render(fileName):
+   """
+   Renders the plots of the twiss table or the bunch dump to fileName.png.
+   Returns (fileName, error message or None).
+   """
+   try:
+      if os.path.basename(fileName) == CONF['twiss_filename']:
+         display1(load_twiss(fileName))
+      else:
+         display2(fileName,fileName)
+      plt.savefig(fileName+'.png')
+      return (fileName,None)
+   except Exception as error:
+      return (fileName,'{}: {}'.format(error.__class__.__name__,error))
+   finally:
+      plt.close('all')
+
+def render_batch(patterns,workers,force = False):
+   """
+   Renders the files of the directories or globs that have no up-to-date PNG with a process pool.
+   """
+   files = batch_files(patterns)
+   todo = [fileName for fileName in files if force or not is_up_to_date(fileName,fileName+'.png')]
+   print '-> {} files, {} up to date, rendering {} with {} workers'.format(len(files),len(files)-len(todo),len(todo),workers)
+   if workers > 1 and len(todo) > 1:
+      pool = multiprocessing.Pool(workers)
+      results = pool.imap_unordered(render,todo)
+   else:
+      pool = None
+      results = itertools.imap(render,todo)
+   failed = 0
+   for (fileName,error) in results:
+      if error != None:
+         failed += 1
+         print '   {} failed: {}'.format(fileName,error)
+      else:
+         print '   {}.png'.format(fileName)
+   if pool != None:
+      pool.close()
+      pool.join()
+   print '-> {} PNG files rendered, {} failed'.format(len(todo)-failed,failed)
 
 def main():
+   parser = argparse.ArgumentParser(description = 'plots of the ALCELI linac results')
+   parser.add_argument('--batch',   nargs = '+', default = None, help = 'directories or globs of run outputs to render to PNG files')
+   parser.add_argument('--workers', default = multiprocessing.cpu_count(), type = int, help = 'number of worker processes of the batch')
+   parser.add_argument('--force',   action = 'store_true', help = 'render also the up-to-date PNG files')
+   args = parser.parse_args()
+   if args.batch != None:
+      render_batch(args.batch,args.workers,args.force)
+      return
+
    if CONF['twissPlot']:
-      with open(CONF['twiss_filename'],"r") as f:
-         twiss_data = json.load(f)     # get the whole file in ram
-         display1(twiss_data)
+      display1(load_twiss(CONF['twiss_filename']))
 
    if CONF['dumpBunchIN']:
-      bunch_in=[]
-      with open(CONF['bunchIn_filename'],'r') as file:
-         for line in file:
-            if line[0] == '%':
-               continue
-            else:
-               line = line.split(' ')
-               kovector = [float(line[i]) for i in range(len(line)-1)]
-               bunch_in.append(kovector)
-      display2(bunch_in,'IN')
+      display2(CONF['bunchIn_filename'],'IN')
 
    if CONF['dumpBunchOUT']:
-      bunch_out=[]
-      with open(CONF['bunchOut_filename'],'r') as file:
-         for line in file:
-            if line[0] == '%':
-               continue
-            else:
-               line = line.split(' ')
-               kovector = [float(line[i]) for i in range(len(line)-1)]
-               bunch_out.append(kovector)
-      display2(bunch_out,'OUT')
+      display2(CONF['bunchOut_filename'],'OUT')
 
    plt.show()
 
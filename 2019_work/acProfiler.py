@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Opt-in profiler of the pyORBIT ALCELI linac bunch tracking.
+
+AcTrackingProfiler registers an ENTRANCE and an EXIT action in an
+AccActionsContainer. Because the actions are called for the child nodes
+too (FringeField, TiltElement, thin nodes inside the thick ones), the
+profiler keeps a stack of open nodes and books for every node the wall
+time spent in its own trackBunch, i.e. without the time of its children.
+The times are aggregated by node class, by sequence and by the number of
+particles in the bunch (power of 2 buckets).
+"""
+
+import time
+import json
+
+import orbit_mpi
+from orbit.lattice import AccActionsContainer
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_PROF = DEBUG_OFF
+
+def particleBucket(nParticles):
+    """
+    Returns the smallest power of 2 >= nParticles.
+    """
+    bucket = 1
+    while bucket < nParticles:
+        bucket *= 2
+    return bucket
+
+class AcTrackingProfiler:
+    """
+    Records the wall time of every node.trackBunch call during tracking.
+    """
+    def __init__(self):
+        self.stack = []
+        self.byClass = {}
+        self.bySequence = {}
+        self.byParticles = {}
+        self.total = 0.
+
+    def addActionsTo(self, actionsContainer):
+        """
+        Adds the profiler actions to an AccActionsContainer. Add them before
+        other EXIT actions to keep their cost out of the node times.
+        """
+        actionsContainer.addAction(self.entrance, AccActionsContainer.ENTRANCE)
+        actionsContainer.addAction(self.exit, AccActionsContainer.EXIT)
+
+    def entrance(self, paramsDict):
+        self.stack.append([paramsDict["node"], time.time(), 0.])
+
+    def exit(self, paramsDict):
+        stop = time.time()
+        (node, start, children_time) = self.stack.pop()
+        elapsed = stop - start
+        if len(self.stack) > 0:
+            self.stack[-1][2] += elapsed
+        else:
+            self.total += elapsed
+        own_time = elapsed - children_time
+        seq = node.getSequence() if hasattr(node,'getSequence') else None
+        seq_name = seq.getName() if seq != None else 'None'
+        nParticles = paramsDict["bunch"].getSize()
+        self._book(self.byClass, node.__class__.__name__, own_time)
+        self._book(self.bySequence, seq_name, own_time)
+        self._book(self.byParticles, particleBucket(nParticles), own_time)
+
+    def _book(self, stats, key, own_time):
+        entry = stats.get(key)
+        if entry == None:
+            entry = stats[key] = [0,0.]
+        entry[0] += 1
+        entry[1] += own_time
+
+    def _rows(self, stats):
+        """
+        Returns [(key, calls, time[s]), ...] sorted by decreasing time.
+        """
+        rows = [(key, calls, t) for key,(calls,t) in stats.items()]
+        rows.sort(key = lambda row: row[2], reverse = True)
+        return rows
+
+    def report(self):
+        """
+        Returns the profile as a table in a string.
+        """
+        s = '-> Tracking profile: total {:.3f} [sec]\n'.format(self.total)
+        for (title, stats) in (('node class',self.byClass),('sequence',self.bySequence),('particles <=',self.byParticles)):
+            s += '{:<20} {:>10} {:>12} {:>12} {:>7}\n'.format(title,'calls','time[sec]','mean[usec]','%')
+            for (key, calls, t) in self._rows(stats):
+                percent = 100.*t/self.total if self.total > 0. else 0.
+                s += '{:<20} {:>10d} {:>12.4f} {:>12.2f} {:>7.2f}\n'.format(str(key),calls,t,1.e+6*t/calls,percent)
+        return s
+
+    def dump(self, fileName):
+        """
+        Prints the report and writes the profile to a JSON file (MPI rank 0 only).
+        """
+        comm = orbit_mpi.mpi_comm.MPI_COMM_WORLD
+        if orbit_mpi.MPI_Comm_rank(comm) != 0:
+            return
+        print self.report()
+        profile = {
+            'total'       : self.total,
+            'byClass'     : self._rows(self.byClass),
+            'bySequence'  : self._rows(self.bySequence),
+            'byParticles' : self._rows(self.byParticles),
+            }
+        with open(fileName,'w') as file:
+            json.dump(profile, file, indent = 1)
+        print '-> tracking profile written to {}'.format(fileName)
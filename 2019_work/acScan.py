@@ -0,0 +1,211 @@
+#! /usr/bin/env python
+
+"""
+This script runs parameter scans of the ALCELI Linac.
+
+The scan is described in a JSON file, either as a list of points
+    {"points": [{"gap_phase": -30.}, {"gap_phase": -25., "current": 20.}]}
+or as a grid, i.e. the cartesian product of the value lists
+    {"grid": {"gap_phase": [-30., -25., -20.], "dB/dr_scale": [0.95, 1.0, 1.05]}}
+
+The parameters of a point are:
+    gap_phase    phase of all RF gaps in [deg]
+    E0TL_scale   factor for E0TL of all RF gaps
+    dB/dr_scale  factor for dB/dr of all quads
+    current      beam current in [mA]
+    alfax_i, betax_i, emitx_i, ... (the injection Twiss of the PARAMS)
+    <node name>:<param>  one parameter of one node, e.g. "QF1:dB/dr"
+                 (gap_phase in [deg])
+
+Every worker process builds the lattice once. The parameters of a point
+are set on the live nodes, all other values are restored to the lattice
+values before. Each point generates its bunch with CONF['bunch_seed'],
+tracks the design particle and the bunch and appends one row to the
+result table (final energy, emittances, sizes and transmission).
+
+Usage: ./START.sh acScan.py 1 scan.json --workers 4 --nParticles 2000 --out scan.dat
+"""
+
+import os
+import sys
+import time
+import json
+import math
+import argparse
+import itertools
+import multiprocessing
+
+from acLinac import makeLattice, getInjectionParams, makeBunchGenerator, simulinacRoot
+from acDistributions import AcGaussDist3D
+from acDiagnostics import bunchTwiss
+from acDesignCache import trackDesign
+from acConf import CONF
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+DEBUG_SCAN = DEBUG_OFF
+
+RESULT_COLUMNS = [
+    'eKin',
+    'emittX','emittY','emittZ','normEmittX','normEmittY',
+    'sizeX','sizeY','sizeZ_deg',
+    'transmission','time']
+
+class AcScanLattice:
+    """
+    The lattice of a worker with the lattice values of the scan parameters.
+    """
+    def __init__(self, accLattice, injection, current = 10.):
+        self.accLattice = accLattice
+        self.injection = injection
+        self.current = current
+        self.gaps = [(gap,gap.getParam("E0TL"),gap.getParam("gap_phase")) for gap in accLattice.getRF_Gaps()]
+        self.quads = [(quad,quad.getParam("dB/dr")) for quad in accLattice.getQuads()]
+        self.nodeValues = {}
+
+    def restore(self):
+        """
+        Restores the lattice values of all parameters.
+        """
+        for (gap,E0TL,gap_phase) in self.gaps:
+            gap.setParam("E0TL",E0TL)
+            self.setGapPhase(gap,gap_phase)
+        for (quad,dBdr) in self.quads:
+            quad.setParam("dB/dr",dBdr)
+        for ((node,param),value) in self.nodeValues.items():
+            node.setParam(param,value)
+
+    def setGapPhase(self, gap, phase):
+        """
+        Sets the gap phase in [rad] like the FACTORY does.
+        """
+        gap.setParam("gap_phase",phase)
+        if gap.isFirstRFGap():
+            gap.getRF_Cavity().setPhase(phase)
+
+    def apply(self, point):
+        """
+        Sets the parameters of the point on the lattice.
+        Returns (injection, current) for the bunch generator.
+        """
+        self.restore()
+        injection = dict(self.injection)
+        current = self.current
+        for (name,value) in sorted(point.items()):
+            if name == 'gap_phase':
+                for (gap,E0TL,gap_phase) in self.gaps:
+                    self.setGapPhase(gap,value*math.pi/180.)
+            elif name == 'E0TL_scale':
+                for (gap,E0TL,gap_phase) in self.gaps:
+                    gap.setParam("E0TL",E0TL*value)
+            elif name == 'dB/dr_scale':
+                for (quad,dBdr) in self.quads:
+                    quad.setParam("dB/dr",dBdr*value)
+            elif name == 'current':
+                current = value
+            elif name in injection:
+                injection[name] = value
+            elif ':' in name:
+                (node_name,param) = name.split(':',1)
+                node = self.accLattice.getNodeForName(node_name)
+                if node == None:
+                    raise ValueError('scan parameter {}: no node {} in the lattice'.format(name,node_name))
+                if (node,param) not in self.nodeValues:
+                    self.nodeValues[(node,param)] = node.getParam(param)
+                if param == 'gap_phase':
+                    self.setGapPhase(node,value*math.pi/180.)
+                else:
+                    node.setParam(param,value)
+            else:
+                raise ValueError('unknown scan parameter {}'.format(name))
+        return (injection,current)
+
+    def run(self, point, nParticles):
+        """
+        Tracks the bunch for the point and returns the dictionary of the RESULT_COLUMNS.
+        """
+        time_start = time.time()
+        (injection,current) = self.apply(point)
+        bunch_gen = makeBunchGenerator(injection, current = current)
+        bunch = bunch_gen.getBunch(nParticles = nParticles, distributorClass = AcGaussDist3D, seed = CONF['bunch_seed'])
+        nParts_in = bunch.getSizeGlobal()
+        self.accLattice.setLinacTracker(switch=True)
+        trackDesign(self.accLattice,bunch,CONF['design_cache_dir'],CONF['field_dir'])
+        self.accLattice.setLinacTracker(switch=False)    # use TeapotBase (TPB) tracking
+        self.accLattice.trackBunch(bunch)
+        result = bunchTwiss(bunch, bunch_gen)
+        result['transmission'] = float(result['Nparts'])/nParts_in if nParts_in > 0 else 0.
+        result['time'] = time.time() - time_start
+        DEBUG_SCAN(__file__,lineno(),'{} -> {}'.format(point,result))
+        return result
+
+# the AcScanLattice of the worker process
+scan_lattice = None
+
+def initWorker(names, xml_file_name):
+    """
+    Builds the lattice once per worker process.
+    """
+    global scan_lattice
+    (accLattice,acc_da) = makeLattice(names,xml_file_name)
+    scan_lattice = AcScanLattice(accLattice,getInjectionParams(acc_da))
+
+def runPoint(task):
+    (index,point,nParticles) = task
+    return (index,point,scan_lattice.run(point,nParticles))
+
+def readScanPoints(fileName):
+    """
+    Returns the list of points (dictionaries) of the scan file.
+    """
+    with open(fileName,'r') as file:
+        scan = json.load(file)
+    points = list(scan.get('points',[]))
+    grid = scan.get('grid',{})
+    if len(grid) > 0:
+        names = sorted(grid.keys())
+        for values in itertools.product(*[grid[name] for name in names]):
+            points.append(dict(zip(names,values)))
+    return points
+
+def main():
+    parser = argparse.ArgumentParser(description = 'ALCELI Linac parameter scan')
+    parser.add_argument('scan',                                         help = 'JSON scan file')
+    parser.add_argument('--workers',    default = multiprocessing.cpu_count(), type = int, help = 'number of worker processes')
+    parser.add_argument('--nParticles', default = 2000, type = int,     help = 'macro particles per point')
+    parser.add_argument('--out',        default = CONF['scan_filename'], help = 'result table')
+    parser.add_argument('--lattice',    default = None,                  help = 'lattice XML file, default: $SIMULINAC_ROOT/lattice.xml')
+    parser.add_argument('--sequences',  default = 'S25to200',            help = 'comma separated sequence names')
+    args = parser.parse_args()
+
+    points = readScanPoints(args.scan)
+    names = args.sequences.split(',')
+    xml_file_name = args.lattice if args.lattice != None else simulinacRoot+"/lattice.xml"
+    parameters = sorted(set(itertools.chain(*[point.keys() for point in points])))
+    tasks = [(index,point,args.nParticles) for (index,point) in enumerate(points)]
+    print "-> {} scan points with {} workers".format(len(points),args.workers)
+
+    time_start = time.time()
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, initWorker, (names,xml_file_name))
+        results = pool.imap_unordered(runPoint,tasks)
+    else:
+        pool = None
+        initWorker(names,xml_file_name)
+        results = itertools.imap(runPoint,tasks)
+    with open(args.out,'w') as file:
+        file.write(' '.join(['point']+parameters+RESULT_COLUMNS)+'\n')
+        for (index,point,result) in results:
+            s  = ' %d '%index
+            s += ' '.join(['%g'%point[name] if name in point else 'nan' for name in parameters])
+            s += '  '+' '.join(['%g'%result[name] for name in RESULT_COLUMNS])
+            file.write(s+'\n')
+            file.flush()
+            print "-> point {} done: T-final[MeV] {:.6f} transmission {:.4f}".format(index,result['eKin'],result['transmission'])
+    if pool != None:
+        pool.close()
+        pool.join()
+    print "-> {} scan points written to {} in {:4.2f} [sec]".format(len(points),args.out,time.time()-time_start)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+Adaptive slicing of the drifts, quads and bends of the ALCELI linac lattice.
+
+setMaxDriftLength() slices the whole lattice uniformly. AcAdaptiveSlicing
+is a slice length profile for AcLinacLatticeFactory.setSliceLengthProfile().
+It is estimated with the linear envelope (acEnvelope.py, with space charge)
+on a coarse lattice sliced with maxLength. For every node the slice length
+is the smaller of
+    tolerance/|d ln(rms size)/ds|     (variation of the beam size, z from
+                                       dz/ds = dE/(beta**2*gamma**3*m))
+    scTolerance/sqrt(k_sc)            (space charge phase advance,
+                                       k_sc the linear space charge strength)
+limited to minLength..maxLength.
+
+Usage: ./START.sh acSlicing.py 1 --uniform 0.01 --min 0.01 --max 0.2
+compares the adaptive and the uniform lattice: number of nodes and the
+difference of the envelopes (with space charge).
+"""
+
+import os
+import sys
+import time
+import math
+import bisect
+import argparse
+
+import numpy as np
+
+from acEnvelope import AcEnvelopeTracker, makeEnvelopeTracker, spaceChargeMatrix
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_SLICE = DEBUG_OFF
+
+class AcSliceEstimator(AcEnvelopeTracker):
+    """
+    Envelope tracker that keeps the sigma matrix at the exit of every node with a length.
+    """
+    def __init__(self, *args):
+        AcEnvelopeTracker.__init__(self, *args)
+        self.samples = []
+
+    def exit(self, paramsDict):
+        AcEnvelopeTracker.exit(self, paramsDict)
+        node = paramsDict["node"]
+        if node in self.nodes and node.getLength() > 0.:
+            bunch = paramsDict["bunch"]
+            syncPart = bunch.getSyncParticle()
+            start = node.getPosition() - node.getLength()/2.
+            self.samples.append((start,start+node.getLength(),self.sigma.copy(),syncPart.beta(),syncPart.gamma(),bunch.mass()))
+
+class AcAdaptiveSlicing:
+    """
+    The slice length profile: the slice lengths of the regions of the lattice.
+    """
+    def __init__(self, minLength = 0.01, maxLength = 0.2, tolerance = 0.01, scTolerance = 0.05):
+        self.minLength = minLength
+        self.maxLength = maxLength
+        self.tolerance = tolerance        # max. relative change of the rms sizes per slice
+        self.scTolerance = scTolerance    # max. space charge phase advance per slice [rad]
+        self.starts = []
+        self.ends = []
+        self.lengths = []
+
+    def sliceLength(self, sigma, beta, gamma, mass, bunch_charge):
+        """
+        Returns the slice length for the sigma matrix.
+        """
+        length = self.maxLength
+        # <u u'> of the planes, the z plane has dE [GeV] with dz/ds = dE/(beta**2*gamma**3*mass)
+        scales = (1.,1.,1./(beta**2*gamma**3*mass))
+        for (i,scale) in zip((0,2,4),scales):
+            correlation = sigma[i,i+1]*scale
+            if sigma[i,i] > 0. and correlation != 0.:
+                length = min(length,self.tolerance*sigma[i,i]/abs(correlation))
+        if bunch_charge != 0.:
+            m = spaceChargeMatrix(sigma,1.,bunch_charge,beta,gamma,mass)
+            k_sc = max(m[1,0],m[3,2])
+            if k_sc > 0.:
+                length = min(length,self.scTolerance/math.sqrt(k_sc))
+        return max(length,self.minLength)
+
+    def estimate(self, accLattice, bunch_gen, spaceCharge = True):
+        """
+        Estimates the profile with the envelope on the (coarse) lattice.
+        """
+        tracker = makeEnvelopeTracker(accLattice,bunch_gen,self.maxLength,spaceCharge,AcSliceEstimator)
+        tracker.track(bunch_gen.bunch)
+        self.starts = []
+        self.ends = []
+        self.lengths = []
+        for (start,end,sigma,beta,gamma,mass) in tracker.samples:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.lengths.append(self.sliceLength(sigma,beta,gamma,mass,tracker.bunch_charge))
+        DEBUG_SLICE(__file__,lineno(),'{} regions, slice lengths {} .. {}'.format(len(self.lengths),min(self.lengths),max(self.lengths)))
+        return self
+
+    def getSliceLength(self, start, end):
+        """
+        Returns the smallest slice length of the regions overlapping start..end.
+        """
+        ind = bisect.bisect_right(self.starts,end)
+        length = self.maxLength
+        while ind > 0 and self.ends[ind-1] >= start:
+            ind -= 1
+            length = min(length,self.lengths[ind])
+        return length
+
+def envelopeSizes(accLattice, bunch_gen, pos_step):
+    """
+    Returns the arrays (positions, sizes[X,Y,Z]) of the envelope with space charge.
+    """
+    tracker = makeEnvelopeTracker(accLattice,bunch_gen,pos_step,True)
+    tracker.track(bunch_gen.bunch)
+    positions = np.array([pos for (name,pos,twiss) in tracker.rows])
+    sizes = np.array([[twiss['sizeX'],twiss['sizeY'],twiss['sizeZ_deg']] for (name,pos,twiss) in tracker.rows])
+    return (positions,sizes)
+
+def main():
+    from acLatticeFactory import AcLinacLatticeFactory
+    from acLinac import getInjectionParams, makeBunchGenerator, simulinacRoot
+    from acConf import CONF
+    parser = argparse.ArgumentParser(description = 'adaptive slicing of the ALCELI linac lattice')
+    parser.add_argument('--lattice',    default = None,        help = 'lattice XML file, default: $SIMULINAC_ROOT/lattice.xml')
+    parser.add_argument('--sequences',  default = 'S25to200',  help = 'comma separated sequence names')
+    parser.add_argument('--uniform',    default = 0.01, type = float, help = 'uniform slice length [m]')
+    parser.add_argument('--min',        default = 0.01, type = float, help = 'min. adaptive slice length [m]')
+    parser.add_argument('--max',        default = 0.2,  type = float, help = 'max. adaptive slice length [m]')
+    parser.add_argument('--tolerance',  default = 0.01, type = float, help = 'max. relative size change per slice')
+    parser.add_argument('--scTolerance',default = 0.05, type = float, help = 'max. space charge phase advance per slice [rad]')
+    parser.add_argument('--current',    default = 10.,  type = float, help = 'beam current [mA]')
+    args = parser.parse_args()
+
+    names = args.sequences.split(',')
+    xml_file_name = args.lattice if args.lattice != None else simulinacRoot+"/lattice.xml"
+    factory = AcLinacLatticeFactory()
+    factory.setLatticeCacheDir(CONF['lattice_cache_dir'])
+
+    factory.setMaxDriftLength(args.uniform)
+    (uniformLattice,acc_da) = factory.getLinacAccLattice(names,xml_file_name)
+    bunch_gen = makeBunchGenerator(getInjectionParams(acc_da),current = args.current)
+
+    time_start = time.time()
+    slicing = AcAdaptiveSlicing(args.min,args.max,args.tolerance,args.scTolerance)
+    factory.setMaxDriftLength(args.max)
+    (coarseLattice,acc_da) = factory.getLinacAccLattice(names,xml_file_name)
+    slicing.estimate(coarseLattice,bunch_gen)
+    factory.setSliceLengthProfile(slicing)
+    (adaptiveLattice,acc_da) = factory.getLinacAccLattice(names,xml_file_name)
+    time_estimate = time.time() - time_start
+
+    (pos_u,sizes_u) = envelopeSizes(uniformLattice,bunch_gen,args.uniform)
+    (pos_a,sizes_a) = envelopeSizes(adaptiveLattice,bunch_gen,args.uniform)
+    nodes_u = len(uniformLattice.getNodes())
+    nodes_a = len(adaptiveLattice.getNodes())
+    print '-> profile estimated and lattice built in {:.2f} [sec]'.format(time_estimate)
+    print ' nodes uniform {:8d}  adaptive {:8d}  savings {:5.1f}%'.format(nodes_u,nodes_a,100.*(nodes_u-nodes_a)/nodes_u)
+    for (column,name) in enumerate(('sizeX[mm]','sizeY[mm]','sizeZ[deg]')):
+        interp = np.interp(pos_u,pos_a,sizes_a[:,column])
+        rel = np.abs(interp - sizes_u[:,column])/np.maximum(np.abs(sizes_u[:,column]),1.e-30)
+        print ' {:10s} max. rel. difference {:.2e}  final uniform {:.6g} adaptive {:.6g}'.format(
+            name,np.max(rel),sizes_u[-1,column],sizes_a[-1,column])
+
+if __name__ == '__main__':
+    main()
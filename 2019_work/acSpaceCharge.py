@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""
+Space charge nodes for the pyORBIT ALCELI linac.
+
+The space charge kicks are attached as child nodes at the boundaries of
+the lattice nodes (the drift, quad and bend slices of the FACTORY) with
+a path length of at least minLength between two kicks. The solvers are
+    '3dfft'    SpaceChargeCalc3D, 3D FFT Poisson solver on a grid (nx,ny,nz)
+    'ellipse'  SpaceChargeCalcUnifEllipse, field of nEllipses uniformly
+               charged ellipsoids (fast, no grid)
+
+The benchmark tracks the bunch with every solver setting (grid size,
+number of ellipsoids) and number of macro particles. It measures the
+time per kick and the emittances at the end, relative to the finest
+setting, to choose the cheapest adequate one.
+
+Usage: ./START.sh acSpaceCharge.py 1 --grids 16,32,64 --nParticles 2000,10000,50000 --length 10.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+from spacecharge import SpaceChargeCalc3D, SpaceChargeCalcUnifEllipse
+from orbit.space_charge.sc3d import setSC3DAccNodes, setUniformEllipsesSCAccNodes
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_SC = DEBUG_OFF
+
+SC_SOLVERS = ('3dfft','ellipse')
+
+BENCHMARK_COLUMNS = [
+    'solver','grid','nParticles','nKicks','time_per_kick[ms]','time[sec]',
+    'normEmittX','normEmittY','emittZ','dEmittX','dEmittY','dEmittZ']
+
+def makeSpaceChargeCalc(solver = '3dfft', grid = (64,64,64), nEllipses = 1):
+    """
+    Returns the space charge calculator of the solver.
+    """
+    if solver == '3dfft':
+        return SpaceChargeCalc3D(grid[0],grid[1],grid[2])
+    if solver == 'ellipse':
+        return SpaceChargeCalcUnifEllipse(nEllipses)
+    raise ValueError('unknown space charge solver {}, use one of {}'.format(solver,SC_SOLVERS))
+
+def addSpaceChargeNodes(accLattice, solver = '3dfft', grid = (64,64,64), nEllipses = 1, minLength = 0.02):
+    """
+    Attaches the space charge nodes of the solver to the lattice.
+    Returns the list of the space charge nodes.
+    """
+    calc = makeSpaceChargeCalc(solver,grid,nEllipses)
+    if solver == '3dfft':
+        sc_nodes = setSC3DAccNodes(accLattice,minLength,calc)
+    else:
+        sc_nodes = setUniformEllipsesSCAccNodes(accLattice,minLength,calc)
+    lengths = [sc_node.getLengthOfSC() for sc_node in sc_nodes]
+    if len(lengths) > 0:
+        print '-> {} space charge nodes ({}), path lengths {:.4f} .. {:.4f} [m]'.format(
+            len(sc_nodes),solver,min(lengths),max(lengths))
+    return sc_nodes
+
+def settingName(solver, grid, nEllipses):
+    if solver == '3dfft':
+        return 'x'.join([str(size) for size in grid])
+    return str(nEllipses)
+
+def timePerKick(calc, bunch, nKicks = 10, length = 0.01):
+    """
+    Returns the mean time [sec] of a space charge kick of the calculator on the bunch.
+    The bunch is changed.
+    """
+    time_start = time.time()
+    for kick in range(nKicks):
+        calc.trackBunch(bunch,length)
+    return (time.time() - time_start)/nKicks
+
+def benchmarkSetting(names, xml_file_name, solver, grid, nEllipses, nParticles, minLength, length, nKicks, seed):
+    """
+    Tracks the bunch with the space charge setting up to the position length [m].
+    Returns the dictionary of the BENCHMARK_COLUMNS without the differences.
+    """
+    from acLinac import makeLattice, getInjectionParams, makeBunchGenerator
+    from acDistributions import AcGaussDist3D
+    from acDiagnostics import bunchTwiss
+    (accLattice,acc_da) = makeLattice(names,xml_file_name)
+    bunch_gen = makeBunchGenerator(getInjectionParams(acc_da))
+    calc = makeSpaceChargeCalc(solver,grid,nEllipses)
+    kick_time = timePerKick(calc,bunch_gen.getBunch(nParticles = nParticles, distributorClass = AcGaussDist3D, seed = seed),nKicks)
+
+    sc_nodes = addSpaceChargeNodes(accLattice,solver,grid,nEllipses,minLength)
+    bunch = bunch_gen.getBunch(nParticles = nParticles, distributorClass = AcGaussDist3D, seed = seed)
+    accLattice.trackDesignBunch(bunch)
+    accLattice.setLinacTracker(switch=False)    # use TeapotBase (TPB) tracking
+    nodes = [node for node in accLattice.getNodes() if node.getPosition() < length]
+    sc_node_set = set(sc_nodes)
+    nKicks = len([child for node in nodes for child in node.getAllChildren() if child in sc_node_set])
+    time_start = time.time()
+    for node in nodes:
+        node.trackBunch(bunch)
+    time_track = time.time() - time_start
+    twiss = bunchTwiss(bunch,bunch_gen)
+    result = {
+        'solver':solver, 'grid':settingName(solver,grid,nEllipses), 'nParticles':nParticles,
+        'resolution':grid[0]*grid[1]*grid[2] if solver == '3dfft' else nEllipses,
+        'nKicks':nKicks,
+        'time_per_kick[ms]':kick_time*1.e+3, 'time[sec]':time_track,
+        'normEmittX':twiss['normEmittX'], 'normEmittY':twiss['normEmittY'], 'emittZ':twiss['emittZ']}
+    DEBUG_SC(__file__,lineno(),result)
+    return result
+
+def main():
+    from acLinac import simulinacRoot
+    from acConf import CONF
+    parser = argparse.ArgumentParser(description = 'space charge solver benchmark of the ALCELI linac')
+    parser.add_argument('--lattice',    default = None,           help = 'lattice XML file, default: $SIMULINAC_ROOT/lattice.xml')
+    parser.add_argument('--sequences',  default = 'S25to200',     help = 'comma separated sequence names')
+    parser.add_argument('--solvers',    default = '3dfft,ellipse',help = 'comma separated solvers')
+    parser.add_argument('--grids',      default = '16,32,64',     help = 'comma separated (cubic) grid sizes of 3dfft')
+    parser.add_argument('--nEllipses',  default = '1,3',          help = 'comma separated numbers of ellipsoids')
+    parser.add_argument('--nParticles', default = '2000,10000,50000', help = 'comma separated numbers of macro particles')
+    parser.add_argument('--minLength',  default = CONF['sc_minLength'], type = float, help = 'min. path length between kicks [m]')
+    parser.add_argument('--length',     default = 1.e+10, type = float, help = 'track up to this position [m]')
+    parser.add_argument('--kicks',      default = 10, type = int, help = 'kicks for the time per kick')
+    parser.add_argument('--out',        default = 'sc_benchmark.dat', help = 'result table')
+    args = parser.parse_args()
+
+    # the benchmark attaches its own space charge nodes and needs all nodes
+    CONF['spaceCharge'] = None
+    CONF['compactLattice'] = False
+    names = args.sequences.split(',')
+    xml_file_name = args.lattice if args.lattice != None else simulinacRoot+"/lattice.xml"
+    settings = []
+    for solver in args.solvers.split(','):
+        if solver == '3dfft':
+            settings += [(solver,(int(size),)*3,1) for size in args.grids.split(',')]
+        else:
+            settings += [(solver,CONF['sc_grid'],int(n)) for n in args.nEllipses.split(',')]
+    results = []
+    for (solver,grid,nEllipses) in settings:
+        for nParticles in [int(n) for n in args.nParticles.split(',')]:
+            results.append(benchmarkSetting(names,xml_file_name,solver,grid,nEllipses,nParticles,
+                args.minLength,args.length,args.kicks,CONF['bunch_seed']))
+            print '-> {} {} with {} particles: {:.3f} [ms] per kick'.format(
+                solver,results[-1]['grid'],nParticles,results[-1]['time_per_kick[ms]'])
+
+    # the reference: the finest grid (3dfft before ellipse) with the most particles
+    reference = max(results, key = lambda result: (result['solver'] == '3dfft',result['resolution'],result['nParticles']))
+    with open(args.out,'w') as file:
+        file.write(' '.join(BENCHMARK_COLUMNS)+'\n')
+        for result in results:
+            for (name,diff) in (('normEmittX','dEmittX'),('normEmittY','dEmittY'),('emittZ','dEmittZ')):
+                result[diff] = (result[name] - reference[name])/reference[name] if reference[name] != 0. else 0.
+            s  = ' %s  %s  %d  %d '%(result['solver'],result['grid'],result['nParticles'],result['nKicks'])
+            s += '  %g  %g '%(result['time_per_kick[ms]'],result['time[sec]'])
+            s += '  '+'  '.join(['%g'%result[name] for name in BENCHMARK_COLUMNS[6:]])
+            file.write(s+'\n')
+            print s
+    print '-> reference {} {} with {} particles, results written to {}'.format(
+        reference['solver'],reference['grid'],reference['nParticles'],args.out)
+
+if __name__ == '__main__':
+    main()
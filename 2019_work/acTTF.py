@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""
+Transit time factor (TTF) polynomials of the RF gaps from on-axis field maps.
+
+For the on-axis field Ez(z) of a gap (centered at its electrical center)
+and kappa = 2*pi*frequency/(c*beta)
+    T(kappa)  =  int Ez*cos(kappa*z) dz / int Ez dz
+    S(kappa)  =  int Ez*sin(kappa*z) dz / int Ez dz
+    T'(kappa) = -int Ez*z*sin(kappa*z) dz / int Ez dz
+    S'(kappa) =  int Ez*z*cos(kappa*z) dz / int Ez dz
+are integrated on a grid of beta values in beta_min..beta_max (all at
+once with NumPy) and fitted by polynomials in kappa, the variable of the
+TTF polynomials of BaseRF_Gap used by the RfGapTTF gap model.
+
+The fits are cached as JSON files keyed by the field and the fit
+parameters. They can be set on the RF gaps of a lattice
+(addTTFsToLattice) or written into the TTFs of the lattice XML file:
+
+Usage: python acTTF.py lattice.xml --out lattice_ttf.xml [--order 4] [--fieldDir dir/]
+"""
+
+import os
+import sys
+import math
+import json
+import hashlib
+import argparse
+
+import numpy as np
+
+from acConf import CONF
+from acFieldTables import loadAxisField, isFieldTable
+
+# DEBUG
+from acDebugHelpers import caller_name, lineno, DEBUG_ON, DEBUG_OFF, DEXIT
+
+DEBUG_TTF = DEBUG_OFF
+
+TTF_CACHE_VERSION = 1
+CLIGHT = 2.99792458e+8      # [m/sec]
+POLY_NAMES = ("polyT","polyS","polyTP","polySP")
+
+def getKappa(frequency, beta):
+    return 2.*math.pi*frequency/(CLIGHT*np.asarray(beta))
+
+def ttfFunctions(z, Ez, kappa):
+    """
+    Returns the arrays (T, S, T', S') for the array of kappa [1/m].
+    z [m] and Ez are the on-axis field, z is shifted to the electrical center.
+    """
+    norm = np.trapz(Ez,z)
+    z = z - np.trapz(Ez*z,z)/norm
+    kz = np.outer(kappa,z)
+    (cos_kz,sin_kz) = (np.cos(kz),np.sin(kz))
+    T  =  np.trapz(Ez*cos_kz,z,axis=1)/norm
+    S  =  np.trapz(Ez*sin_kz,z,axis=1)/norm
+    Tp = -np.trapz(Ez*z*sin_kz,z,axis=1)/norm
+    Sp =  np.trapz(Ez*z*cos_kz,z,axis=1)/norm
+    return (T,S,Tp,Sp)
+
+def fitTTFs(z, Ez, frequency, beta_min, beta_max, order = 4, nBeta = 200):
+    """
+    Fits the TTF polynomials in kappa for beta_min..beta_max.
+    Returns (ttfs, errors): ttfs as in the lattice records of AcLinacLatticeFactory
+    {'beta_min','beta_max','polyT':(order,coefs),...} with the coefficients
+    in increasing powers and the max. absolute fit errors {'polyT':...}.
+    """
+    kappa = getKappa(frequency,np.linspace(beta_min,beta_max,nBeta))
+    ttfs = {'beta_min':beta_min, 'beta_max':beta_max}
+    errors = {}
+    for (poly_name,values) in zip(POLY_NAMES,ttfFunctions(z,Ez,kappa)):
+        coefs = np.polyfit(kappa,values,order)
+        errors[poly_name] = float(np.max(np.abs(np.polyval(coefs,kappa) - values)))
+        ttfs[poly_name] = (order,coefs[::-1].tolist())
+    return (ttfs,errors)
+
+def ttfCacheFileName(z, Ez, fit_params, cacheDir):
+    sha = hashlib.sha1(repr((TTF_CACHE_VERSION,fit_params)))
+    sha.update(np.ascontiguousarray(z).tostring())
+    sha.update(np.ascontiguousarray(Ez).tostring())
+    return os.path.join(cacheDir,'ttf_{}.json'.format(sha.hexdigest()))
+
+def loadTTFs(fileName, frequency, beta_min, beta_max, order = 4, nBeta = 200, cacheDir = None):
+    """
+    Returns (ttfs, errors) of fitTTFs() for the field table from the cache
+    or fits them and writes the cache. The parsed field table is cached in
+    cacheDir too, None switches both off.
+    """
+    (z,Ez) = loadAxisField(fileName,cacheDir = cacheDir)
+    if cacheDir == None:
+        return fitTTFs(z,Ez,frequency,beta_min,beta_max,order,nBeta)
+    fit_params = (frequency,beta_min,beta_max,order,nBeta)
+    cacheName = ttfCacheFileName(z,Ez,fit_params,cacheDir)
+    if os.path.exists(cacheName):
+        with open(cacheName,'r') as file:
+            cache = json.load(file)
+        return (cache['ttfs'],cache['errors'])
+    (ttfs,errors) = fitTTFs(z,Ez,frequency,beta_min,beta_max,order,nBeta)
+    if not os.path.isdir(cacheDir):
+        try:
+            os.makedirs(cacheDir)
+        except OSError:
+            pass    # made by another rank
+    tmpName = '{}.{}.tmp'.format(cacheName,os.getpid())
+    with open(tmpName,'w') as file:
+        json.dump({'file':fileName, 'fit':fit_params, 'ttfs':ttfs, 'errors':errors},file)
+    os.rename(tmpName,cacheName)
+    return (ttfs,errors)
+
+def setGapTTFs(rf_gap, ttfs):
+    """
+    Sets beta_min, beta_max and the TTF polynomials of the RF gap.
+    """
+    rf_gap.setParam("beta_min",ttfs["beta_min"])
+    rf_gap.setParam("beta_max",ttfs["beta_max"])
+    for (poly,poly_name) in zip(rf_gap.getTTF_Polynimials(),POLY_NAMES):
+        (order,coef_arr) = ttfs[poly_name]
+        poly.order(order)
+        for coef_ind in range(len(coef_arr)):
+            poly.coefficient(coef_ind,coef_arr[coef_ind])
+
+def addTTFsToLattice(accLattice, dir_location = '', order = 4, tolerance = None):
+    """
+    Fits the TTF polynomials for all RF gaps with a field table (EzFile)
+    in their beta_min..beta_max range and sets them on the gaps.
+    Gaps with a fit error above the tolerance are reported (None: no check).
+    Returns the number of RF gaps.
+    """
+    count = 0
+    bad_fits = []
+    for rf_gap in accLattice.getRF_Gaps():
+        if not (rf_gap.hasParam("EzFile") and isFieldTable(rf_gap.getParam("EzFile"))):
+            continue
+        (ttfs,errors) = loadTTFs(dir_location+rf_gap.getParam("EzFile"),
+            rf_gap.getRF_Cavity().getFrequency(),
+            rf_gap.getParam("beta_min"),rf_gap.getParam("beta_max"),
+            order,cacheDir = CONF['ttf_cache_dir'])
+        DEBUG_TTF(__file__,lineno(),'{}: fit errors {}'.format(rf_gap.getName(),errors))
+        if tolerance != None and max(errors.values()) > tolerance:
+            bad_fits.append((rf_gap.getName(),max(errors.values())))
+        setGapTTFs(rf_gap,ttfs)
+        count += 1
+    if len(bad_fits) > 0:
+        print '-> WARNING: TTF fit errors of {} RF gaps above {:.1e} (raise ttf_order or narrow beta_min..beta_max):'.format(len(bad_fits),tolerance)
+        for (name,error) in bad_fits:
+            print '   {:12s} {:.2e}'.format(name,error)
+    return count
+
+def addTTFsToDA(acc_da, dir_location = '', order = 4, beta_range = (0.1,0.9)):
+    """
+    Fits the TTF polynomials for all RFGAP accElements of the XML data adaptor
+    with a field table (EzFile) and writes them into their TTFs children.
+    The beta range of existing TTFs is kept. Returns the list of
+    (gap name, fit errors).
+    """
+    results = []
+    for seq_da in acc_da.childAdaptors():
+        if len(seq_da.childAdaptors("Cavities")) != 1:
+            continue
+        frequencies = {}
+        for cav_da in seq_da.childAdaptors("Cavities")[0].childAdaptors("Cavity"):
+            frequencies[cav_da.stringValue("name")] = cav_da.doubleValue("frequency")
+        for node_da in seq_da.childAdaptors("accElement"):
+            if node_da.stringValue("type") != "RFGAP":
+                continue
+            params_da = node_da.childAdaptors("parameters")[0]
+            fl_name = params_da.stringValue("EzFile")
+            if not isFieldTable(fl_name):
+                continue
+            if len(node_da.childAdaptors("TTFs")) == 0:
+                ttfs_da = node_da.createChild("TTFs")
+                ttfs_da.setValue("beta_min",beta_range[0])
+                ttfs_da.setValue("beta_max",beta_range[1])
+            ttfs_da = node_da.childAdaptors("TTFs")[0]
+            (ttfs,errors) = loadTTFs(dir_location+fl_name,
+                frequencies[params_da.stringValue("cavity")],
+                ttfs_da.doubleValue("beta_min"),ttfs_da.doubleValue("beta_max"),
+                order,cacheDir = CONF['ttf_cache_dir'])
+            for poly_name in POLY_NAMES:
+                if len(ttfs_da.childAdaptors(poly_name)) == 0:
+                    ttfs_da.createChild(poly_name)
+                poly_da = ttfs_da.childAdaptors(poly_name)[0]
+                (poly_order,coefs) = ttfs[poly_name]
+                poly_da.setValue("order",poly_order)
+                poly_da.setValue("pcoefs",coefs)
+            results.append((node_da.stringValue("name"),errors))
+    return results
+
+def main():
+    from orbit.utils.xml import XmlDataAdaptor
+    parser = argparse.ArgumentParser(description = 'TTF polynomials of the RF gaps from the field tables')
+    parser.add_argument('lattice',                                  help = 'lattice XML file')
+    parser.add_argument('--out',      default = None,               help = 'lattice XML file with the fitted TTFs')
+    parser.add_argument('--order',    default = 4, type = int,      help = 'order of the polynomials')
+    parser.add_argument('--fieldDir', default = CONF['field_dir'],  help = 'directory of the EzFiles')
+    args = parser.parse_args()
+
+    acc_da = XmlDataAdaptor.adaptorForFile(args.lattice)
+    results = addTTFsToDA(acc_da,args.fieldDir,args.order)
+    for (name,errors) in results:
+        print ' {:12s} '.format(name)+' '.join(['{} {:.2e}'.format(poly_name,errors[poly_name]) for poly_name in POLY_NAMES])
+    print '-> TTFs of {} RF gaps fitted'.format(len(results))
+    if args.out != None:
+        acc_da.writeToFile(args.out)
+        print '-> lattice with the fitted TTFs written to {}'.format(args.out)
+
+if __name__ == '__main__':
+    main()
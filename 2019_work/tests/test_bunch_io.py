@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+acBunchIO: header and columns of the binary bunch dump survive the round trip.
+
+Run from 2019_work: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import random
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import acBunchIO
+from acBunchIO import COLUMNS, bunchHeader, bunchColumns, writeColumns, loadBunch, dumpFileNames
+
+class SyncParticle:
+    """ the sync particle attributes read by bunchHeader() """
+    def x(self):  return 0.001
+    def y(self):  return -0.002
+    def z(self):  return 0.
+    def px(self): return 0.
+    def py(self): return 0.
+    def pz(self): return 0.0687
+    def kinEnergy(self): return 0.0025
+    def beta(self):  return 0.0729
+    def gamma(self): return 1.00266
+    def time(self):  return 1.5e-9
+
+class ListBunch:
+    """ the bunch accessors used by acBunchIO on a list of particles """
+    def __init__(self, particles):
+        self.particles = particles
+        self.sync = SyncParticle()
+    def getSyncParticle(self): return self.sync
+    def charge(self): return 1.
+    def classicalRadius(self): return 1.5347e-18
+    def macroSize(self): return 2.5e+5
+    def mass(self): return 0.939294
+    def getPartAttrNames(self): return []
+    def getSize(self): return len(self.particles)
+    def x(self, i):  return self.particles[i][0]
+    def px(self, i): return self.particles[i][1]
+    def y(self, i):  return self.particles[i][2]
+    def py(self, i): return self.particles[i][3]
+    def z(self, i):  return self.particles[i][4]
+    def pz(self, i): return self.particles[i][5]
+
+class BunchIOTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.block_size = acBunchIO.BLOCK_SIZE
+        acBunchIO.BLOCK_SIZE = 7    # several blocks and a partial one
+        rng = random.Random(1)
+        self.particles = [[rng.gauss(0.,1.e-3) for k in range(6)] for i in range(40)]
+
+    def tearDown(self):
+        acBunchIO.BLOCK_SIZE = self.block_size
+        shutil.rmtree(self.dir)
+
+    def write(self, fileName, bunch):
+        with open(fileName,'wb') as file:
+            return writeColumns(file,bunchHeader(bunch),bunchColumns(bunch))
+
+    def testRoundTrip(self):
+        fileName = os.path.join(self.dir,'bunch.dat')
+        bunch = ListBunch(self.particles)
+        nBytes = self.write(fileName,bunch)
+        self.assertEqual(nBytes,os.path.getsize(fileName))
+        (header,data) = loadBunch(fileName)
+        self.assertEqual(header['nParticles'],len(self.particles))
+        self.assertEqual(header['columns'],list(COLUMNS))
+        self.assertEqual(header['macro_size'],bunch.macroSize())
+        self.assertEqual(header['m0c2'],bunch.mass())
+        self.assertEqual(header['sync_coords'],[0.001,-0.002,0.])
+        self.assertEqual(header['sync_kinEnergy'],0.0025)
+        self.assertEqual(header['sync_time'],1.5e-9)
+        self.assertTrue(np.array_equal(data[:6].T,np.array(self.particles)))
+
+    def testEmptyBunch(self):
+        fileName = os.path.join(self.dir,'empty.dat')
+        self.write(fileName,ListBunch([]))
+        (header,data) = loadBunch(fileName)
+        self.assertEqual(header['nParticles'],0)
+        self.assertEqual(data.shape,(6,0))
+
+    def testRankFileNames(self):
+        fileName = os.path.join(self.dir,'bunchf.dat')
+        self.assertRaises(IOError,dumpFileNames,fileName)
+        for rank in range(3):
+            self.write('{}.{}'.format(fileName,rank),ListBunch(self.particles[rank::3]))
+        names = dumpFileNames(fileName)
+        self.assertEqual(names,['{}.{}'.format(fileName,rank) for rank in range(3)])
+        self.assertEqual(sum([loadBunch(name)[0]['nParticles'] for name in names]),len(self.particles))
+        self.write(fileName,ListBunch(self.particles))
+        self.assertEqual(dumpFileNames(fileName),[fileName])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+acDesignCache: the design state from the cache lets a fresh lattice track.
+
+Run from 2019_work: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from linac import BaseRfGap
+    from bunch import Bunch
+    from orbit.py_linac.lattice import LinacAccLattice, Sequence, RF_Cavity, BaseRF_Gap, Drift
+    from acCheckpoint import designState
+    from acDesignCache import trackDesign
+    HAVE_ORBIT = True
+except ImportError:
+    HAVE_ORBIT = False
+
+def makeLattice():
+    """
+    Returns a lattice of one sequence with drifts and one cavity of two RF gaps.
+    """
+    lattice = LinacAccLattice("test")
+    seq = Sequence("SEQ")
+    seq.setLinacAccLattice(lattice)
+    seq.setLength(0.6)
+    seq.setPosition(0.)
+    cav = RF_Cavity("CAV")
+    cav.setAmp(1.)
+    cav.setFrequency(402.5e+6)
+    cav.setPosition(0.3)
+    seq.addRF_Cavity(cav)
+    gapModel = BaseRfGap()
+    pos = 0.
+    for (index,length) in enumerate((0.1,0.2,0.3)):
+        drift = Drift("DR{}".format(index))
+        drift.setLength(length)
+        drift.setParam("pos",pos+length/2.)
+        seq.addNode(drift)
+        pos += length
+        if index == 2:
+            break
+        gap = BaseRF_Gap("GAP{}".format(index))
+        gap.setLength(0.)
+        gap.setParam("E0TL",0.0002)
+        gap.setParam("E0L",0.0002)
+        gap.setParam("mode",0.)
+        gap.setParam("gap_phase",-0.5)
+        gap.setParam("EzFile","")
+        gap.setParam("pos",pos)
+        cav.addRF_GapNode(gap)
+        if gap.isFirstRFGap():
+            cav.setPhase(gap.getParam("gap_phase"))
+        gap.setCppGapModel(gapModel)
+        seq.addNode(gap)
+    for node in seq.getNodes():
+        lattice.addNode(node)
+    lattice.initialize()
+    return lattice
+
+def makeBunch(nParticles = 0):
+    bunch = Bunch()
+    bunch.mass(0.939294)
+    bunch.charge(+1.0)
+    bunch.getSyncParticle().kinEnergy(0.0025)
+    for i in range(nParticles):
+        bunch.addParticle(1.e-4*i,0.,-1.e-4*i,0.,1.e-4*i,0.)
+    return bunch
+
+@unittest.skipIf(not HAVE_ORBIT, 'pyORBIT is not available')
+class DesignCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def track(self, lattice):
+        bunch = makeBunch(10)
+        lattice.trackBunch(bunch)
+        return bunch.getSyncParticle().kinEnergy()
+
+    def testCacheHitTracksOnFreshLattice(self):
+        designed = makeLattice()
+        sync = trackDesign(designed,makeBunch(),self.cacheDir)
+        self.assertEqual(len(os.listdir(self.cacheDir)),1)
+        self.assertEqual(sorted(sync.keys()),['GAP0','GAP1'])
+
+        fresh = makeLattice()
+        self.assertEqual(trackDesign(fresh,makeBunch(),self.cacheDir),sync)
+        self.assertEqual(designState(fresh),designState(designed))
+        for cav in fresh.getRF_Cavities():
+            self.assertTrue(cav.isDesignSetUp())
+        self.assertAlmostEqual(self.track(fresh),self.track(designed),places = 12)
+
+    def testChangedCavityPhaseMisses(self):
+        trackDesign(makeLattice(),makeBunch(),self.cacheDir)
+        lattice = makeLattice()
+        lattice.getRF_Cavities()[0].setPhase(-0.4)
+        trackDesign(lattice,makeBunch(),self.cacheDir)
+        self.assertEqual(len(os.listdir(self.cacheDir)),2)
+
+    def testChangedAxisFieldStepMisses(self):
+        lattice = makeLattice()
+        for gap in lattice.getRF_Gaps():
+            gap.z_step = 0.002
+        trackDesign(lattice,makeBunch(),self.cacheDir)
+        lattice = makeLattice()
+        for gap in lattice.getRF_Gaps():
+            gap.z_step = 0.001
+        trackDesign(lattice,makeBunch(),self.cacheDir)
+        self.assertEqual(len(os.listdir(self.cacheDir)),2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,111 @@
-import sys, os, math, argparse
+import sys, os, math, argparse, json
+import numpy as np
 import pandas as pd
 # import matplotlib
 # matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 
+CACHE_VERSION = 1
+CHUNK_SIZE    = 1000000     # rows read at once from the data source
+
+class ColumnCache(object):
+    """
+    Binary per column cache of a whitespace separated data source in the
+    directory <data source>.cache next to it: one .npy file per column and
+    meta.json with the mtime and the size of the data source. The cache is
+    dropped when the data source changes. Columns are read from the data
+    source only once, in chunks of CHUNK_SIZE rows.
+    """
+    def __init__(self,qfile_name,header):
+        self.qfile_name = qfile_name
+        self.header     = header
+        self.dir        = f'{qfile_name}.cache'
+        self.meta_name  = os.path.join(self.dir,'meta.json')
+        stat            = os.stat(qfile_name)
+        self.source     = dict(version=CACHE_VERSION, mtime=stat.st_mtime, size=stat.st_size, header=header)
+        self.meta       = self.read_meta()
+
+    def read_meta(self):
+        try:
+            with open(self.meta_name,'r') as file:
+                meta = json.load(file)
+        except (IOError,OSError,ValueError):
+            return dict(names=None, columns=[])
+        if meta.get('source') != self.source:
+            return dict(names=None, columns=[])
+        return dict(names=meta['names'], columns=meta['columns'])
+
+    def write_meta(self):
+        meta = dict(source=self.source, names=self.column_names(), columns=self.meta['columns'])
+        tmp_name = f'{self.meta_name}.{os.getpid()}.tmp'
+        with open(tmp_name,'w') as file:
+            json.dump(meta,file)
+        os.replace(tmp_name,self.meta_name)
+
+    def column_names(self):
+        """ all column names of the data source """
+        if self.meta['names'] == None:
+            if self.header:
+                columns = pd.read_csv(self.qfile_name, sep=r"\s+", nrows=0).columns
+            else:
+                columns = pd.read_csv(self.qfile_name, header=None, sep=r"\s+", nrows=1).columns
+            self.meta['names'] = [str(name) for name in columns]
+        return self.meta['names']
+
+    def column_file(self,name):
+        return os.path.join(self.dir,f'{self.column_names().index(name)}.npy')
+
+    def read_source(self,names):
+        """ dictionary of the arrays of the columns read from the data source """
+        all_names = self.column_names()
+        missing   = [name for name in names if name not in all_names]
+        if len(missing) > 0:
+            raise KeyError(f'columns {missing} not in {self.qfile_name}, columns are {all_names}')
+        usecols = [all_names.index(name) for name in names]
+        if self.header:
+            reader = pd.read_csv(self.qfile_name, sep=r"\s+", usecols=usecols, chunksize=CHUNK_SIZE)
+        else:
+            reader = pd.read_csv(self.qfile_name, header=None, sep=r"\s+", usecols=usecols, chunksize=CHUNK_SIZE)
+        parts = dict((name,[]) for name in names)
+        for chunk in reader:
+            # the chunk has the columns in the order of the data source
+            for name,index in zip(names,usecols):
+                parts[name].append(chunk.iloc[:,sorted(usecols).index(index)].to_numpy())
+        columns = {}
+        for name in names:
+            columns[name] = np.concatenate(parts[name]) if len(parts[name]) > 0 else np.empty(0)
+        return columns
+
+    def load(self,names):
+        """ dictionary of the arrays of the columns, from the cache if possible """
+        cached  = set(self.meta['columns'])
+        columns = {}
+        for name in names:
+            if name in cached:
+                columns[name] = np.load(self.column_file(name), allow_pickle=False)
+        missing = [name for name in names if name not in cached]
+        if len(missing) == 0:
+            return columns
+        columns.update(self.read_source(missing))
+        try:
+            if not os.path.isdir(self.dir):
+                os.makedirs(self.dir)
+            if len(self.meta['columns']) == 0:
+                # stale or no cache: drop the old column files
+                for file_name in os.listdir(self.dir):
+                    if file_name.endswith('.npy'):
+                        os.remove(os.path.join(self.dir,file_name))
+            for name in missing:
+                values = columns[name]
+                if values.dtype == object:
+                    values = values.astype(str)
+                np.save(self.column_file(name), values, allow_pickle=False)
+            self.meta['columns'] = self.meta['columns'] + missing
+            self.write_meta()
+        except OSError as error:
+            print(f'no column cache for {self.qfile_name}: {error}')
+        return columns
+
 class PandaPlotter(object):
     def __init__(self,args):
         # print(args)
@@ -15,14 +117,28 @@ class PandaPlotter(object):
         self.ordinate2  = None
         self.ordinate3  = None
         self.ordinate4  = None
-        qfile_name = f'{self.dir}/{self.file}' 
+        qfile_name = f'{self.dir}/{self.file}'
         self.qfile_name = os.path.normpath(qfile_name)
         # print(f'data source: {qfile_name}')
         header    = not self.header
-        if header:
-            self.df = pd.read_csv(qfile_name, sep="\s+")
-        else:
-            self.df = pd.read_csv(qfile_name, header=None, sep="\s+")
+        self.cache = ColumnCache(self.qfile_name,header)
+        self.df    = pd.DataFrame()
+        # only the columns to plot are read, all if none are given
+        columns    = self.plot_columns(args)
+        self.load_columns(columns if len(columns) > 0 else self.cache.column_names())
+
+    def plot_columns(self,args):
+        columns = [args.get(key) for key in ('x','y','y2','y3','y4')]
+        return [str(column) for column in columns if column != None]
+
+    def load_columns(self,columns):
+        """ adds the missing columns to the data frame """
+        missing = [column for column in columns if column not in self.df.columns]
+        if len(missing) == 0:
+            return
+        loaded = self.cache.load(missing)
+        for column in missing:
+            self.df[column] = loaded[column]
 
     def do_plot(self,args):
         self.abscissa   = args.get('x')
@@ -30,16 +146,17 @@ class PandaPlotter(object):
         self.ordinate2  = args.get('y2')
         self.ordinate3  = args.get('y3')
         self.ordinate4  = args.get('y4')
+        self.load_columns(self.plot_columns(args))
 
-        x_column        = self.abscissa
-        y1_column       = self.ordinate1
+        x_column        = str(self.abscissa)
+        y1_column       = str(self.ordinate1)
         y2_column       = self.ordinate2
         y3_column       = self.ordinate3
         y4_column       = self.ordinate4
         y_columns       = [y1_column]
-        if y2_column != None: y_columns.append(y2_column)
-        if y3_column != None: y_columns.append(y3_column)
-        if y4_column != None: y_columns.append(y4_column)
+        if y2_column != None: y_columns.append(str(y2_column))
+        if y3_column != None: y_columns.append(str(y3_column))
+        if y4_column != None: y_columns.append(str(y4_column))
         print('================================================================================================================')
         print(f'plotting ordinates "{y_columns}" against abscissa "{x_column}"')
         print('================================================================================================================')
@@ -47,6 +164,10 @@ class PandaPlotter(object):
         self.df.plot(x_column,y_columns,linestyle='-',linewidth="0.6", title=self.qfile_name)
         plt.show()
     def data_info(self):
+        """ all columns of the data source and the info of the loaded ones """
+        names = self.cache.column_names()
+        print(f'{self.qfile_name}: {len(names)} columns, {len(self.df.columns)} loaded (*)')
+        print(' '.join([f'{name}*' if name in self.df.columns else name for name in names]))
         self.df.info()
 
 if __name__ == '__main__':
@@ -65,4 +186,3 @@ if __name__ == '__main__':
         print('CLI example => python PandaPlotter.py --px ".." pyorbit_twiss_sizes_ekin.dat position emittX --y2 emittZ')
     else:
         PandaPlotter(args).do_plot(args)
-